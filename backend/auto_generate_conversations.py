@@ -1,7 +1,37 @@
+"""Generate synthetic Julie / town person conversations.
+
+Conversations are generated for a matrix of characters x seeds x
+repetitions. A bounded pool of workers simulates many conversations at
+once; every LLM request goes through the shared async client, which bounds
+concurrent requests (A2I2_LLM_MAX_CONNECTIONS) and can cap the request rate
+(--rate-limit / A2I2_LLM_RATE_LIMIT). Each finished conversation is
+appended to a JSON lines file as soon as it completes; the file is fsynced
+in batches and checkpointed in a manifest, so an interrupted job continues
+with --resume without regenerating finished conversations (see
+jsonl_output).
+
+The seed shuffles the example lines offered in each prompt, so different
+seeds give different (but reproducible) prompts for the same character.
+
+    python auto_generate_conversations.py
+    python auto_generate_conversations.py --seeds 0-99 --repetitions 2 --concurrency 32 --rate-limit 20
+    python auto_generate_conversations.py --output ../results/run1.jsonl --resume
+"""
+import argparse
+import asyncio
 import json
 import os
-from pathlib import Path
-from ollama_0220 import simulate_interactive_single_turn, conversation_manager, decision_making
+import random
+import time
+from itertools import product
+from typing import Dict, List, Optional, Tuple
+
+from ollama_0220 import (simulate_interactive_single_turn, simulate_interactive_single_turn_async,
+                         conversation_manager, decision_making, decision_making_async)
+from jsonl_output import JSONLWriter, RunManifest, start_job
+from llm_client import get_async_client
+from llm_metrics import llm_metrics
+from persona_policy import get_policy
 
 # Get base directory from environment variable or use default
 BASE_DIR = os.getenv('A2I2_BASE_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -9,7 +39,13 @@ BASE_DIR = os.getenv('A2I2_BASE_DIR', os.path.dirname(os.path.dirname(os.path.ab
 # Configure paths relative to base directory
 PERSONA_FILE_PATH = os.path.join("data_for_train/persona.json")
 DIAL_FILE_PATH = os.path.join("data_for_train/character_lines.jsonl")
-OUTPUT_FILE_PATH = os.path.join(BASE_DIR, "results/auto_generated_conversations.json")
+OUTPUT_FILE_PATH = os.path.join(BASE_DIR, "results/auto_generated_conversations.jsonl")
+
+# Town people to generate conversations for
+TOWN_PEOPLE = ["bob", "niki", "lindsay", "ross", "michelle"]
+
+# Up to 10 messages (5 exchanges between Julie and town person)
+MAX_MESSAGES = 10
 
 def load_json_file(file_path):
     """Load JSON file with error handling."""
@@ -32,96 +68,90 @@ def load_dialogue_data():
 
 def get_julie_category(message_count, town_person):
     """Determine Julie's category based on message count and town person."""
-    if message_count <= 1:
-        return "greetings"
-    elif message_count <= 5:
-        if town_person in ["bob", "michelle"]:
-            return "emphasize_danger"
-        else:
-            return "progression"
-    elif message_count <= 7:
-        return "progression"
-    elif message_count <= 9:
-        return "closing"
-    else:
-        return "closing"
+    return get_policy(town_person).julie_category(message_count) or "closing"
 
 def get_town_person_category(message_count, town_person):
     """Determine town person's category based on message count and character."""
-    if message_count <= 2:
-        return "greetings"
-    elif message_count <= 5:
-        if town_person == "bob":
-            return "work_resistance"
-        elif town_person == "niki":
-            return "observations"
-        elif town_person == "lindsay":
-            return "observations"
-        elif town_person == "ross":
-            return "response_to_operator_greetings"
-        elif town_person == "michelle":
-            return "response_to_operator_greetings"
+    return get_policy(town_person).auto_julie_category(message_count)
+
+def _shuffled(lines, rng: Optional[random.Random]):
+    return rng.sample(lines, len(lines)) if rng is not None and isinstance(lines, list) else lines
+
+def build_julie_turn(message_count, town_person, history, dialogue_data, rng=None) -> Dict:
+    """Julie's turn (speaker, prompt, category) for this point of the conversation."""
+    # Determine Julie's category
+    julie_category = get_julie_category(message_count, town_person)
+    julie_context = dialogue_data.get("julie", {}).get(julie_category, [])
+
+    # Fallback to general if category doesn't exist
+    if not julie_context:
+        julie_category = "general"
+        julie_context = dialogue_data.get("julie", {}).get("general", [])
+    julie_context = _shuffled(julie_context, rng)
+
+    # Create Julie's prompt
+    if julie_category == "closing":
+        julie_prompt_content = f"This conversation is now ending. Generate ONLY a brief goodbye message to {town_person} that clearly ends the conversation. Choose from these closing lines: {julie_context}. Do not ask any questions or continue the conversation."
     else:
-        if town_person == "bob":
-            return "minimal_engagement"
-        elif town_person == "michelle":
-            return "refuse_assistance"
-        else:
-            return "progression"
+        julie_prompt_content = f"Generate a message to respond to {town_person}. Use or adapt lines from this category: {julie_category}: {julie_context}."
+
+    return {
+        "speaker": "julie",
+        "prompt": f"You are roleplaying as Julie, an emergency evacuation virtual assistant.\nPrevious conversation:\n{history}\n{julie_prompt_content}\nKeep your response in one short sentence. Only generate utterances, no system messages.",
+        "category": julie_category
+    }
+
+def build_town_person_turn(message_count, town_person, history, julie_response, persona_data, dialogue_data, rng=None) -> Dict:
+    """The town person's reply turn to Julie's last message."""
+    town_person_category = get_town_person_category(message_count, town_person)
+    town_person_data = dialogue_data.get(town_person, {})
+    context = _shuffled(town_person_data.get(town_person_category, []), rng)
+
+    prompt_content = f"Generate a response to Julie's persuasive message. Use or adapt lines from this {town_person_category}: {context}."
+
+    return {
+        "speaker": town_person,
+        "prompt": f"You are roleplaying as {town_person}, \n{town_person}'s background: {persona_data[town_person]}\nPrevious conversation:\n{history}\n{prompt_content}\nJulie just said: {julie_response}\nPlease generate a response based on this message and keep your response natural and brief. Only generate utterances, no system messages.",
+        "category": town_person_category
+    }
+
+def _julie_persona(persona_data):
+    return persona_data.get("julie", "A virtual assistant specializing in emergency evacuations")
+
+def _wants_decision(history) -> bool:
+    """Decisions are asked for once the conversation has a few lines."""
+    return bool(history) and len(history.split('\n')) >= 3
 
 def generate_conversation(town_person, persona_data, dialogue_data):
     """Generate a conversation between Julie and a town person."""
     # Use a unique session ID with timestamp to avoid conflicts
-    import time
     session_id = f"{town_person}_auto_session_{int(time.time())}"
     conversation_history = []
     decision_responses = []
-    
+
     print(f"Generating conversation for {town_person}...")
-    
-    # Generate up to 10 messages (5 exchanges between Julie and town person)
-    for message_count in range(1, 11):
+
+    for message_count in range(1, MAX_MESSAGES + 1):
         print(f"Message {message_count}")
-        
+
         # Get conversation history
         history = conversation_manager.get_history(session_id, max_turns=11)
-        
-        # Determine Julie's category
-        julie_category = get_julie_category(message_count, town_person)
-        julie_context = dialogue_data.get("julie", {}).get(julie_category, [])
-        
-        # Fallback to general if category doesn't exist
-        if not julie_context:
-            julie_category = "general"
-            julie_context = dialogue_data.get("julie", {}).get("general", [])
-        
-        # Create Julie's prompt
-        if julie_category == "closing":
-            julie_prompt_content = f"This conversation is now ending. Generate ONLY a brief goodbye message to {town_person} that clearly ends the conversation. Choose from these closing lines: {julie_context}. Do not ask any questions or continue the conversation."
-        else:
-            julie_prompt_content = f"Generate a message to respond to {town_person}. Use or adapt lines from this category: {julie_category}: {julie_context}."
-        
+
         # Configure Julie's turn
-        julie_turn = {
-            "speaker": "julie",
-            "prompt": f"You are roleplaying as Julie, an emergency evacuation virtual assistant.\nPrevious conversation:\n{history}\n{julie_prompt_content}\nKeep your response in one short sentence. Only generate utterances, no system messages.",
-            "category": julie_category
-        }
-        
+        julie_turn = build_julie_turn(message_count, town_person, history, dialogue_data)
+        julie_category = julie_turn["category"]
+
         try:
             # Generate Julie's response
             julie_response, julie_retrieved_info = simulate_interactive_single_turn(
                 "julie",
                 "",
                 speaker="Julie",
-                persona=persona_data.get("julie", "A virtual assistant specializing in emergency evacuations"),
+                persona=_julie_persona(persona_data),
                 turn=julie_turn,
                 session_id=session_id
             )
-            
-            # Add Julie's message to history
-            # conversation_manager.add_message(session_id, "Julie", julie_response)
-            
+
             # Record Julie's message
             conversation_history.append({
                 "speaker": "Julie",
@@ -129,26 +159,16 @@ def generate_conversation(town_person, persona_data, dialogue_data):
                 "category": julie_category,
                 "retrieved_info": julie_retrieved_info
             })
-            
+
             print(f"Julie: {julie_response}")
-            
+
             # Check if conversation should end
             if julie_category == "closing":
                 break
-            
-            # Generate town person's response
-            town_person_category = get_town_person_category(message_count, town_person)
-            town_person_data = dialogue_data.get(town_person, {})
-            context = town_person_data.get(town_person_category, [])
-            
-            prompt_content = f"Generate a response to Julie's persuasive message. Use or adapt lines from this {town_person_category}: {context}."
-            
-            town_person_turn = {
-                "speaker": town_person,
-                "prompt": f"You are roleplaying as {town_person}, \n{town_person}'s background: {persona_data[town_person]}\nPrevious conversation:\n{history}\n{prompt_content}\nJulie just said: {julie_response}\nPlease generate a response based on this message and keep your response natural and brief. Only generate utterances, no system messages.",
-                "category": town_person_category
-            }
-            
+
+            town_person_turn = build_town_person_turn(message_count, town_person, history, julie_response,
+                                                      persona_data, dialogue_data)
+
             # Generate town person's response
             response, retrieved_info = simulate_interactive_single_turn(
                 town_person,
@@ -158,34 +178,31 @@ def generate_conversation(town_person, persona_data, dialogue_data):
                 turn=town_person_turn,
                 session_id=session_id
             )
-            
-            # Add town person's response to history
-            # conversation_manager.add_message(session_id, town_person, response)
-            
+
             # Record town person's message
             conversation_history.append({
                 "speaker": town_person,
                 "message": response,
-                "category": town_person_category,
+                "category": town_person_turn["category"],
                 "retrieved_info": retrieved_info
             })
-            
+
             print(f"{town_person}: {response}")
-            
+
             # Get decision response if we have enough messages
             updated_history = conversation_manager.get_history(session_id, max_turns=9)
-            if updated_history and len(updated_history.split('\n')) >= 3:
+            if _wants_decision(updated_history):
                 decision_response = decision_making(updated_history, town_person)
                 if decision_response:
                     decision_responses.append({
                         "message_count": message_count,
                         "decision": decision_response
                     })
-            
+
         except Exception as e:
             print(f"Error generating message {message_count} for {town_person}: {str(e)}")
             break
-    
+
     return {
         "town_person": town_person,
         "conversation_history": conversation_history,
@@ -193,48 +210,197 @@ def generate_conversation(town_person, persona_data, dialogue_data):
         "total_messages": len(conversation_history)
     }
 
+async def generate_conversation_async(town_person, persona_data, dialogue_data, seed=None, session_id=None):
+    """Async variant of generate_conversation, for running many conversations at once.
+
+    With a ``seed`` the example lines in each prompt are shuffled
+    reproducibly. Returns the same fields as generate_conversation, plus
+    ``error`` if a message could not be generated.
+    """
+    session_id = session_id or f"{town_person}_auto_session_{time.time_ns()}"
+    rng = random.Random(seed) if seed is not None else None
+    conversation_history = []
+    decision_responses = []
+    error = None
+
+    try:
+        for message_count in range(1, MAX_MESSAGES + 1):
+            history = conversation_manager.get_history(session_id, max_turns=11)
+            julie_turn = build_julie_turn(message_count, town_person, history, dialogue_data, rng)
+            try:
+                julie_response, julie_retrieved_info = await simulate_interactive_single_turn_async(
+                    "julie", "", speaker="Julie", persona=_julie_persona(persona_data),
+                    turn=julie_turn, session_id=session_id)
+                conversation_history.append({
+                    "speaker": "Julie",
+                    "message": julie_response,
+                    "category": julie_turn["category"],
+                    "retrieved_info": julie_retrieved_info
+                })
+                if julie_turn["category"] == "closing":
+                    break
+
+                town_person_turn = build_town_person_turn(message_count, town_person, history, julie_response,
+                                                          persona_data, dialogue_data, rng)
+                response, retrieved_info = await simulate_interactive_single_turn_async(
+                    town_person, julie_response, speaker="Julie", persona=persona_data[town_person],
+                    turn=town_person_turn, session_id=session_id)
+                conversation_history.append({
+                    "speaker": town_person,
+                    "message": response,
+                    "category": town_person_turn["category"],
+                    "retrieved_info": retrieved_info
+                })
+
+                updated_history = conversation_manager.get_history(session_id, max_turns=9)
+                if _wants_decision(updated_history):
+                    decision_response = await decision_making_async(updated_history, town_person)
+                    if decision_response:
+                        decision_responses.append({
+                            "message_count": message_count,
+                            "decision": decision_response
+                        })
+            except Exception as e:
+                error = f"message {message_count}: {str(e)}"
+                break
+    finally:
+        # Batch runs create thousands of sessions; drop each one when done
+        conversation_manager.end_session(session_id)
+
+    result = {
+        "town_person": town_person,
+        "conversation_history": conversation_history,
+        "decision_responses": decision_responses,
+        "total_messages": len(conversation_history)
+    }
+    if error is not None:
+        result["error"] = error
+    return result
+
+def parse_seeds(spec: str) -> List[int]:
+    """Parse "0-9", "1,5,7" or a mix of both into a list of seeds."""
+    seeds = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            low, high = part.split("-", 1)
+            seeds.extend(range(int(low), int(high) + 1))
+        else:
+            seeds.append(int(part))
+    return seeds
+
+def build_jobs(town_people: List[str], seeds: List[int], repetitions: int) -> List[Tuple[str, int, int]]:
+    """Every (town_person, seed, repetition), with characters interleaved."""
+    return [(town_person, seed, repetition)
+            for seed, repetition, town_person in product(seeds, range(repetitions), town_people)]
+
+def job_id(town_person: str, seed: int, repetition: int) -> str:
+    return f"{town_person}-s{seed}-r{repetition}"
+
+class BatchRunner:
+    """Simulates a list of jobs with a bounded pool of workers, streaming results to a JSONL writer."""
+
+    def __init__(self, persona_data, dialogue_data, writer: JSONLWriter, manifest: RunManifest, concurrency: int = 8):
+        self.persona_data = persona_data
+        self.dialogue_data = dialogue_data
+        self.writer = writer
+        self.manifest = manifest
+        self.concurrency = max(1, concurrency)
+        self.completed = 0
+        self.errors = 0
+        self.messages = 0
+
+    async def run(self, jobs: List[Tuple[str, int, int]]):
+        queue: "asyncio.Queue" = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+        workers = [asyncio.create_task(self._worker(queue, len(jobs)))
+                   for _ in range(min(self.concurrency, len(jobs)))]
+        await asyncio.gather(*workers)
+
+    async def _worker(self, queue: "asyncio.Queue", total: int):
+        while True:
+            try:
+                town_person, seed, repetition = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            record_id = job_id(town_person, seed, repetition)
+            start = time.perf_counter()
+            result = await generate_conversation_async(
+                town_person, self.persona_data, self.dialogue_data, seed=seed,
+                session_id=f"{town_person}_batch_{seed}_{repetition}_{time.time_ns()}")
+
+            self.completed += 1
+            if "error" in result:
+                # Not written, so a resumed run retries it
+                self.errors += 1
+                self.manifest.mark_failed(record_id, result["error"])
+                print(f"[{self.completed}/{total}] {record_id}: error: {result['error']}")
+                continue
+            self.writer.write({"id": record_id, "seed": seed, "repetition": repetition,
+                               "seconds": round(time.perf_counter() - start, 3), **result})
+            self.messages += result["total_messages"]
+            print(f"[{self.completed}/{total}] {record_id}: {result['total_messages']} messages")
+
 def main():
-    """Main function to generate conversations for all town people."""
+    """Generate conversations for every (town person, seed, repetition) in the matrix."""
+    parser = argparse.ArgumentParser(description="Generate synthetic Julie / town person conversations.")
+    parser.add_argument("--characters", default=",".join(TOWN_PEOPLE), help="Comma-separated town people")
+    parser.add_argument("--seeds", default="0", help='Seeds, e.g. "0-99" or "1,2,3"')
+    parser.add_argument("--repetitions", type=int, default=1, help="Conversations per character and seed")
+    parser.add_argument("--concurrency", type=int, default=8, help="Conversations simulated at once")
+    parser.add_argument("--rate-limit", type=float, help="Max LLM requests per second (default A2I2_LLM_RATE_LIMIT)")
+    parser.add_argument("--output", default=OUTPUT_FILE_PATH, help="JSON lines file conversations are appended to")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the job writing to --output, skipping finished conversations")
+    parser.add_argument("--fsync-every", type=int, default=16, help="Fsync the output every N conversations")
+    args = parser.parse_args()
+
+    config = {"characters": args.characters, "seeds": args.seeds, "repetitions": args.repetitions}
+    try:
+        manifest = start_job(args.output, config, resume=args.resume)
+    except FileExistsError as e:
+        parser.error(str(e))
+    # A resumed job keeps the matrix it was started with
+    config = manifest.config
+
     # Load data
     persona_data = load_json_file(PERSONA_FILE_PATH)
     dialogue_data = load_dialogue_data()
-    
-    # Town people to generate conversations for
-    town_people = ["bob", "niki", "lindsay", "ross", "michelle"]
-    
-    all_conversations = []
-    
-    for town_person in town_people:
-        print(f"\n{'='*50}")
-        print(f"Generating conversation for {town_person}")
-        print(f"{'='*50}")
-        
-        conversation_result = generate_conversation(town_person, persona_data, dialogue_data)
-        all_conversations.append(conversation_result)
-        
-        print(f"Generated {conversation_result['total_messages']} messages for {town_person}")
-    
-    # Save results to JSON file
-    output_data = {
-        "generated_at": str(Path(__file__).stat().st_mtime),
-        "total_conversations": len(all_conversations),
-        "conversations": all_conversations
-    }
-    
-    # Ensure output directory exists
-    os.makedirs(os.path.dirname(OUTPUT_FILE_PATH), exist_ok=True)
-    
-    with open(OUTPUT_FILE_PATH, 'w') as f:
-        json.dump(output_data, f, indent=2)
-    
+
+    town_people = [name.strip() for name in config["characters"].split(",") if name.strip()]
+    unknown = [name for name in town_people if name not in persona_data]
+    if unknown:
+        parser.error(f"Unknown characters: {', '.join(unknown)}")
+    all_jobs = build_jobs(town_people, parse_seeds(config["seeds"]), config["repetitions"])
+    jobs = [job for job in all_jobs if job_id(*job) not in manifest.completed]
+    manifest.total = len(all_jobs)
+    manifest.save()
+    if args.rate_limit is not None:
+        get_async_client().rate_limiter.rate = args.rate_limit
+
+    print(f"Generating {len(jobs)} conversations ({len(all_jobs) - len(jobs)} already done, "
+          f"{args.concurrency} at a time)")
+    start = time.perf_counter()
+    with JSONLWriter(args.output, fsync_every=args.fsync_every, on_sync=manifest.mark_completed) as writer:
+        runner = BatchRunner(persona_data, dialogue_data, writer, manifest, concurrency=args.concurrency)
+        try:
+            asyncio.run(runner.run(jobs))
+        except KeyboardInterrupt:
+            print("Interrupted; run again with --resume to continue")
+    manifest.finish()
+    seconds = time.perf_counter() - start
+
+    totals = llm_metrics.snapshot()["totals"]
     print(f"\n{'='*50}")
-    print(f"Generated {len(all_conversations)} conversations")
-    print(f"Results saved to: {OUTPUT_FILE_PATH}")
+    print(f"Generated {runner.completed - runner.errors} conversations ({runner.messages} messages, "
+          f"{runner.errors} failed) in {seconds:.1f}s, {runner.completed / seconds if seconds else 0:.2f} conversations/s")
+    print(f"LLM calls: {totals['calls']}, tokens: {totals['prompt_tokens'] + totals['completion_tokens']}")
+    print(f"Results appended to: {args.output} ({len(manifest.completed)}/{manifest.total} done, "
+          f"manifest: {manifest.path})")
     print(f"{'='*50}")
-    
-    # Print summary
-    for conv in all_conversations:
-        print(f"{conv['town_person']}: {conv['total_messages']} messages, {len(conv['decision_responses'])} decisions")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
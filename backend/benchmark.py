@@ -0,0 +1,265 @@
+"""Load test and latency benchmark for the /chat endpoint.
+
+N simulated trainees talk to every character at once, one mode at a time:
+
+    interactive  the trainee types operator lines, one /chat request per turn
+    auto_julie   Julie talks to the character, one /chat request per round
+    auto         one /chat request generates a whole dual-role conversation
+
+For each mode the report has requests/s, p50/p95/p99 latency, and the LLM
+calls and tokens per request. The report is written as JSON, so two commits
+can be compared with ``--compare``.
+
+By default the server runs in this process with the fake LLM backend, so no
+network or API key is needed and numbers are reproducible:
+
+    python benchmark.py --trainees 20 --turns 5 --output bench.json
+    python benchmark.py --llm-latency uniform:0.2,0.8 --compare bench.json
+
+LLM usage comes from the server's /metrics. ``--url`` drives a running
+server instead; ``--fake-url`` reads usage from a fake LLM server (see
+fake_llm) rather than the server's own metrics.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+MODES = ("interactive", "auto_julie", "auto")
+PERSONA_FILE_PATH = os.path.join("data_for_train/persona.json")
+
+# Lines the simulated trainees type in interactive mode, in turn
+OPERATOR_LINES = [
+    "Hello, this is the fire department. There is a wildfire coming toward your area.",
+    "You need to evacuate now, the fire is spreading fast.",
+    "Is anyone else at home with you?",
+    "Your life is more important than your belongings.",
+    "Please leave now and head to the evacuation center downtown.",
+    "Thank you, stay safe and goodbye.",
+]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def characters() -> List[str]:
+    """Every town person the trainees can talk to (Julie is the assistant)."""
+    with open(PERSONA_FILE_PATH, "r") as f:
+        return [name for name in json.load(f) if name != "julie"]
+
+
+def request_body(mode: str, character: str, session_id: str, turn: int) -> Dict:
+    if mode == "interactive":
+        return {"townPerson": character, "userInput": OPERATOR_LINES[turn % len(OPERATOR_LINES)],
+                "mode": "interactive", "speaker": "Operator", "sessionId": session_id}
+    if mode == "auto_julie":
+        return {"townPerson": character, "userInput": "", "mode": "interactive", "speaker": "Julie",
+                "autoJulie": True, "sessionId": session_id}
+    return {"townPerson": character, "mode": "auto", "sessionId": session_id}
+
+
+class Benchmark:
+    """Runs the trainees against one server and collects per-mode results."""
+
+    def __init__(self, client: httpx.AsyncClient, usage, trainees: int, turns: int, characters: List[str]):
+        self.client = client
+        self.usage = usage
+        self.trainees = trainees
+        self.turns = turns
+        self.characters = characters
+
+    async def trainee(self, mode: str, index: int, latencies: List[float], errors: List[str]):
+        character = self.characters[index % len(self.characters)]
+        session_id = f"bench-{mode}-{index}-{int(time.time())}"
+        # Auto mode produces a whole conversation per request
+        turns = 1 if mode == "auto" else self.turns
+        for turn in range(turns):
+            data = {}
+            start = time.perf_counter()
+            try:
+                response = await self.client.post("/chat", json=request_body(mode, character, session_id, turn))
+                data = response.json()
+                if response.status_code != 200 or "error" in data:
+                    errors.append(f"{character}: {data.get('error', response.status_code)}")
+            except (httpx.HTTPError, ValueError) as e:
+                errors.append(f"{character}: {e}")
+            latencies.append(time.perf_counter() - start)
+            if mode == "auto_julie" and data.get("conversation_ended"):
+                break
+        try:
+            await self.client.delete(f"/session/{session_id}")
+        except httpx.HTTPError:
+            pass
+
+    async def run_mode(self, mode: str) -> Dict:
+        latencies: List[float] = []
+        errors: List[str] = []
+        usage_before = await self.usage()
+        start = time.perf_counter()
+        await asyncio.gather(*(self.trainee(mode, i, latencies, errors) for i in range(self.trainees)))
+        seconds = time.perf_counter() - start
+        usage_after = await self.usage()
+
+        latencies.sort()
+        requests = len(latencies)
+        result = {
+            "requests": requests,
+            "errors": len(errors),
+            "seconds": round(seconds, 3),
+            "requests_per_second": round(requests / seconds, 2) if seconds else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 1),
+                "p95": round(percentile(latencies, 0.95) * 1000, 1),
+                "p99": round(percentile(latencies, 0.99) * 1000, 1),
+                "mean": round(sum(latencies) / requests * 1000, 1) if requests else 0.0,
+                "max": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+            },
+            "llm_calls_per_request": None,
+            "tokens_per_request": None,
+        }
+        if usage_before is not None and usage_after is not None and requests:
+            calls = usage_after["calls"] - usage_before["calls"]
+            tokens = (usage_after["prompt_tokens"] + usage_after["completion_tokens"]
+                      - usage_before["prompt_tokens"] - usage_before["completion_tokens"])
+            result["llm_calls_per_request"] = round(calls / requests, 2)
+            result["tokens_per_request"] = round(tokens / requests, 1)
+        if errors:
+            result["sample_errors"] = errors[:5]
+        return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_in_process(args, modes: List[str], names: List[str]) -> Dict[str, Dict]:
+    """Start the server app in this process (with its startup/shutdown hooks) and benchmark it."""
+    import server
+    from llm_metrics import llm_metrics
+
+    async def usage():
+        return llm_metrics.snapshot()["totals"]
+
+    await server.startup()
+    try:
+        while not server.warmup_state["ready"]:
+            await asyncio.sleep(0.05)
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost", timeout=args.timeout) as client:
+            bench = Benchmark(client, usage, args.trainees, args.turns, names)
+            return {mode: await bench.run_mode(mode) for mode in modes}
+    finally:
+        await server.shutdown()
+
+
+async def run_remote(args, modes: List[str], names: List[str]) -> Dict[str, Dict]:
+    """Benchmark a server that is already running at ``args.url``."""
+    limits = httpx.Limits(max_connections=args.trainees, max_keepalive_connections=args.trainees)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        async def usage():
+            if args.fake_url:
+                response = await client.get(f"{args.fake_url.rstrip('/')}/usage")
+                return response.json()
+            response = await client.get("/metrics")
+            return response.json()["totals"] if response.status_code == 200 else None
+
+        bench = Benchmark(client, usage, args.trainees, args.turns, names)
+        return {mode: await bench.run_mode(mode) for mode in modes}
+
+
+def print_report(report: Dict, baseline: Optional[Dict] = None):
+    print(f"\n{'mode':<12} {'req':>6} {'err':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'calls/req':>10} {'tokens/req':>11}")
+    for mode, result in report["modes"].items():
+        latency = result["latency_ms"]
+        print(f"{mode:<12} {result['requests']:>6} {result['errors']:>5} {result['requests_per_second']:>8} "
+              f"{latency['p50']:>9} {latency['p95']:>9} {latency['p99']:>9} "
+              f"{str(result['llm_calls_per_request']):>10} {str(result['tokens_per_request']):>11}")
+        previous = (baseline or {}).get("modes", {}).get(mode)
+        if previous:
+            def change(new, old):
+                return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"{'  vs base':<12} {'':>6} {'':>5} "
+                  f"{change(result['requests_per_second'], previous['requests_per_second']):>8} "
+                  f"{change(latency['p50'], previous['latency_ms']['p50']):>9} "
+                  f"{change(latency['p95'], previous['latency_ms']['p95']):>9} "
+                  f"{change(latency['p99'], previous['latency_ms']['p99']):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /chat with simulated trainees.")
+    parser.add_argument("--trainees", type=int, default=10, help="Concurrent simulated trainees per mode")
+    parser.add_argument("--turns", type=int, default=5, help="Requests per trainee (auto mode always sends one)")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"Comma-separated modes ({', '.join(MODES)})")
+    parser.add_argument("--characters", default="all", help="Comma-separated characters, or all")
+    parser.add_argument("--url", help="Benchmark a running server instead of an in-process one")
+    parser.add_argument("--fake-url", help="Fake LLM server to read usage from when using --url")
+    parser.add_argument("--llm-latency", help="In-process fake LLM latency, e.g. uniform:0.2,0.8 (see fake_llm)")
+    parser.add_argument("--llm-tokens-per-second", type=float, help="In-process fake LLM token rate")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--output", default="benchmark.json", help="Where to write the JSON report")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"Unknown modes: {', '.join(unknown)}")
+    names = characters() if args.characters == "all" else [name.strip() for name in args.characters.split(",")]
+
+    if not args.url:
+        # Configure the in-process server before it is imported
+        os.environ.setdefault("A2I2_LLM_BACKEND", "fake")
+        if args.llm_latency:
+            os.environ["A2I2_FAKE_LLM_LATENCY"] = args.llm_latency
+        if args.llm_tokens_per_second is not None:
+            os.environ["A2I2_FAKE_LLM_TOKENS_PER_SECOND"] = str(args.llm_tokens_per_second)
+        results = asyncio.run(run_in_process(args, modes, names))
+    else:
+        results = asyncio.run(run_remote(args, modes, names))
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "commit": git_commit(),
+        "config": {
+            "trainees": args.trainees,
+            "turns": args.turns,
+            "characters": names,
+            "url": args.url,
+            "llm_backend": None if args.url else os.environ.get("A2I2_LLM_BACKEND"),
+            "llm_latency": os.environ.get("A2I2_FAKE_LLM_LATENCY", "fixed:0"),
+            "llm_tokens_per_second": float(os.environ.get("A2I2_FAKE_LLM_TOKENS_PER_SECOND", "0")),
+        },
+        "modes": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f"\nReport written to {args.output}")
+    if any(result["errors"] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""On-disk cache for dialogue line embeddings and their FAISS indexes.
+
+Encoding every dialogue line on each process start is the slowest part of
+building the retrieval index. This cache keeps:
+
+* one float32 matrix of line vectors per encoder (``<encoder>.vectors.npy``,
+  rows looked up by a hash of the line in ``<encoder>.keys.json``), so only
+  new or edited lines are ever encoded;
+* the built indexes for each set of dialogue files, in a directory named by
+  a hash of the files' content and the encoder name.
+
+Both are memory-mapped on load, so workers on one host share a single copy
+in the page cache. Files are replaced atomically, so concurrent workers never
+read a partial write. faiss is only imported on first use.
+
+Configuration (environment variables):
+    A2I2_EMBEDDING_CACHE_DIR  cache directory (default embedding_cache; empty disables)
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from log_config import get_logger
+
+if TYPE_CHECKING:
+    import faiss
+
+logger = get_logger("embedding_cache")
+
+EMBEDDING_CACHE_DIR = os.getenv("A2I2_EMBEDDING_CACHE_DIR", "embedding_cache")
+
+def _line_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _replace_atomically(path: str, write: Callable[[str], None]):
+    """Write to a temporary file next to ``path`` and rename it into place."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_npy(array: np.ndarray) -> Callable[[str], None]:
+    def write(path):
+        with open(path, "wb") as f:
+            np.save(f, array)
+    return write
+
+
+def _write_json(data) -> Callable[[str], None]:
+    def write(path):
+        with open(path, "w") as f:
+            json.dump(data, f)
+    return write
+
+
+class EmbeddingCache:
+    """Line vectors and built indexes for one encoder, persisted under ``directory``."""
+
+    def __init__(self, directory: str = EMBEDDING_CACHE_DIR, encoder_name: str = "all-MiniLM-L6-v2"):
+        self.directory = directory
+        self.encoder_name = encoder_name
+        self._slug = encoder_name.replace("/", "_")
+        self._lock = threading.Lock()
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.directory, f"{self._slug}.vectors.npy")
+
+    @property
+    def _keys_path(self) -> str:
+        return os.path.join(self.directory, f"{self._slug}.keys.json")
+
+    def source_key(self, paths: Sequence[str]) -> str:
+        """Hash of the dialogue files' content and the encoder name."""
+        digest = hashlib.sha1(self.encoder_name.encode("utf-8"))
+        for path in paths:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()[:16]
+
+    def embed(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Vectors for ``texts``, encoding only lines not cached yet."""
+        with self._lock:
+            keys, vectors = self._load_vectors()
+            rows = {key: row for row, key in enumerate(keys)}
+            missing = list(dict.fromkeys(text for text in texts if _line_key(text) not in rows))
+            if missing:
+                new_vectors = encode(missing)
+                vectors = new_vectors if vectors is None else np.concatenate([vectors, new_vectors])
+                for text in missing:
+                    rows[_line_key(text)] = len(keys)
+                    keys.append(_line_key(text))
+                self._save_vectors(keys, vectors)
+                logger.info(f"Encoded {len(missing)} new dialogue lines ({len(texts) - len(missing)} cached)")
+            return np.ascontiguousarray(vectors[[rows[_line_key(text)] for text in texts]], dtype=np.float32)
+
+    def _load_vectors(self) -> Tuple[List[str], Optional[np.ndarray]]:
+        try:
+            with open(self._keys_path, "r") as f:
+                keys = json.load(f)
+            vectors = np.load(self._vectors_path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            if os.path.exists(self._keys_path):
+                logger.warning(f"Ignoring unreadable embedding cache in {self.directory}: {e}")
+            return [], None
+        if len(keys) != len(vectors):
+            logger.warning(f"Embedding cache keys and vectors disagree in {self.directory}; re-encoding")
+            return [], None
+        return keys, vectors
+
+    def _save_vectors(self, keys: List[str], vectors: np.ndarray):
+        os.makedirs(self.directory, exist_ok=True)
+        # Vectors first: a keys file never refers to rows that are not there
+        _replace_atomically(self._vectors_path, _write_npy(vectors))
+        _replace_atomically(self._keys_path, _write_json(keys))
+
+    def load_indexes(self, source_key: str) -> Optional[Dict[str, Tuple["faiss.Index", List[Tuple[str, str]]]]]:
+        """The partitions saved for ``source_key``, or None if there are none."""
+        index_dir = os.path.join(self.directory, source_key)
+        try:
+            with open(os.path.join(index_dir, "manifest.json"), "r") as f:
+                manifest = json.load(f)
+            import faiss
+            # Memory-map the flat codes where this faiss supports it
+            mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+            partitions = {}
+            for name, entries in manifest.items():
+                index = faiss.read_index(os.path.join(index_dir, f"{name}.faiss"), mmap_flag)
+                partitions[name] = (index, [tuple(entry) for entry in entries])
+        except (OSError, ValueError, RuntimeError) as e:
+            if os.path.isdir(index_dir):
+                logger.warning(f"Ignoring unreadable index cache {index_dir}: {e}")
+            return None
+        return partitions
+
+    def save_indexes(self, source_key: str, partitions: Dict[str, Tuple["faiss.Index", List[Tuple[str, str]]]]):
+        """Persist built partitions under ``source_key``."""
+        import faiss
+        index_dir = os.path.join(self.directory, source_key)
+        os.makedirs(index_dir, exist_ok=True)
+        for name, (index, _) in partitions.items():
+            _replace_atomically(os.path.join(index_dir, f"{name}.faiss"),
+                                lambda path: faiss.write_index(index, path))
+        # The manifest goes last; its presence marks the directory complete
+        manifest = {name: entries for name, (_, entries) in partitions.items()}
+        _replace_atomically(os.path.join(index_dir, "manifest.json"), _write_json(manifest))
+
+
+def default_embedding_cache(encoder_name: str) -> Optional[EmbeddingCache]:
+    """The configured cache for an encoder, or None if caching is disabled."""
+    if not EMBEDDING_CACHE_DIR:
+        return None
+    return EmbeddingCache(EMBEDDING_CACHE_DIR, encoder_name)
@@ -0,0 +1,279 @@
+"""Deterministic stand-in LLM for offline runs and load tests.
+
+The same prompt always gets the same reply and the same simulated latency,
+so throughput numbers are reproducible without network access or an API key.
+
+Two ways to use it:
+
+* in-process: ``A2I2_LLM_BACKEND=fake`` makes the engine and the server
+  answer from ``FakeLLM`` directly (see llm_backends);
+* over HTTP: ``python fake_llm.py --port 8100`` serves an OpenAI-compatible
+  ``/v1/chat/completions`` (including ``stream=true``); point the openai
+  backend at it with ``OPENAI_BASE_URL=http://localhost:8100/v1`` and any
+  ``OPENAI_API_KEY``. ``GET /usage`` reports the calls and tokens served.
+
+Classifier prompts (JSON mode) get "no" for every label and yes/no check
+prompts get "no", unless answers are configured, e.g.
+``evacuation_decision=yes`` to make simulated town people agree to leave.
+
+Configuration (environment variables, also the CLI defaults):
+    A2I2_FAKE_LLM_LATENCY            time to first token: "fixed:S", "uniform:LOW,HIGH",
+                                     "lognormal:MU,SIGMA" or "exponential:MEAN" (default fixed:0)
+    A2I2_FAKE_LLM_TOKENS_PER_SECOND  generation speed after the first token (default 0, instant)
+    A2I2_FAKE_LLM_ANSWERS            canned answers, e.g. "evacuation_decision=yes,mentions_fire=yes"
+    A2I2_FAKE_LLM_SEED               seed for the simulated latencies (default 0)
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+LATENCY_DISTRIBUTIONS = {
+    "fixed": 1,
+    "uniform": 2,
+    "lognormal": 2,
+    "exponential": 1,
+}
+
+# Canned operator/town person lines the fake model picks from
+FAKE_REPLIES = [
+    "There is a fire approaching your area and you need to evacuate now.",
+    "I understand. Can you tell me who else is at home with you?",
+    "Please take only what you need and head to the evacuation center.",
+    "The roads to the north are still open, so leave as soon as you can.",
+    "I hear you, but your safety matters more than the house right now.",
+    "Okay, I will get ready to leave. Where should I go?",
+]
+_LABEL_LINE = re.compile(r"^- (\w+):", re.MULTILINE)
+CHECK_PROMPT_MARKER = "respond with 'yes' or 'no'"
+
+
+def parse_latency(spec: str) -> Tuple[str, Tuple[float, ...]]:
+    """Parse "name:a,b" into a distribution name and its parameters."""
+    name, _, params = spec.partition(":")
+    name = name.strip().lower()
+    if name not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(f"Unknown latency distribution: {name} "
+                         f"(expected one of {', '.join(LATENCY_DISTRIBUTIONS)})")
+    values = tuple(float(value) for value in params.split(",") if value.strip())
+    if len(values) != LATENCY_DISTRIBUTIONS[name]:
+        raise ValueError(f"Latency distribution {name} takes {LATENCY_DISTRIBUTIONS[name]} parameter(s): {spec}")
+    return name, values
+
+
+def parse_answers(spec: str) -> Dict[str, str]:
+    """Parse "label=yes,other=no" into a dict of canned answers."""
+    answers = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        label, _, answer = item.partition("=")
+        answer = answer.strip().lower()
+        if answer not in ("yes", "no"):
+            raise ValueError(f"Canned answers must be yes or no: {item}")
+        answers[label.strip()] = answer
+    return answers
+
+
+def count_tokens(text: str) -> int:
+    """Rough token count (whitespace-separated words)."""
+    return len(text.split())
+
+
+class FakeLLM:
+    """A deterministic chat model with simulated latency."""
+
+    def __init__(self, latency: str = "fixed:0", tokens_per_second: float = 0.0,
+                 answers: Optional[Dict[str, str]] = None, seed: int = 0):
+        self.latency = parse_latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.answers = dict(answers or {})
+        self.seed = seed
+        self._usage_lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @classmethod
+    def from_env(cls) -> "FakeLLM":
+        return cls(
+            latency=os.getenv("A2I2_FAKE_LLM_LATENCY", "fixed:0"),
+            tokens_per_second=float(os.getenv("A2I2_FAKE_LLM_TOKENS_PER_SECOND", "0")),
+            answers=parse_answers(os.getenv("A2I2_FAKE_LLM_ANSWERS", "")),
+            seed=int(os.getenv("A2I2_FAKE_LLM_SEED", "0")),
+        )
+
+    @staticmethod
+    def _digest(prompt: str) -> int:
+        return int(hashlib.sha1(prompt.encode("utf-8")).hexdigest(), 16)
+
+    def reply(self, prompt: str, response_format: Optional[Dict] = None, max_tokens: int = 500) -> str:
+        """The reply to ``prompt``; the same prompt always gets the same answer.
+
+        Every call is counted in the usage totals.
+        """
+        if response_format is not None and response_format.get("type") == "json_object":
+            reply = json.dumps({label: self.answers.get(label, "no") for label in _LABEL_LINE.findall(prompt)})
+        elif CHECK_PROMPT_MARKER in prompt:
+            reply = self.answers.get("check", "no")
+        else:
+            reply = FAKE_REPLIES[self._digest(prompt) % len(FAKE_REPLIES)]
+            reply = " ".join(reply.split()[:max_tokens])
+        with self._usage_lock:
+            self.calls += 1
+            self.prompt_tokens += count_tokens(prompt)
+            self.completion_tokens += count_tokens(reply)
+        return reply
+
+    def usage(self) -> Dict[str, int]:
+        """Calls and tokens answered so far."""
+        with self._usage_lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+
+    def first_token_delay(self, prompt: str) -> float:
+        """Simulated seconds before the first token, drawn per (seed, prompt)."""
+        name, params = self.latency
+        if name == "fixed":
+            return params[0]
+        rng = random.Random(self.seed * 1000003 + self._digest(prompt))
+        if name == "uniform":
+            return rng.uniform(*params)
+        if name == "lognormal":
+            return rng.lognormvariate(*params)
+        return rng.expovariate(1.0 / params[0]) if params[0] > 0 else 0.0
+
+    @property
+    def token_delay(self) -> float:
+        """Simulated seconds per generated token after the first."""
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def delay(self, prompt: str, reply: str) -> float:
+        """Total simulated seconds to generate ``reply``."""
+        return self.first_token_delay(prompt) + self.token_delay * max(0, count_tokens(reply) - 1)
+
+    def pieces(self, reply: str) -> List[str]:
+        """``reply`` split into streamed token pieces that join back to it."""
+        return [word if i == 0 else " " + word for i, word in enumerate(reply.split(" "))]
+
+    def complete(self, prompt: str, response_format: Optional[Dict] = None, max_tokens: int = 500) -> str:
+        """Blocking call: sleep for the simulated latency, then reply."""
+        reply = self.reply(prompt, response_format, max_tokens)
+        delay = self.delay(prompt, reply)
+        if delay > 0:
+            time.sleep(delay)
+        return reply
+
+
+def _completion_id(prompt: str) -> str:
+    return "chatcmpl-fake-" + hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def create_app(llm: FakeLLM):
+    """An OpenAI-compatible FastAPI app answering from ``llm``."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI(title="Fake LLM")
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "fake", "object": "model", "owned_by": "a2i2"}]}
+
+    @app.get("/usage")
+    async def usage():
+        return llm.usage()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        model = body.get("model", "fake")
+        reply = llm.reply(prompt, body.get("response_format"), int(body.get("max_tokens") or 500))
+        created = int(time.time())
+        completion_id = _completion_id(prompt)
+        usage = {
+            "prompt_tokens": count_tokens(prompt),
+            "completion_tokens": count_tokens(reply),
+            "total_tokens": count_tokens(prompt) + count_tokens(reply),
+        }
+
+        if not body.get("stream"):
+            await asyncio.sleep(llm.delay(prompt, reply))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }
+
+        def chunk(delta: Dict, finish_reason: Optional[str] = None) -> str:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(data)}\n\n"
+
+        async def events():
+            yield chunk({"role": "assistant", "content": ""})
+            await asyncio.sleep(llm.first_token_delay(prompt))
+            for i, piece in enumerate(llm.pieces(reply)):
+                if i > 0 and llm.token_delay > 0:
+                    await asyncio.sleep(llm.token_delay)
+                yield chunk({"content": piece})
+            yield chunk({}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                data = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                        "model": model, "choices": [], "usage": usage}
+                yield f"data: {json.dumps(data)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    defaults = FakeLLM.from_env()
+    parser = argparse.ArgumentParser(description="Serve a deterministic fake LLM with an OpenAI-compatible API.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8100, help="Port to listen on")
+    parser.add_argument("--latency", default=os.getenv("A2I2_FAKE_LLM_LATENCY", "fixed:0"),
+                        help='Time to first token, e.g. "fixed:0.3", "uniform:0.2,0.8", "lognormal:-1,0.5"')
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second,
+                        help="Generation speed after the first token (0 = instant)")
+    parser.add_argument("--answer", action="append", default=[],
+                        help='Canned answer for a check, e.g. "evacuation_decision=yes" (repeatable)')
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="Seed for the simulated latencies")
+    args = parser.parse_args()
+
+    answers = dict(defaults.answers)
+    answers.update(parse_answers(",".join(args.answer)))
+    llm = FakeLLM(args.latency, args.tokens_per_second, answers, args.seed)
+
+    import uvicorn
+    print(f"Fake LLM on http://{args.host}:{args.port}/v1 "
+          f"(latency {args.latency}, {args.tokens_per_second} tokens/s, answers {answers or 'all no'})")
+    uvicorn.run(create_app(llm), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
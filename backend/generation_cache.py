@@ -0,0 +1,101 @@
+"""Opt-in cache for LLM generations.
+
+Many prompts are fully determined by the character, the category and a
+short (often empty) history, so trainees starting the same scenario send
+identical prompts. Generations are cached by (model, temperature,
+max_tokens, normalized prompt) in an LRU/TTL cache.
+
+Modes:
+    off       no caching (default)
+    exact     reuse the first generation for a prompt
+    variants  collect up to N generations per prompt, then reuse a random
+              one, so repeated scenarios still vary
+
+Configuration (environment variables):
+    A2I2_GENERATION_CACHE           off, exact or variants
+    A2I2_GENERATION_CACHE_SIZE      max cached prompts (default 2048)
+    A2I2_GENERATION_CACHE_TTL       seconds an entry is kept (default 3600)
+    A2I2_GENERATION_CACHE_VARIANTS  generations kept per prompt in variants mode (default 3)
+"""
+import hashlib
+import os
+import random
+import threading
+from typing import Any, Dict, Optional
+
+from label_cache import TTLCache, normalize_utterance
+
+GENERATION_CACHE_MODES = ("off", "exact", "variants")
+
+
+class GenerationCache:
+    """Generated replies keyed by prompt, optionally keeping several variants each."""
+
+    def __init__(self, mode: str = "off", max_entries: int = 2048, ttl_seconds: float = 3600, variants: int = 3):
+        if mode not in GENERATION_CACHE_MODES:
+            raise ValueError(f"Unknown generation cache mode: {mode}")
+        self.mode = mode
+        self.variants = max(1, variants) if mode == "variants" else 1
+        self._cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @staticmethod
+    def make_key(prompt: str, model: str, temperature: float, max_tokens: int) -> str:
+        """Hash of the generation parameters and the whitespace/case-normalized prompt."""
+        digest = hashlib.sha1(normalize_utterance(prompt).encode("utf-8"))
+        digest.update(f"|{model}|{temperature}|{max_tokens}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """A cached reply, or None while the prompt still needs (more) generations."""
+        variants = self._cache.get(key)
+        with self._lock:
+            if variants is None or len(variants) < self.variants:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return random.choice(variants)
+
+    def add(self, key: str, text: str):
+        """Store a generated reply as one of the prompt's variants."""
+        with self._lock:
+            variants = list(self._cache.get(key) or [])
+            if text not in variants and len(variants) < self.variants:
+                variants.append(text)
+            self._cache.set(key, variants)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters (from callers' point of view) and occupancy."""
+        cache_stats = self._cache.stats()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "mode": self.mode,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "size": cache_stats["size"],
+                "evictions": cache_stats["evictions"],
+                "expirations": cache_stats["expirations"],
+                "max_entries": cache_stats["max_entries"],
+                "ttl_seconds": cache_stats["ttl_seconds"],
+                "variants": self.variants,
+            }
+
+
+# Shared by every generation call in the process.
+generation_cache = GenerationCache(
+    mode=os.getenv("A2I2_GENERATION_CACHE", "off").lower(),
+    max_entries=int(os.getenv("A2I2_GENERATION_CACHE_SIZE", "2048")),
+    ttl_seconds=float(os.getenv("A2I2_GENERATION_CACHE_TTL", "3600")),
+    variants=int(os.getenv("A2I2_GENERATION_CACHE_VARIANTS", "3")),
+)
@@ -0,0 +1,178 @@
+"""Durable JSON lines output for generation jobs, with resumable checkpoints.
+
+A generation job appends one JSON record (with an ``id``) per finished
+conversation to a JSONL file. Each line is flushed when written, but the
+file is fsynced in batches, every ``fsync_every`` records or
+``fsync_interval`` seconds, so a crash loses at most the last unsynced
+batch without paying for an fsync per line.
+
+After every fsync the job's manifest (``<output>.manifest.json``) is
+rewritten atomically with the job configuration and the ids that are now
+on disk. A resumed job skips those ids, and any complete record written
+after the last checkpoint; a partial last line left by a crash is
+truncated first. Failed conversations are not written to the output, so
+they are retried on resume.
+"""
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+
+def manifest_path(output_path: str) -> str:
+    return f"{output_path}.manifest.json"
+
+
+def recover_jsonl(path: str, id_key: str = "id") -> Set[str]:
+    """Ids of the complete records in ``path``, truncating a partial last line."""
+    if not os.path.exists(path):
+        return set()
+    ids = set()
+    with open(path, "rb+") as f:
+        good_bytes = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            good_bytes += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and id_key in record:
+                ids.add(record[id_key])
+        if good_bytes < f.seek(0, os.SEEK_END):
+            f.truncate(good_bytes)
+    return ids
+
+
+class JSONLWriter:
+    """Appends JSON records to a file, fsyncing in batches.
+
+    ``on_sync`` is called with the ids of the records each fsync made
+    durable, e.g. to checkpoint them.
+    """
+
+    def __init__(self, path: str, fsync_every: int = 16, fsync_interval: float = 1.0,
+                 on_sync: Optional[Callable[[List[str]], None]] = None):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        self.on_sync = on_sync
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a")
+        self._unsynced: List[str] = []
+        self._last_sync = time.monotonic()
+        self.written = 0
+        self.syncs = 0
+
+    def write(self, record: Dict[str, Any]):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self._unsynced.append(record.get("id"))
+        self.written += 1
+        if (len(self._unsynced) >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        """Fsync the records written since the last sync."""
+        self._last_sync = time.monotonic()
+        if not self._unsynced:
+            return
+        os.fsync(self._file.fileno())
+        self.syncs += 1
+        ids, self._unsynced = self._unsynced, []
+        if self.on_sync is not None:
+            self.on_sync([record_id for record_id in ids if record_id is not None])
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RunManifest:
+    """Configuration and progress of a generation job, checkpointed next to its output."""
+
+    def __init__(self, output_path: str, config: Optional[Dict[str, Any]] = None):
+        self.output_path = output_path
+        self.path = manifest_path(output_path)
+        self.config = config or {}
+        self.total = 0
+        self.completed: Set[str] = set()
+        self.failed: Dict[str, str] = {}
+        self.status = "running"
+        self.started_at = datetime.now().isoformat()
+
+    @classmethod
+    def load(cls, output_path: str) -> Optional["RunManifest"]:
+        try:
+            with open(manifest_path(output_path), "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        manifest = cls(output_path, data.get("config"))
+        manifest.total = data.get("total", 0)
+        manifest.completed = set(data.get("completed_ids", []))
+        manifest.failed = data.get("failed", {})
+        manifest.status = data.get("status", "running")
+        manifest.started_at = data.get("started_at", manifest.started_at)
+        return manifest
+
+    def mark_completed(self, ids: Iterable[str]):
+        """Record ids that are durably written to the output, and checkpoint."""
+        for record_id in ids:
+            self.completed.add(record_id)
+            self.failed.pop(record_id, None)
+        self.save()
+
+    def mark_failed(self, record_id: str, error: str):
+        """Record a failure (saved with the next checkpoint); it is retried on resume."""
+        self.failed[record_id] = error
+
+    def finish(self):
+        self.status = "finished" if not self.failed and len(self.completed) >= self.total else "incomplete"
+        self.save()
+
+    def save(self):
+        data = {
+            "output": self.output_path,
+            "config": self.config,
+            "status": self.status,
+            "total": self.total,
+            "completed": len(self.completed),
+            "started_at": self.started_at,
+            "updated_at": datetime.now().isoformat(),
+            "failed": self.failed,
+            "completed_ids": sorted(self.completed),
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def start_job(output_path: str, config: Dict[str, Any], resume: bool = False) -> RunManifest:
+    """The manifest for a job writing to ``output_path``.
+
+    With ``resume`` the previous manifest (and its configuration) is kept and
+    every complete record already in the output counts as done. Without it,
+    an existing output is refused rather than mixed with a new job.
+    """
+    if not resume:
+        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+            raise FileExistsError(f"{output_path} already exists; resume it or choose another output")
+        return RunManifest(output_path, config)
+    manifest = RunManifest.load(output_path) or RunManifest(output_path, config)
+    manifest.completed |= recover_jsonl(output_path)
+    manifest.status = "running"
+    return manifest
@@ -0,0 +1,92 @@
+"""Content-addressed cache for utterance classifier labels.
+
+History scans in the chat flow ask the same checks about the same lines on
+every turn. Labels are cached by (normalized text, check type, model) so a
+line is classified once and later turns only pay for the new lines.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def normalize_utterance(text: str) -> str:
+    """Lowercase and collapse whitespace so trivially different copies of a line share a key."""
+    return " ".join(str(text).lower().split())
+
+
+def make_key(text: str, check: str, model: str) -> Tuple[str, str, str]:
+    """Build the cache key for a classifier result."""
+    digest = hashlib.sha1(normalize_utterance(text).encode("utf-8")).hexdigest()
+    return (digest, check, model)
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl_seconds``."""
+
+    def __init__(self, max_entries: int = 4096, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key) -> Optional[Any]:
+        """Return the cached value, or None on a miss or an expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries when full."""
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and occupancy."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+# Shared by every check function in the process.
+label_cache = TTLCache(
+    max_entries=int(os.getenv("A2I2_LABEL_CACHE_SIZE", "4096")),
+    ttl_seconds=float(os.getenv("A2I2_LABEL_CACHE_TTL", "3600")),
+)
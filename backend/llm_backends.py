@@ -0,0 +1,192 @@
+"""LLM backends for the conversation engine, selected by configuration.
+
+Every backend is a ``GeneratorModel`` that answers a single user prompt,
+either synchronously (``complete``, used by CLI scripts) or through the
+pooled async client it creates for the server (``create_async_client``).
+The conversation engine in ``ollama_0220_openai`` only talks to the
+selected backend, so caching, pooling and batching are written once and
+behave the same whichever model is behind them.
+
+Backends:
+    openai  OpenAI chat completions (OPENAI_API_KEY, optional OPENAI_BASE_URL)
+    ollama  a local Ollama server (OLLAMA_HOST, OLLAMA_MODEL)
+    fake    in-process FakeLLM: deterministic, zero latency unless configured (see fake_llm)
+
+Configuration (environment variables):
+    A2I2_LLM_BACKEND  backend name (default openai)
+"""
+import logging
+import os
+import threading
+from abc import abstractmethod
+from typing import Dict, List, Optional, Type
+
+import httpx
+
+from GeneratorModel import GeneratorModel
+from fake_llm import FakeLLM
+from llm_metrics import estimate_tokens, record_tokens
+from llm_client import (LLM_BACKEND, LLM_TIMEOUT, OLLAMA_HOST, OLLAMA_MODEL, AsyncFakeClient,
+                        AsyncLLMClient, AsyncOllamaClient, AsyncOpenAIClient)
+
+prompt_query = """Use these example lines as a guide:
+{context}
+
+{question}"""
+
+# Registered backend classes, by name
+LLM_BACKENDS: Dict[str, Type["LLMBackend"]] = {}
+
+
+def register_backend(name: str):
+    """Class decorator adding a backend to the registry under ``name``."""
+    def register(cls):
+        cls.name = name
+        LLM_BACKENDS[name] = cls
+        return cls
+    return register
+
+
+class LLMBackend(GeneratorModel):
+    """A chat model answering single user prompts.
+
+    ``model_file`` is the default model name; callers may pass another per call.
+    """
+    name = None
+    default_model = None
+
+    def __init__(self, model_file: Optional[str] = None):
+        super().__init__(model_file or self.default_model)
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    def load_model(self):
+        """Create the backend's client; called on first use."""
+        pass
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self.load_model()
+                    self._loaded = True
+
+    def complete(self, prompt: str, model: Optional[str] = None, temperature: float = 0.7,
+                 max_tokens: int = 500, response_format: Optional[Dict] = None) -> str:
+        """Return the model's reply to a single user prompt."""
+        self._ensure_loaded()
+        return self._complete(prompt, model or self.model_file, temperature, max_tokens, response_format)
+
+    def query(self, retrieved_documents: List[str], question: str) -> str:
+        """Answer ``question`` guided by retrieved example lines."""
+        return self.complete(prompt_query.format(context="\n".join(retrieved_documents), question=question))
+
+    @abstractmethod
+    def _complete(self, prompt, model, temperature, max_tokens, response_format) -> str:
+        pass
+
+    @abstractmethod
+    def create_async_client(self) -> AsyncLLMClient:
+        """A new pooled async client talking to the same model."""
+        pass
+
+
+@register_backend("openai")
+class OpenAIBackend(LLMBackend):
+    default_model = AsyncOpenAIClient.default_model
+
+    def load_model(self):
+        from openai import OpenAI
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError(
+                "OPENAI_API_KEY not found. Please create a .env file in the project root "
+                "with the line: OPENAI_API_KEY=your_api_key_here"
+            )
+        self._client = OpenAI(api_key=api_key, base_url=os.getenv("OPENAI_BASE_URL"), timeout=LLM_TIMEOUT)
+
+    def _complete(self, prompt, model, temperature, max_tokens, response_format):
+        kwargs = {}
+        if response_format is not None:
+            kwargs['response_format'] = response_format
+        response = self._client.chat.completions.create(
+            model=model,
+            messages=[{
+                'role': 'user',
+                'content': prompt,
+            }],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs
+        )
+        if response.usage is not None:
+            record_tokens(response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content.strip()
+
+    def create_async_client(self):
+        return AsyncOpenAIClient()
+
+
+@register_backend("ollama")
+class OllamaBackend(LLMBackend):
+    default_model = OLLAMA_MODEL
+
+    def load_model(self):
+        self._client = httpx.Client(base_url=OLLAMA_HOST, timeout=LLM_TIMEOUT)
+
+    def _complete(self, prompt, model, temperature, max_tokens, response_format):
+        # OpenAI model names (the engine's default) mean nothing to Ollama
+        if model.startswith("gpt-"):
+            model = self.model_file
+        payload = {
+            "model": model,
+            "messages": [{'role': 'user', 'content': prompt}],
+            "stream": False,
+            "options": {"temperature": temperature, "num_predict": max_tokens},
+        }
+        if response_format is not None and response_format.get("type") == "json_object":
+            payload["format"] = "json"
+        response = self._client.post("/api/chat", json=payload)
+        response.raise_for_status()
+        data = response.json()
+        record_tokens(data.get('prompt_eval_count'), data.get('eval_count'))
+        return data['message']['content'].strip()
+
+    def create_async_client(self):
+        return AsyncOllamaClient()
+
+
+@register_backend("fake")
+class FakeBackend(LLMBackend):
+    """In-process ``FakeLLM``, configured by the A2I2_FAKE_LLM_* variables."""
+    default_model = "fake"
+
+    def load_model(self):
+        self.llm = FakeLLM.from_env()
+
+    def _complete(self, prompt, model, temperature, max_tokens, response_format):
+        reply = self.llm.complete(prompt, response_format, max_tokens)
+        record_tokens(estimate_tokens(prompt), estimate_tokens(reply))
+        return reply
+
+    def create_async_client(self):
+        self._ensure_loaded()
+        return AsyncFakeClient(self.llm)
+
+
+_backend: Optional[LLMBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> LLMBackend:
+    """Return the process-wide backend selected by A2I2_LLM_BACKEND."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if LLM_BACKEND not in LLM_BACKENDS:
+                    raise ValueError(f"Unknown LLM backend: {LLM_BACKEND} "
+                                     f"(expected one of {', '.join(sorted(LLM_BACKENDS))})")
+                _backend = LLM_BACKENDS[LLM_BACKEND]()
+                logging.info(f"Using {LLM_BACKEND} LLM backend")
+    return _backend
@@ -0,0 +1,294 @@
+"""Async LLM clients for the FastAPI server.
+
+The chat handlers are ``async``, so model calls must not block the event
+loop. Each backend keeps one pooled HTTP client per event loop, bounds the
+number of in-flight requests and applies a per-request timeout.
+
+Configuration (environment variables):
+    A2I2_LLM_BACKEND          "openai" (default), "ollama" or "fake" (see llm_backends)
+    A2I2_LLM_MAX_CONNECTIONS  pool size / max concurrent requests (default 20)
+    A2I2_LLM_TIMEOUT          per-request timeout in seconds (default 30)
+    A2I2_LLM_RATE_LIMIT       max requests started per second, e.g. for batch jobs (default 0, unlimited)
+    OLLAMA_HOST               Ollama base URL (default http://localhost:11434)
+    OLLAMA_MODEL              model used by the Ollama backend (default llama3.2:latest)
+"""
+import asyncio
+import json
+import os
+import time
+from abc import ABCMeta, abstractmethod
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+from llm_metrics import estimate_tokens, record_tokens
+from log_config import get_logger
+
+logger = get_logger("llm_client")
+
+LLM_BACKEND = os.getenv("A2I2_LLM_BACKEND", "openai").lower()
+LLM_MAX_CONNECTIONS = int(os.getenv("A2I2_LLM_MAX_CONNECTIONS", "20"))
+LLM_TIMEOUT = float(os.getenv("A2I2_LLM_TIMEOUT", "30"))
+LLM_RATE_LIMIT = float(os.getenv("A2I2_LLM_RATE_LIMIT", "0"))
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:latest")
+
+
+class RateLimiter:
+    """Spaces request starts at least ``1 / rate`` seconds apart (0 disables it).
+
+    Shared by every task using the client, so concurrent callers together
+    stay under the provider's requests-per-second limit.
+    """
+
+    def __init__(self, rate: float = 0.0):
+        self.rate = rate
+        self._next_start = 0.0
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        start = max(now, self._next_start)
+        self._next_start = start + 1.0 / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class AsyncLLMClient(object, metaclass=ABCMeta):
+    """A pooled, concurrency-bounded, optionally rate-limited async chat completion client."""
+
+    def __init__(self, max_connections: int = LLM_MAX_CONNECTIONS, timeout: float = LLM_TIMEOUT,
+                 rate_limit: float = LLM_RATE_LIMIT):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate_limit)
+        self._http: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+
+    def _ensure_pool(self):
+        # httpx pools and asyncio semaphores belong to the loop they were
+        # first used on, so rebuild them if we are now on a different loop
+        # (e.g. a CLI script calling asyncio.run() more than once).
+        loop = asyncio.get_event_loop()
+        if self._http is None or self._loop is not loop:
+            if self._http is not None:
+                self._close_stale_pool(self._http, self._loop)
+            self._http = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=httpx.Timeout(self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+            self._loop = loop
+            self._on_new_pool()
+
+    @staticmethod
+    def _close_stale_pool(http: httpx.AsyncClient, loop):
+        """Close a client built on another loop, whose connections can only be closed there."""
+        if loop is not None and loop.is_running():
+            # e.g. a loop in another thread
+            asyncio.run_coroutine_threadsafe(http.aclose(), loop)
+        # Otherwise the loop has stopped (after asyncio.run() it is closed):
+        # its connections cannot be awaited any more, and their sockets are
+        # closed when the dropped client is garbage collected.
+
+    def _on_new_pool(self):
+        """Hook for subclasses that wrap the pooled httpx client."""
+        pass
+
+    async def complete(self, prompt: str, model: Optional[str] = None, temperature: float = 0.7,
+                       max_tokens: int = 500, response_format: Optional[Dict] = None) -> str:
+        """Return the model's reply to a single user prompt."""
+        self._ensure_pool()
+        async with self._semaphore:
+            await self.rate_limiter.acquire()
+            return await asyncio.wait_for(
+                self._complete(prompt, model, temperature, max_tokens, response_format),
+                timeout=self.timeout,
+            )
+
+    async def stream(self, prompt: str, model: Optional[str] = None, temperature: float = 0.7,
+                     max_tokens: int = 500) -> AsyncIterator[str]:
+        """Yield the model's reply to a single user prompt in pieces as it is generated."""
+        self._ensure_pool()
+        async with self._semaphore:
+            await self.rate_limiter.acquire()
+            async for delta in self._stream(prompt, model, temperature, max_tokens):
+                yield delta
+
+    @abstractmethod
+    async def _complete(self, prompt, model, temperature, max_tokens, response_format) -> str:
+        pass
+
+    async def _stream(self, prompt, model, temperature, max_tokens) -> AsyncIterator[str]:
+        """Backends without native streaming yield the whole reply at once."""
+        yield await asyncio.wait_for(self._complete(prompt, model, temperature, max_tokens, None),
+                                     timeout=self.timeout)
+
+    async def warmup(self, model: Optional[str] = None):
+        """Open the pool and send a one-token request.
+
+        This also makes backends such as Ollama load the model before the
+        first real request.
+        """
+        await self.complete("Say OK.", model=model, temperature=0.0, max_tokens=1)
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+class AsyncOpenAIClient(AsyncLLMClient):
+    default_model = "gpt-4o-mini"
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self._client = None
+
+    def _on_new_pool(self):
+        from openai import AsyncOpenAI
+        self._client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=self._http,
+            timeout=self.timeout,
+        )
+
+    async def _complete(self, prompt, model, temperature, max_tokens, response_format) -> str:
+        kwargs = {}
+        if response_format is not None:
+            kwargs['response_format'] = response_format
+        response = await self._client.chat.completions.create(
+            model=model or self.default_model,
+            messages=[{
+                'role': 'user',
+                'content': prompt,
+            }],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs
+        )
+        if response.usage is not None:
+            record_tokens(response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content.strip()
+
+    async def _stream(self, prompt, model, temperature, max_tokens):
+        stream = await self._client.chat.completions.create(
+            model=model or self.default_model,
+            messages=[{
+                'role': 'user',
+                'content': prompt,
+            }],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            if chunk.usage is not None:
+                record_tokens(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class AsyncOllamaClient(AsyncLLMClient):
+    default_model = OLLAMA_MODEL
+
+    def __init__(self, host: str = OLLAMA_HOST, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host.rstrip('/')
+
+    def _payload(self, prompt, model, temperature, max_tokens, stream) -> Dict:
+        # OpenAI model names (the callers' default) mean nothing to Ollama.
+        if not model or model.startswith("gpt-"):
+            model = self.default_model
+        return {
+            "model": model,
+            "messages": [{'role': 'user', 'content': prompt}],
+            "stream": stream,
+            "options": {"temperature": temperature, "num_predict": max_tokens},
+        }
+
+    async def _complete(self, prompt, model, temperature, max_tokens, response_format) -> str:
+        payload = self._payload(prompt, model, temperature, max_tokens, stream=False)
+        if response_format is not None and response_format.get("type") == "json_object":
+            payload["format"] = "json"
+        response = await self._http.post(f"{self.host}/api/chat", json=payload)
+        response.raise_for_status()
+        data = response.json()
+        record_tokens(data.get('prompt_eval_count'), data.get('eval_count'))
+        return data['message']['content'].strip()
+
+    async def _stream(self, prompt, model, temperature, max_tokens):
+        payload = self._payload(prompt, model, temperature, max_tokens, stream=True)
+        # Ollama streams one JSON object per line
+        async with self._http.stream("POST", f"{self.host}/api/chat", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                content = chunk.get('message', {}).get('content')
+                if content:
+                    yield content
+                if chunk.get('done'):
+                    record_tokens(chunk.get('prompt_eval_count'), chunk.get('eval_count'))
+                    break
+
+
+class AsyncFakeClient(AsyncLLMClient):
+    """In-process client answering from a ``fake_llm.FakeLLM`` with its simulated latency."""
+    default_model = "fake"
+
+    def __init__(self, llm, **kwargs):
+        super().__init__(**kwargs)
+        self.llm = llm
+
+    def _ensure_pool(self):
+        # No connections to pool; only bound concurrency like the real backends
+        loop = asyncio.get_event_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+            self._loop = loop
+
+    async def _complete(self, prompt, model, temperature, max_tokens, response_format) -> str:
+        reply = self.llm.reply(prompt, response_format, max_tokens)
+        record_tokens(estimate_tokens(prompt), estimate_tokens(reply))
+        await asyncio.sleep(self.llm.delay(prompt, reply))
+        return reply
+
+    async def _stream(self, prompt, model, temperature, max_tokens):
+        reply = self.llm.reply(prompt, None, max_tokens)
+        record_tokens(estimate_tokens(prompt), estimate_tokens(reply))
+        await asyncio.sleep(self.llm.first_token_delay(prompt))
+        for i, piece in enumerate(self.llm.pieces(reply)):
+            if i > 0 and self.llm.token_delay > 0:
+                await asyncio.sleep(self.llm.token_delay)
+            yield piece
+
+
+_async_client: Optional[AsyncLLMClient] = None
+
+
+def get_async_client() -> AsyncLLMClient:
+    """Return the process-wide async client for the configured backend."""
+    global _async_client
+    if _async_client is None:
+        from llm_backends import get_backend
+        _async_client = get_backend().create_async_client()
+        logger.info(f"Using async {LLM_BACKEND} client "
+                     f"(max_connections={LLM_MAX_CONNECTIONS}, timeout={LLM_TIMEOUT}s)")
+    return _async_client
+
+
+async def close_async_client():
+    """Close the pooled connections, e.g. on server shutdown."""
+    if _async_client is not None:
+        await _async_client.aclose()
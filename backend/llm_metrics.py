@@ -0,0 +1,201 @@
+"""Per-request accounting of LLM calls and tokens.
+
+Every model call made by the engine runs inside ``llm_call(purpose, model)``,
+which times it and picks up the token usage the backend reports through
+``record_tokens``. Calls answered from a cache are recorded with
+``record_cached`` instead. Purposes are short tags such as ``generation``,
+``greeting``, ``checks`` (the utterance classifier) or ``decision`` (the
+classifier asked for an evacuation decision).
+
+A request handler wraps its work in ``request_usage(endpoint)``; every call
+made while it runs, including in tasks it spawns, is added to the request's
+``RequestUsage``, which can be returned to the client. Finished requests are
+aggregated per endpoint and per purpose in the process-wide ``llm_metrics``.
+
+Backends that do not report token counts are metered with a rough estimate
+(whitespace-separated words).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for backends that do not report usage."""
+    return len(text.split())
+
+
+class LLMCall:
+    """One model call (or cache hit) and what it cost."""
+    __slots__ = ("purpose", "model", "seconds", "prompt_tokens", "completion_tokens", "cached", "error")
+
+    def __init__(self, purpose: str, model: Optional[str], cached: bool = False):
+        self.purpose = purpose
+        self.model = model
+        self.seconds = 0.0
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.cached = cached
+        self.error = False
+
+
+def _empty_totals() -> Dict[str, Any]:
+    return {"calls": 0, "cached": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0}
+
+
+def _add_call(totals: Dict[str, Any], call: LLMCall):
+    if call.cached:
+        totals["cached"] += 1
+        return
+    totals["calls"] += 1
+    totals["errors"] += int(call.error)
+    totals["prompt_tokens"] += call.prompt_tokens or 0
+    totals["completion_tokens"] += call.completion_tokens or 0
+    totals["seconds"] += call.seconds
+
+
+def _rounded(totals: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(totals, seconds=round(totals["seconds"], 4))
+
+
+class RequestUsage:
+    """The LLM calls made while handling one request."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.calls: List[LLMCall] = []
+        self._lock = threading.Lock()
+
+    def add(self, call: LLMCall):
+        with self._lock:
+            self.calls.append(call)
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals and a per-purpose breakdown, as returned to clients."""
+        totals = _empty_totals()
+        by_purpose: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            calls = list(self.calls)
+        for call in calls:
+            _add_call(totals, call)
+            _add_call(by_purpose.setdefault(call.purpose, _empty_totals()), call)
+        summary = _rounded(totals)
+        summary["by_purpose"] = {purpose: _rounded(purpose_totals) for purpose, purpose_totals in by_purpose.items()}
+        return summary
+
+
+class LLMMetrics:
+    """Process-wide LLM usage, per purpose and per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.totals = _empty_totals()
+            self.by_purpose: Dict[str, Dict[str, Any]] = {}
+            self.by_endpoint: Dict[str, Dict[str, Any]] = {}
+
+    def record_call(self, call: LLMCall):
+        with self._lock:
+            _add_call(self.totals, call)
+            _add_call(self.by_purpose.setdefault(call.purpose, _empty_totals()), call)
+
+    def record_request(self, usage: RequestUsage):
+        summary = usage.summary()
+        with self._lock:
+            endpoint = self.by_endpoint.setdefault(usage.endpoint, dict(_empty_totals(), requests=0))
+            endpoint["requests"] += 1
+            for key in ("calls", "cached", "errors", "prompt_tokens", "completion_tokens", "seconds"):
+                endpoint[key] += summary[key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Totals, per purpose and per endpoint (with per-request averages)."""
+        with self._lock:
+            by_endpoint = {}
+            for name, endpoint in self.by_endpoint.items():
+                requests = endpoint["requests"] or 1
+                by_endpoint[name] = dict(
+                    _rounded(endpoint),
+                    calls_per_request=round(endpoint["calls"] / requests, 2),
+                    tokens_per_request=round((endpoint["prompt_tokens"] + endpoint["completion_tokens"]) / requests, 1),
+                    llm_seconds_per_request=round(endpoint["seconds"] / requests, 4),
+                )
+            return {
+                "since": self.started_at,
+                "totals": _rounded(self.totals),
+                "by_purpose": {purpose: _rounded(totals) for purpose, totals in self.by_purpose.items()},
+                "by_endpoint": by_endpoint,
+            }
+
+
+# Shared by every model call in the process.
+llm_metrics = LLMMetrics()
+
+_request_usage: ContextVar[Optional[RequestUsage]] = ContextVar("a2i2_request_usage", default=None)
+_current_call: ContextVar[Optional[LLMCall]] = ContextVar("a2i2_current_llm_call", default=None)
+
+
+@contextmanager
+def request_usage(endpoint: str):
+    """Collect the LLM calls made while handling a request to ``endpoint``."""
+    usage = RequestUsage(endpoint)
+    token = _request_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _request_usage.reset(token)
+        llm_metrics.record_request(usage)
+
+
+def _finish(call: LLMCall):
+    llm_metrics.record_call(call)
+    usage = _request_usage.get()
+    if usage is not None:
+        usage.add(call)
+
+
+@contextmanager
+def llm_call(purpose: str, model: Optional[str], prompt: str = ""):
+    """Time and meter one model call; the backend reports tokens with ``record_tokens``."""
+    call = LLMCall(purpose, model)
+    token = _current_call.set(call)
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.error = True
+        raise
+    finally:
+        call.seconds = time.perf_counter() - start
+        _current_call.reset(token)
+        if call.prompt_tokens is None:
+            call.prompt_tokens = estimate_tokens(prompt)
+        _finish(call)
+
+
+def record_tokens(prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    """Called by backends with the usage their API reported for the current call."""
+    call = _current_call.get()
+    if call is None:
+        return
+    if prompt_tokens is not None:
+        call.prompt_tokens = (call.prompt_tokens or 0) + prompt_tokens
+    if completion_tokens is not None:
+        call.completion_tokens = (call.completion_tokens or 0) + completion_tokens
+
+
+def record_completion(text: str):
+    """Estimate completion tokens from the reply if the backend reported none."""
+    call = _current_call.get()
+    if call is not None and call.completion_tokens is None:
+        call.completion_tokens = estimate_tokens(text)
+
+
+def record_cached(purpose: str, model: Optional[str]):
+    """Record a call answered from a cache instead of the model."""
+    _finish(LLMCall(purpose, model, cached=True))
@@ -0,0 +1,174 @@
+"""Logging setup for the server and the conversation engine.
+
+Records are put on an in-memory queue by the calling thread and written by
+a background listener thread, so a chat turn never waits on stdout (or on
+the log collector reading it). If the queue is full, records are dropped
+and counted rather than blocking.
+
+Loggers are named per module (``a2i2.server``, ``a2i2.engine``) so their
+levels can be tuned separately. Any ``extra={...}`` fields passed to a log
+call are appended as ``key=value`` pairs in text format, or become keys of
+the JSON object in json format.
+
+Full histories, prompts and retrieved info are logged with ``log_payload``:
+only at DEBUG, only for a sampled fraction of calls, and truncated.
+
+Configuration (environment variables):
+    A2I2_LOG_LEVEL              root level (default INFO)
+    A2I2_LOG_LEVELS             per-logger levels, e.g. "a2i2.server=DEBUG,uvicorn.access=WARNING"
+    A2I2_LOG_FORMAT             text (default) or json
+    A2I2_LOG_QUEUE_SIZE         records buffered before new ones are dropped (default 10000)
+    A2I2_LOG_PAYLOAD_SAMPLE     fraction of payload logs kept (default 0.1)
+    A2I2_LOG_PAYLOAD_MAX_CHARS  payloads are truncated to this length (default 2000)
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+LOG_LEVEL = os.getenv("A2I2_LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("A2I2_LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("A2I2_LOG_FORMAT", "text").lower()
+LOG_QUEUE_SIZE = int(os.getenv("A2I2_LOG_QUEUE_SIZE", "10000"))
+LOG_PAYLOAD_SAMPLE = float(os.getenv("A2I2_LOG_PAYLOAD_SAMPLE", "0.1"))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("A2I2_LOG_PAYLOAD_MAX_CHARS", "2000"))
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else came from ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _extra_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class TextFormatter(logging.Formatter):
+    """The usual one-line format, followed by any extra fields as key=value."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, for log collectors."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Records stay in this process, so keep extra fields and let the
+        # listener format them; only freeze the message and traceback text.
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+_configure_lock = threading.Lock()
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """Parse "logger=LEVEL,other=LEVEL" into a dict."""
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, _, level = item.partition("=")
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """Install the queue-backed handler on the root logger (once per process)."""
+    global _listener, _queue_handler
+    with _configure_lock:
+        if _listener is not None:
+            return
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JSONFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        log_queue: "queue.Queue" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _queue_handler = DroppingQueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger()
+        root.addHandler(_queue_handler)
+        root.setLevel(LOG_LEVEL)
+        for name, level in parse_levels(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+
+
+def add_log_file(path: str, formatter: Optional[logging.Formatter] = None) -> logging.Handler:
+    """Also write every record to ``path``, from the listener thread like stdout."""
+    configure_logging()
+    handler = logging.FileHandler(path)
+    handler.setFormatter(formatter or (JSONFormatter() if LOG_FORMAT == "json" else TextFormatter()))
+    _listener.handlers = _listener.handlers + (handler,)
+    return handler
+
+
+def get_logger(name: str) -> logging.Logger:
+    """A module logger under the ``a2i2`` namespace, e.g. ``get_logger("server")``."""
+    return logging.getLogger(f"a2i2.{name}")
+
+
+def log_payload(logger: logging.Logger, message: str, payload: Any, level: int = logging.DEBUG, **fields):
+    """Log a large value (history, prompt, retrieved info) for a sample of calls.
+
+    Nothing is formatted unless the level is enabled and the call is sampled.
+    """
+    if not logger.isEnabledFor(level) or random.random() >= LOG_PAYLOAD_SAMPLE:
+        return
+    text = payload if isinstance(payload, str) else repr(payload)
+    if len(text) > LOG_PAYLOAD_MAX_CHARS:
+        text = f"{text[:LOG_PAYLOAD_MAX_CHARS]}... ({len(text)} chars)"
+    logger.log(level, f"{message}: {text}", extra=fields)
+
+
+def dropped_records() -> int:
+    """Records dropped because the log queue was full."""
+    return _queue_handler.dropped if _queue_handler is not None else 0
@@ -1,37 +1,52 @@
-from openai import OpenAI
-from GeneratorModel import GeneratorModel
+from llm_backends import get_backend
+from label_cache import label_cache, make_key
+from llm_client import get_async_client
+from session_store import SessionStore, open_session_store
+from embedding_cache import default_embedding_cache
+from generation_cache import generation_cache
+from llm_metrics import llm_call, record_cached, record_completion
+from tracing import span, traced
+from log_config import add_log_file, configure_logging, get_logger, log_payload
+from jsonl_output import JSONLWriter, start_job
 import argparse
-import torch
-import pickle
+import asyncio
 #from em_retriever import *
 import json
-from sentence_transformers import SentenceTransformer
-import faiss
 import numpy as np
 import os
-from typing import List, Dict, Optional
+from typing import TYPE_CHECKING, List, Dict, Optional, Tuple
 import time
 import random
 import logging
 import sys
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime
 import urllib3
 import http.client
 import warnings
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    import faiss
+    from sentence_transformers import SentenceTransformer
+
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize OpenAI client
-# IMPORTANT: Never hardcode API keys! Always use environment variables
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError(
-        "OPENAI_API_KEY not found. Please create a .env file in the project root "
-        "with the line: OPENAI_API_KEY=your_api_key_here"
-    )
-client = OpenAI(api_key=api_key)
+# Configure logging (queue-backed; see log_config) before anything logs
+configure_logging()
+logger = get_logger("engine")
+
+# LLM backend (openai, ollama or fake) selected by A2I2_LLM_BACKEND.
+# IMPORTANT: Never hardcode API keys! The OpenAI backend reads OPENAI_API_KEY
+# from the environment on its first call.
+llm_backend = get_backend()
+
+# Example lines retrieved per prompt, instead of a whole category
+RETRIEVAL_TOP_K = int(os.getenv("A2I2_RETRIEVAL_TOP_K", "5"))
+ENCODER_NAME = 'all-MiniLM-L6-v2'
 
 # Disable all HTTP request logging
 os.environ['PYTHONWARNINGS'] = 'ignore'
@@ -45,12 +60,6 @@ http.client.HTTPConnection.debuglevel = 0
 # Disable all warnings
 warnings.filterwarnings('ignore')
 
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 for module in ['urllib3', 'requests', 'http.client', 'asyncio', 'websockets']:
     logging.getLogger(module).setLevel(logging.ERROR)
 
@@ -95,17 +104,46 @@ You are the Fire Department Agent. Generate a single response to {name}'s messag
 
 Format your output as a direct response without any name prefix or additional context."""
 
+_encoders: Dict[str, "SentenceTransformer"] = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoder(name: str = ENCODER_NAME) -> "SentenceTransformer":
+    """Load a sentence encoder on first use and share it across the process.
+
+    torch and sentence_transformers take seconds to import, so they are only
+    imported here rather than when this module is.
+    """
+    with _encoders_lock:
+        if name not in _encoders:
+            start = time.time()
+            from sentence_transformers import SentenceTransformer
+            _encoders[name] = SentenceTransformer(name)
+            logger.info(f"Loaded encoder {name} in {time.time() - start:.2f}s")
+        return _encoders[name]
+
+
 class DialogueVectorStore:
-    def __init__(self):
+    def __init__(self, encoder: Optional["SentenceTransformer"] = None, encoder_name: str = ENCODER_NAME):
         self.character_responses = {}
         self.operator_responses = {}
         self.operator_response_categories = ['greetings', 'progression', 'observations', 'closing', 'emphasize_danger', 'emphasize_value_of_life', 'give_up_persuading']
         self.character_response_categories = ['greetings', 'response_to_operator_greetings', 'progression', 'observations', 'general', 'closing']
-        # Initialize sentence transformer for semantic similarity
-        self.encoder = SentenceTransformer('all-MiniLM-L6-v2')
+        # Sentence transformer for semantic similarity, loaded on first use
+        self._encoder = encoder
+        self.encoder_name = encoder_name
+        self.embedding_cache = default_embedding_cache(encoder_name)
+        self.source_paths: List[str] = []
+        # Partition name -> (FAISS index, [(category, line)]), built on first search
+        self.partitions: Optional[Dict[str, Tuple["faiss.Index", List[Tuple[str, str]]]]] = None
+        self._index_lock = threading.Lock()
+        # Set if the encoder or faiss cannot be loaded; examples() then falls
+        # back to the first lines of each category
+        self.retrieval_error: Optional[str] = None
         
     def add_dialogues(self, file_path):
         """Load character responses from JSONL file."""
+        self.source_paths.append(file_path)
         try:
             with open(file_path, 'r') as file:
                 for line_num, line in enumerate(file, 1):
@@ -133,69 +171,179 @@ class DialogueVectorStore:
                                     data[category] = []
                             self.character_responses[data['character']] = data
                     except json.JSONDecodeError as e:
-                        logging.warning(f"Skipping invalid JSON at line {line_num}: {str(e)}")
+                        logger.warning(f"Skipping invalid JSON at line {line_num}: {str(e)}")
                         continue
                         
             if not self.character_responses:
-                logging.warning("No valid character responses were loaded")
+                logger.warning("No valid character responses were loaded")
             else:
-                logging.info(f"Loaded responses for characters: {list(self.character_responses.keys())}")
-                logging.info(f"Loaded operator responses for contexts: {list(self.operator_responses.keys())}")
+                logger.info(f"Loaded responses for characters: {list(self.character_responses.keys())}")
+                logger.info(f"Loaded operator responses for contexts: {list(self.operator_responses.keys())}")
                 
         except Exception as e:
-            logging.error(f"Error loading dialogues: {str(e)}")
+            logger.error(f"Error loading dialogues: {str(e)}")
             raise
 
-    def search(self, query: str, character: str = None, k: int = 3) -> List[Dict]:
-        """Search for relevant dialogue entries based on keywords."""
-        results = []
-        
-        # Convert query to lowercase for case-insensitive matching
-        query = query.lower()
-        
-        # Determine which category to search based on keywords
-        category = None
-        if "greeting" in query:
-            category = 'greetings'
-        elif "evacuation" in query or "leave" in query:
-            category = 'progression'
-        elif "see" in query or "smoke" in query or "fire" in query:
-            category = 'observations'
-        elif "goodbye" in query or "bye" in query:
-            category = 'closing'
-        elif "operator" in query or "response" in query:
-            category = 'response_to_operator_greetings'
+    @property
+    def encoder(self) -> "SentenceTransformer":
+        if self._encoder is None:
+            self._encoder = get_encoder(self.encoder_name)
+        return self._encoder
+
+    def warmup(self):
+        """Load the encoder and build the index ahead of the first search."""
+        self.query_vector("warmup")
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Encode texts to L2-normalized float32 vectors, so inner product is cosine similarity."""
+        vectors = self.encoder.encode(texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def _partition_entries(self) -> Dict[str, List[Tuple[str, str]]]:
+        """(category, line) pairs for each character and for the operator."""
+        partitions = {}
+        for character, data in self.character_responses.items():
+            if character == 'operator':
+                continue
+            partitions[character] = [(category, line) for category, lines in data.items() if isinstance(lines, list)
+                                     for line in lines if isinstance(line, str)]
+        partitions['operator'] = [(category, line) for category, lines in self.operator_responses.items()
+                                  for line in lines if isinstance(line, str)]
+        return partitions
+
+    def build_index(self):
+        """Embed every loaded line and build one FAISS inner-product index per partition.
+
+        With an embedding cache, indexes built for the same dialogue files and
+        encoder are loaded from disk, and only new lines are encoded.
+        """
+        with self._index_lock:
+            if self.partitions is not None:
+                return
+            start = time.time()
+            cache = self.embedding_cache
+            source_key = cache.source_key(self.source_paths) if cache else None
+            if cache:
+                partitions = cache.load_indexes(source_key)
+                if partitions is not None:
+                    self.partitions = partitions
+                    logger.info(f"Loaded dialogue index {source_key} from {cache.directory} "
+                                 f"in {time.time() - start:.2f}s")
+                    return
+
+            entries = self._partition_entries()
+            texts = [line for partition in entries.values() for _, line in partition]
+            if not texts:
+                vectors = None
+            elif cache:
+                vectors = cache.embed(texts, self.embed)
+            else:
+                vectors = self.embed(texts)
+            dimension = vectors.shape[1] if vectors is not None else self.encoder.get_sentence_embedding_dimension()
+            import faiss
+            partitions = {}
+            offset = 0
+            for name, partition in entries.items():
+                index = faiss.IndexFlatIP(dimension)
+                if partition:
+                    index.add(vectors[offset:offset + len(partition)])
+                offset += len(partition)
+                partitions[name] = (index, partition)
+            if cache:
+                cache.save_indexes(source_key, partitions)
+            self.partitions = partitions
+            logger.info(f"Indexed {len(texts)} dialogue lines in {len(partitions)} partitions "
+                         f"in {time.time() - start:.2f}s")
+
+    def _disable_retrieval(self, error: Exception):
+        if self.retrieval_error is None:
+            self.retrieval_error = f"{type(error).__name__}: {error}"
+            logger.warning(f"Semantic retrieval unavailable, using the first {RETRIEVAL_TOP_K} lines "
+                           f"of each category: {self.retrieval_error}")
+
+    def ensure_index(self) -> bool:
+        """Build the index if needed; False if semantic retrieval is unavailable."""
+        if self.partitions is not None:
+            return True
+        if self.retrieval_error is not None:
+            return False
+        try:
+            self.build_index()
+            return True
+        except (ImportError, OSError) as e:
+            self._disable_retrieval(e)
+            return False
+
+    def query_vector(self, text: str) -> Optional[np.ndarray]:
+        """Embed a search query, building the index first if needed.
+
+        None if the encoder or index cannot be loaded (e.g. sentence_transformers
+        is not installed or the model cannot be downloaded).
+        """
+        if not self.ensure_index():
+            return None
+        try:
+            return self.embed([text])
+        except (ImportError, OSError) as e:
+            self._disable_retrieval(e)
+            return None
+
+    def search(self, query, character: str = None, k: int = 3, category: str = None) -> List[Dict]:
+        """Return the ``k`` lines most similar to ``query``.
+
+        ``query`` is a string or a vector from ``query_vector``. Searches one
+        character's lines (``'operator'`` for the operator's), or every
+        character's when ``character`` is None, optionally restricted to one
+        category.
+        """
+        query_vector = query if isinstance(query, np.ndarray) else self.query_vector(query)
+        if query_vector is None or not self.ensure_index():
+            return []
+        query_vector = query_vector.reshape(1, -1)
+        if character:
+            names = [character] if character in self.partitions else []
         else:
-            category = 'general'
+            names = [name for name in self.partitions if name != 'operator']
 
-        # If character is specified, only search that character's responses
-        if character and character in self.character_responses:
-            responses = self.character_responses[character].get(category, [])
-            for response in responses[:k]:
+        results = []
+        for name in names:
+            index, entries = self.partitions[name]
+            if not index.ntotal:
+                continue
+            # Partitions are small, so a category filter just scores all of them
+            scores, ids = index.search(query_vector, index.ntotal if category else min(k, index.ntotal))
+            for score, i in zip(scores[0], ids[0]):
+                if i < 0:
+                    continue
+                entry_category, content = entries[i]
+                if category and entry_category != category:
+                    continue
                 results.append({
-                    'speaker': character,
-                    'content': response,
-                    'character': character,
-                    'context': category
+                    'speaker': name,
+                    'content': content,
+                    'character': name,
+                    'context': entry_category,
+                    'score': float(score)
                 })
-        else:
-            # Search all characters
-            for char, data in self.character_responses.items():
-                responses = data.get(category, [])
-                for response in responses[:k]:
-                    results.append({
-                        'speaker': char,
-                        'content': response,
-                        'character': char,
-                        'context': category
-                    })
-                    if len(results) >= k:
-                        break
-                if len(results) >= k:
-                    break
-
+        results.sort(key=lambda result: result['score'], reverse=True)
         return results[:k]
 
+    def examples(self, character: str, category: str, query=None, k: int = RETRIEVAL_TOP_K) -> List[str]:
+        """The ``k`` lines of a category closest to ``query`` (the first ``k`` without a query).
+
+        ``query`` is text or a vector from ``query_vector``. Without semantic
+        retrieval (see ``retrieval_error``) the first ``k`` lines are used.
+        """
+        if isinstance(query, str):
+            query = self.query_vector(query) if query.strip() else None
+        if query is None or not self.ensure_index():
+            if character == 'operator':
+                lines = self.operator_responses.get(category, [])
+            else:
+                lines = self.character_responses.get(character, {}).get(category, [])
+            return lines[:k]
+        return [result['content'] for result in self.search(query, character, k, category)]
+
     def get_response(self, character, category):
         """Get a response for a specific character and category."""
         if character not in self.character_responses:
@@ -231,37 +379,290 @@ class DialogueVectorStore:
         return random.choice(responses)
 
 
+class Turn:
+    """One history entry.
+
+    Speakers are interned, so every turn by the same speaker shares one
+    string, and ``__slots__`` keeps the per-turn overhead to three fields.
+    """
+    __slots__ = ('speaker', 'content', 'timestamp')
+
+    def __init__(self, speaker: str, content: str, timestamp: float):
+        self.speaker = sys.intern(speaker)
+        self.content = content
+        self.timestamp = timestamp
+
+    def render(self) -> str:
+        return f"{self.speaker}: {self.content}"
+
+
+def _turn_bytes(turn: Turn) -> int:
+    """Approximate memory held by one turn (the interned speaker is shared)."""
+    return sys.getsizeof(turn) + sys.getsizeof(turn.content) + sys.getsizeof(turn.timestamp)
+
+
+class _Session:
+    """One conversation's recent turns plus its rendered history windows.
+
+    Turns live in a ring buffer that holds as many turns as the largest
+    window read so far. The last-N windows callers ask for are cached as
+    (line count, text) and updated incrementally on every append, so
+    reading the history is O(1).
+    """
+    __slots__ = ('turns', 'windows', 'total', 'bytes', 'checked_at')
+
+    def __init__(self, capacity: int):
+        self.turns: "deque[Turn]" = deque(maxlen=capacity)
+        self.windows: Dict[int, Tuple[int, str]] = {}
+        self.total = 0
+        self.bytes = 0
+        # When the session was last compared with the session store
+        self.checked_at = time.time()
+
+    def append(self, turn: Turn, capacity: int) -> Tuple[int, int]:
+        """Add a turn; return (bytes delta, number of turns dropped from the buffer)."""
+        if self.turns.maxlen != capacity:
+            self.turns = deque(self.turns, maxlen=capacity)
+        # The first line of each window, in case it slides out below
+        oldest = {max_turns: self.turns[-count] for max_turns, (count, _) in self.windows.items() if count}
+        dropped = self.turns[0] if len(self.turns) == capacity else None
+
+        self.turns.append(turn)
+        self.total += 1
+        size = _turn_bytes(turn)
+        if dropped is not None:
+            size -= _turn_bytes(dropped)
+        self.bytes += size
+
+        line = turn.render()
+        for max_turns, (count, window) in self.windows.items():
+            if not count:
+                self.windows[max_turns] = (1, line)
+                continue
+            window = f"{window}\n{line}"
+            if count + 1 > min(max_turns, len(self.turns)):
+                window = window[len(oldest[max_turns].render()) + 1:]
+            else:
+                count += 1
+            self.windows[max_turns] = (count, window)
+        return size, int(dropped is not None)
+
+    def window(self, max_turns: int) -> Tuple[int, str]:
+        """(line count, text) of the last ``max_turns`` turns joined with newlines."""
+        cached = self.windows.get(max_turns)
+        if cached is None:
+            turns = list(self.turns)[-max_turns:]
+            cached = (len(turns), "\n".join(turn.render() for turn in turns))
+            self.windows[max_turns] = cached
+        return cached
+
+
 class ConversationManager:
-    def __init__(self):
-        self.conversations: Dict[str, List[Dict]] = {}
-        
+    """In-memory conversation histories with bounded growth.
+
+    Sessions are evicted least-recently-used beyond ``max_sessions`` and
+    after ``idle_ttl`` seconds without activity. Each session keeps only as
+    many turns as the largest history window read so far (starting at
+    ``history_window``), capped at ``max_turns_per_session``.
+
+    With a ``store``, every turn is also written to durable storage. Memory
+    then acts as a cache: sessions lost in a restart are recovered at
+    startup, and sessions evicted here are loaded from the store when next
+    read. Sessions are otherwise never read back, so a turn does not touch
+    the disk. With several workers sharing the store, set
+    ``refresh_interval`` so sessions are re-checked against the store (and
+    sessions started by another worker are looked up) at most that often;
+    ``ensure_loaded`` lets async callers do that lookup off the event loop.
+    """
+
+    def __init__(self, max_sessions: int = 1000, idle_ttl: float = 3600, max_turns_per_session: int = 200,
+                 history_window: int = 12, store: Optional[SessionStore] = None, refresh_interval: float = 0):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_turns_per_session = max_turns_per_session
+        self.history_capacity = min(history_window, max_turns_per_session)
+        self.store = store
+        self.refresh_interval = refresh_interval
+        # Sessions in the store but evicted from memory, i.e. the only ones
+        # a single worker ever needs to load
+        self._stored_only: set = set()
+        # Ordered least recently used first
+        self.conversations: "OrderedDict[str, _Session]" = OrderedDict()
+        self.last_active: Dict[str, float] = {}
+        self.total_bytes = 0
+        self.evicted_sessions = 0
+        self.trimmed_messages = 0
+        self._lock = threading.RLock()
+
+    def _touch(self, session_id: str):
+        self.last_active[session_id] = time.time()
+        self.conversations.move_to_end(session_id)
+
+    def _drop(self, session_id: str):
+        session = self.conversations.pop(session_id)
+        del self.last_active[session_id]
+        self.total_bytes -= session.bytes
+
+    def _load(self, session_id: str) -> Optional[_Session]:
+        """Replace the in-memory copy of a session with the store's; None if the store has none."""
+        total, turns = self.store.load(session_id, self.history_capacity)
+        if session_id in self.conversations:
+            self._drop(session_id)
+        if not turns:
+            return None
+        session = _Session(self.history_capacity)
+        for speaker, content, timestamp in turns:
+            session.append(Turn(speaker, content, timestamp), self.history_capacity)
+        session.total = total
+        self._stored_only.discard(session_id)
+        self.conversations[session_id] = session
+        self.last_active[session_id] = time.time()
+        self.total_bytes += session.bytes
+        return session
+
+    def _session(self, session_id: str) -> Optional[_Session]:
+        """The current copy of a session, loading it from the store only if it may be there."""
+        session = self.conversations.get(session_id)
+        if self.store is None:
+            return session
+        if session is None:
+            if session_id in self._stored_only or self.refresh_interval > 0:
+                session = self._load(session_id)
+        elif self.refresh_interval > 0:
+            now = time.time()
+            if now - session.checked_at >= self.refresh_interval:
+                # Another worker may have added turns
+                session.checked_at = now
+                if self.store.total(session_id) > session.total:
+                    session = self._load(session_id)
+        return session
+
+    def ensure_loaded(self, session_id: str):
+        """Do any store reads a session needs now, e.g. from a worker thread before a turn."""
+        if self.store is not None:
+            with self._lock:
+                self._session(session_id)
+
+    def recover(self) -> int:
+        """Reload the sessions active within ``idle_ttl`` from the store; return how many."""
+        if self.store is None:
+            return 0
+        start = time.time()
+        since = start - self.idle_ttl
+        self.store.compact(since, self.max_turns_per_session)
+        with self._lock:
+            session_ids = self.store.recent_sessions(since, self.max_sessions)
+            # Oldest first, so the LRU order matches the store's
+            for session_id in reversed(session_ids):
+                self._load(session_id)
+        logger.info(f"Recovered {len(session_ids)} sessions in {(time.time() - start) * 1000:.1f}ms")
+        return len(session_ids)
+
+    def close(self):
+        """Flush and close the session store."""
+        if self.store is not None:
+            self.store.close()
+
+    def prune(self) -> int:
+        """Evict idle sessions and any beyond ``max_sessions``; return how many were evicted."""
+        with self._lock:
+            evicted = 0
+            cutoff = time.time() - self.idle_ttl
+            while self.conversations:
+                oldest = next(iter(self.conversations))
+                if self.last_active[oldest] >= cutoff and len(self.conversations) <= self.max_sessions:
+                    break
+                self._drop(oldest)
+                if self.store is not None:
+                    self._stored_only.add(oldest)
+                evicted += 1
+            self.evicted_sessions += evicted
+            return evicted
+
     def add_message(self, session_id: str, speaker: str, content: str):
         """Add a message to the conversation history."""
-        if session_id not in self.conversations:
-            self.conversations[session_id] = []
-            
-        self.conversations[session_id].append({
-            'speaker': speaker,
-            'content': content,
-            'timestamp': time.time()
-        })
-        
+        with self._lock:
+            session = self._session(session_id)
+            if session is None:
+                session = self.conversations[session_id] = _Session(self.history_capacity)
+
+            turn = Turn(speaker, content, time.time())
+            size, trimmed = session.append(turn, self.history_capacity)
+            if self.store is not None:
+                self.store.append(session_id, turn.speaker, turn.content, turn.timestamp)
+            self.trimmed_messages += trimmed
+            self.total_bytes += size
+            self._touch(session_id)
+            self.prune()
+
+    def message_count(self, session_id: str) -> int:
+        """Number of messages ever added to a session."""
+        with self._lock:
+            session = self._session(session_id)
+            return session.total if session else 0
+
+    def get_window(self, session_id: str, max_turns: int = 7) -> Tuple[int, str]:
+        """Return (number of messages in the window, formatted window) for the last ``max_turns`` messages."""
+        with self._lock:
+            if max_turns <= 0:
+                # Same as messages[-0:]: as much history as we keep
+                max_turns = self.max_turns_per_session
+            if max_turns > self.history_capacity:
+                # Keep enough turns for this window from now on
+                self.history_capacity = min(max_turns, self.max_turns_per_session)
+
+            session = self._session(session_id)
+            if session is None:
+                logger.debug(f"No conversation found for session ID: {session_id}")
+                return 0, ""
+
+            self._touch(session_id)
+            count, history = session.window(max_turns)
+        logger.debug("History window read", extra={"session_id": session_id, "turns": count})
+        log_payload(logger, "History window", history, session_id=session_id)
+        return count, history
+
     def get_history(self, session_id: str, max_turns: int = 7) -> str:
         """Get formatted conversation history."""
-        if session_id not in self.conversations:
-            print(f"No conversation found for session ID: {session_id}")
-            return ""
-            
-        history = self.conversations[session_id][-max_turns:]
-        print(f"Found {len(history)} messages for session ID: {session_id}")
-        for i, msg in enumerate(history):
-            print(f"Message {i+1}: {msg['speaker']}: {msg['content']}")
-        
-        return "\n".join([f"{msg['speaker']}: {msg['content']}" for msg in history])
+        return self.get_window(session_id, max_turns)[1]
+
+    def end_session(self, session_id: str) -> bool:
+        """Forget a session; return whether it existed."""
+        with self._lock:
+            existed = session_id in self.conversations or session_id in self._stored_only
+            if session_id in self.conversations:
+                self._drop(session_id)
+            self._stored_only.discard(session_id)
+            if self.store is not None:
+                # Also removes it for other workers sharing the store
+                self.store.delete(session_id)
+            return existed
+
+    def stats(self) -> Dict:
+        """Session counts and approximate memory use."""
+        with self._lock:
+            return {
+                "sessions": len(self.conversations),
+                "messages": sum(len(session.turns) for session in self.conversations.values()),
+                "memory_bytes": self.total_bytes,
+                "evicted_sessions": self.evicted_sessions,
+                "trimmed_messages": self.trimmed_messages,
+                "max_sessions": self.max_sessions,
+                "idle_ttl": self.idle_ttl,
+                "max_turns_per_session": self.max_turns_per_session,
+                "history_capacity": self.history_capacity,
+            }
 
 # Initialize global instances
 vector_store = DialogueVectorStore()
-conversation_manager = ConversationManager()
+conversation_manager = ConversationManager(
+    max_sessions=int(os.getenv("A2I2_MAX_SESSIONS", "1000")),
+    idle_ttl=float(os.getenv("A2I2_SESSION_IDLE_TTL", "3600")),
+    max_turns_per_session=int(os.getenv("A2I2_MAX_TURNS_PER_SESSION", "200")),
+    history_window=int(os.getenv("A2I2_HISTORY_WINDOW", "12")),
+    store=open_session_store(),
+    refresh_interval=float(os.getenv("A2I2_SESSION_REFRESH_INTERVAL", "0")),
+)
 
 # Load dialogues if the file exists
 dialogue_file = 'data_for_train/characterlines.jsonl'
@@ -270,8 +671,8 @@ if os.path.exists(dialogue_file):
     vector_store.add_dialogues(dialogue_file)
    
 else:
-    logging.error(f"Warning: Dialogue file not found at {dialogue_file}")
-    logging.error(f"Current working directory: {os.getcwd()}")
+    logger.error(f"Warning: Dialogue file not found at {dialogue_file}")
+    logger.error(f"Current working directory: {os.getcwd()}")
 
 
 prompt_rag = """System: You are a Fire Department Agent speaking with TownPerson {name} during a fire emergency.
@@ -288,22 +689,163 @@ Current conversation history:
 Based on {name}'s background and the conversation examples, you are the operator to provide an intial greeting for fire rescue.
 Format your output as a direct response without any name prefix or additional context."""
 
-def send_to_openai(prompt: str, model: str = "gpt-4o-mini") -> str:
-    """Query the OpenAI API with the given prompt."""
+# In-flight cached generations, so concurrent identical prompts share one call
+_inflight_generations: Dict[str, "asyncio.Task"] = {}
+
+
+def _start_shared(inflight: Dict, key, coro) -> "asyncio.Task":
+    """Run ``coro`` as a task shared by every caller asking for ``key`` meanwhile.
+
+    Callers await the task through ``asyncio.shield``, so cancelling one of
+    them (e.g. on a client disconnect) neither cancels the call nor leaves
+    the others waiting forever.
+    """
+    task = asyncio.ensure_future(coro)
+    inflight[key] = task
+
+    def forget(done):
+        if inflight.get(key) is done:
+            del inflight[key]
+        if not done.cancelled():
+            # Retrieved here so a task nobody awaits any more does not log
+            # "exception was never retrieved"
+            done.exception()
+
+    task.add_done_callback(forget)
+    return task
+
+
+def _generation_cache_key(prompt, model, temperature, max_tokens, response_format) -> Optional[str]:
+    """The generation cache key for a call, or None if it should not be cached.
+
+    Structured (JSON) calls are classifier calls, which the label cache covers.
+    """
+    if not generation_cache.enabled or response_format is not None:
+        return None
+    return generation_cache.make_key(prompt, model, temperature, max_tokens)
+
+
+@contextmanager
+def _llm_span(purpose: str, model: str, prompt: str):
+    """Trace and meter one backend call."""
+    with span("llm", **{"llm.purpose": purpose, "llm.model": model, "llm.backend": llm_backend.name}) as llm_span:
+        with llm_call(purpose, model, prompt) as call:
+            yield call
+        llm_span.set_attributes(**{"llm.prompt_tokens": call.prompt_tokens,
+                                   "llm.completion_tokens": call.completion_tokens})
+
+
+def _cached_generation(purpose: str, model: str):
+    """Record a generation answered without calling the backend."""
+    record_cached(purpose, model)
+    with span("llm", **{"llm.purpose": purpose, "llm.model": model, "llm.cached": True}):
+        pass
+
+
+def send_to_openai(prompt: str, model: str = "gpt-4o-mini", temperature: float = 0.7,
+                   max_tokens: int = 500, response_format: Optional[Dict] = None,
+                   purpose: str = "generation") -> str:
+    """Query the configured LLM backend with the given prompt.
+
+    ``purpose`` tags the call in the LLM usage metrics (see llm_metrics).
+    """
+    cache_key = _generation_cache_key(prompt, model, temperature, max_tokens, response_format)
+    if cache_key is not None:
+        cached = generation_cache.get(cache_key)
+        if cached is not None:
+            _cached_generation(purpose, model)
+            return cached
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{
-                'role': 'user',
-                'content': prompt,
-            }],
-            temperature=0.7,
-            max_tokens=500
-        )
-        return response.choices[0].message.content.strip()
+        with _llm_span(purpose, model, prompt):
+            text = llm_backend.complete(
+                prompt,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                response_format=response_format
+            )
+            record_completion(text)
     except Exception as e:
-        logging.error(f"Error calling OpenAI API: {str(e)}")
+        logger.error(f"Error calling {llm_backend.name} LLM backend: {str(e)}")
         raise
+    if cache_key is not None:
+        generation_cache.add(cache_key, text)
+    return text
+
+async def send_to_openai_async(prompt: str, model: str = "gpt-4o-mini", temperature: float = 0.7,
+                               max_tokens: int = 500, response_format: Optional[Dict] = None,
+                               purpose: str = "generation") -> str:
+    """Query the configured LLM backend without blocking the event loop."""
+    cache_key = _generation_cache_key(prompt, model, temperature, max_tokens, response_format)
+    if cache_key is None:
+        return await _complete_async(prompt, model, temperature, max_tokens, response_format, purpose)
+
+    cached = generation_cache.get(cache_key)
+    if cached is not None:
+        _cached_generation(purpose, model)
+        return cached
+    # Identical prompts arriving together (e.g. a class starting the same
+    # scenario) share one generation
+    inflight = _inflight_generations.get(cache_key)
+    if inflight is not None:
+        _cached_generation(purpose, model)
+        return await asyncio.shield(inflight)
+
+    return await asyncio.shield(_start_shared(
+        _inflight_generations, cache_key,
+        _cached_complete_async(cache_key, prompt, model, temperature, max_tokens, response_format, purpose)))
+
+async def _cached_complete_async(cache_key, prompt, model, temperature, max_tokens, response_format, purpose) -> str:
+    text = await _complete_async(prompt, model, temperature, max_tokens, response_format, purpose)
+    generation_cache.add(cache_key, text)
+    return text
+
+async def _complete_async(prompt, model, temperature, max_tokens, response_format, purpose) -> str:
+    try:
+        with _llm_span(purpose, model, prompt):
+            text = await get_async_client().complete(
+                prompt,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                response_format=response_format
+            )
+            record_completion(text)
+            return text
+    except Exception as e:
+        logger.error(f"Error calling async LLM backend: {str(e)}")
+        raise
+
+async def send_to_openai_stream(prompt: str, model: str = "gpt-4o-mini", temperature: float = 0.7,
+                                max_tokens: int = 500, purpose: str = "generation"):
+    """Stream the configured LLM backend's reply as text deltas.
+
+    A cached reply is sent as a single delta.
+    """
+    cache_key = _generation_cache_key(prompt, model, temperature, max_tokens, None)
+    if cache_key is not None:
+        cached = generation_cache.get(cache_key)
+        if cached is not None:
+            _cached_generation(purpose, model)
+            yield cached
+            return
+    pieces = []
+    try:
+        with _llm_span(purpose, model, prompt):
+            async for delta in get_async_client().stream(
+                prompt,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens
+            ):
+                pieces.append(delta)
+                yield delta
+            record_completion("".join(pieces))
+    except Exception as e:
+        logger.error(f"Error streaming from async LLM backend: {str(e)}")
+        raise
+    if cache_key is not None:
+        generation_cache.add(cache_key, "".join(pieces).strip())
 
 def clean_response(response: str) -> str:
     """Clean up model response by removing prefixes and system messages."""
@@ -318,47 +860,8 @@ def clean_response(response: str) -> str:
         response = response.replace("Operator:", "").strip()
     return response
 
-def simulate_dual_role_conversation(
-    persona: str,
-    name: str,
-    session_id: Optional[str] = None
-) -> str:
-    """
-    Simulate a conversation using LLM while following a specific conversation flow structure.
-    """
-    if session_id is None:
-        session_id = f"{name}_{int(time.time())}"
-        
-    # Convert name to lowercase for character matching
-    character = name.lower()
-        
-    # Auto mode: generate responses following conversation flow structure
-    history = ""
-    retrieved_info_list = []
-    
-    # Initial operator greeting
-    greeting_prompt = prompt_rag.format(
-        name=name,
-        persona=persona,
-        context="Example greeting: Hello hi, this is Fire Department dispatcher Tanay. Are you okay?",
-        history="",
-        speaker="Agent"
-    )
-    initial_response = clean_response(send_to_openai(greeting_prompt))
-    conversation_manager.add_message(session_id, "Agent", initial_response)
-    
-    history = f"Agent: {initial_response}\n"
-    
-    # Add retrieved info for initial greeting
-    operator_greetings = vector_store.operator_responses.get('greetings', [])
-    retrieved_info_list.append({
-        'speaker': 'Agent',
-        'category': 'greetings',
-        'examples': operator_greetings,
-        'context': f"Category: Greetings\nSpeaker: Agent\n\nExample responses:\n" + "\n".join([f"- {greeting}" for greeting in operator_greetings])
-    })
-    
-    # Conversation flow structure with prompts
+def get_conversation_structure(character: str, name: str) -> List[Dict]:
+    """Return the auto-mode turn plan (speaker, prompt, category) for a character."""
     if character == "bob":
         conversation_structure = [
             {
@@ -861,7 +1364,8 @@ def simulate_dual_role_conversation(
                 "category": "closing"
             }
         ]
-    elif character == "mary" or character == "ben" or character == "ana" or character == "tom" or character == "mia":
+    else:
+        # mary, ben, ana, tom, mia and any character without a scripted flow
         conversation_structure = [
             {
                 "speaker": name,
@@ -948,6 +1452,63 @@ def simulate_dual_role_conversation(
                 {history}"""
             }
             ]
+    return conversation_structure
+
+
+def _greeting_prompt(persona: str, name: str) -> str:
+    return prompt_rag.format(
+        name=name,
+        persona=persona,
+        context="Example greeting: Hello hi, this is Fire Department dispatcher Tanay. Are you okay?",
+        history="",
+        speaker="Agent"
+    )
+
+
+def _greeting_retrieved_info() -> List[Dict]:
+    operator_greetings = vector_store.operator_responses.get('greetings', [])
+    return [{
+        'speaker': 'Agent',
+        'category': 'greetings',
+        'examples': operator_greetings,
+        'context': "Category: Greetings\nSpeaker: Agent\n\nExample responses:\n" + "\n".join([f"- {greeting}" for greeting in operator_greetings])
+    }]
+
+
+def _final_decision(history: str, decision_response: str) -> str:
+    log_payload(logger, "Final conversation", history)
+    if "yes" in decision_response.lower():
+        decision = "Evacuate"
+    else:
+        decision = "Do not evacuate"
+    logger.debug("Dual-role conversation finished", extra={"decision_response": decision_response,
+                                                           "decision": decision})
+    return decision
+
+
+@traced("dual_role_conversation")
+def simulate_dual_role_conversation(
+    persona: str,
+    name: str,
+    session_id: Optional[str] = None
+) -> str:
+    """
+    Simulate a conversation using LLM while following a specific conversation flow structure.
+    """
+    if session_id is None:
+        # Unique per conversation, so concurrent ones never share a history
+        session_id = f"{name}_{time.time_ns()}"
+
+    # Convert name to lowercase for character matching
+    character = name.lower()
+    conversation_structure = get_conversation_structure(character, name)
+
+    # Initial operator greeting
+    initial_response = clean_response(send_to_openai(_greeting_prompt(persona, name), purpose="greeting"))
+    conversation_manager.add_message(session_id, "Agent", initial_response)
+    history = f"Agent: {initial_response}\n"
+    retrieved_info_list = _greeting_retrieved_info()
+
     for turn in conversation_structure:
         # Generate response using the original prompt
         prompt = turn["prompt"].format(
@@ -956,178 +1517,480 @@ def simulate_dual_role_conversation(
             context='',
             history=history
         )
-        
-        # print(f"\nGenerating response for {turn['speaker']}...")
         response = clean_response(send_to_openai(prompt))
-        # print(f"Generated response: {response}")
-        print("-" * 50)
-        
+
         conversation_manager.add_message(session_id, turn["speaker"], response)
         history += f"{turn['speaker']}: {response}\n"
-        
-    
-        
-    print("\n=== Final Conversation ===")
-    print(history)
-    decision_response = decision_making(history, name)
-    print(f"Decision: {decision_response}")
-    print("\n=== Decision ===")
-    if "yes" in decision_response.lower():
-        decision = "Evacuate"
-        print("Evacuate")
-    else:
-        decision = "Do not evacuate"
-        print("Do not evacuate")
 
+    decision = _final_decision(history, decision_making(history, name))
     return history, retrieved_info_list, decision
 
 
-def simulate_interactive_single_turn(town_person, user_input, speaker, persona, turn, session_id=None):
-    """Handle interactive conversation mode."""
+@traced("dual_role_conversation")
+async def simulate_dual_role_conversation_async(
+    persona: str,
+    name: str,
+    session_id: Optional[str] = None
+) -> str:
+    """Async variant of simulate_dual_role_conversation for the server."""
+    if session_id is None:
+        # Unique per conversation, so concurrent ones never share a history
+        session_id = f"{name}_{time.time_ns()}"
+
+    character = name.lower()
+    conversation_structure = get_conversation_structure(character, name)
+
+    initial_response = clean_response(await send_to_openai_async(_greeting_prompt(persona, name), purpose="greeting"))
+    conversation_manager.add_message(session_id, "Agent", initial_response)
+    history = f"Agent: {initial_response}\n"
+    retrieved_info_list = _greeting_retrieved_info()
+
+    for turn in conversation_structure:
+        prompt = turn["prompt"].format(
+            name=name,
+            persona=persona,
+            context='',
+            history=history
+        )
+        response = clean_response(await send_to_openai_async(prompt))
+
+        conversation_manager.add_message(session_id, turn["speaker"], response)
+        history += f"{turn['speaker']}: {response}\n"
+
+    decision = _final_decision(history, await decision_making_async(history, name))
+    return history, retrieved_info_list, decision
+
+
+async def _pipelined_dual_role(persona: str, name: str, session_id: str):
+    try:
+        return await simulate_dual_role_conversation_async(persona, name, session_id=session_id)
+    finally:
+        # The history is returned; a batch of thousands should not keep its sessions
+        conversation_manager.end_session(session_id)
+
+
+async def simulate_dual_role_conversations_async(jobs, concurrency: Optional[int] = None):
+    """Pipelined dual-role simulation of many conversations.
+
+    ``jobs`` yields ``(job_id, persona, name)``. Turns within a conversation
+    depend on each other, so the overlap is across conversations: while one
+    waits for its next LLM call the others proceed, with up to
+    ``concurrency`` conversations in flight (default: the async client's
+    connection limit, so throughput follows the backend's concurrency).
+    Jobs are consumed lazily, so ``jobs`` can be a long generator.
+
+    Yields ``(job_id, result, error)`` in completion order, where ``result``
+    is ``(history, retrieved_info, decision)`` or None if ``error`` is set.
+    """
+    concurrency = max(1, concurrency or get_async_client().max_connections)
+    jobs = iter(jobs)
+    running: Dict["asyncio.Task", str] = {}
+
+    def start_next() -> bool:
+        for job_id, persona, name in jobs:
+            session_id = f"{name}_pipeline_{time.time_ns()}"
+            running[asyncio.ensure_future(_pipelined_dual_role(persona, name, session_id))] = job_id
+            return True
+        return False
+
+    try:
+        while len(running) < concurrency and start_next():
+            pass
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                job_id = running.pop(task)
+                start_next()
+                if task.exception() is not None:
+                    yield job_id, None, task.exception()
+                else:
+                    yield job_id, task.result(), None
+    finally:
+        for task in running:
+            task.cancel()
+
+
+def _last_message(session_id) -> str:
+    """The text of the session's last message, used as the retrieval query."""
+    history = conversation_manager.get_history(session_id)
+    return history.rsplit('\n', 1)[-1].split(':', 1)[-1].strip()
+
+
+async def _turn_query_async(session_id, query=None) -> Optional[np.ndarray]:
+    """The retrieval query vector for an async turn, computed off the event loop.
+
+    ``query`` is a vector the caller already computed for the last message
+    (the server embeds the trainee's line to select the category); otherwise
+    the last message is embedded in a worker thread. None if there is no
+    query or semantic retrieval is unavailable.
+    """
+    if query is None:
+        last_message = _last_message(session_id)
+        return await asyncio.to_thread(vector_store.query_vector, last_message) if last_message else None
+    if vector_store.partitions is None:
+        await asyncio.to_thread(vector_store.ensure_index)
+    return query
+
+
+def _interactive_turn_prompt(town_person, speaker, persona, turn, session_id, query):
+    """Build the prompt for one interactive turn from the session history.
+
+    ``query`` (text, a vector or None) selects the example lines.
+    """
     # Convert name to lowercase for character matching
     name = town_person.lower()
     character = town_person.lower()
-    
-    print(f"simulate_interactive_single_turn called for {town_person} with speaker={speaker}")
-    
-    # Use provided session_id or create a new one
-    if session_id is None:
-        session_id = f"{name}_{int(time.time())}"
-    
+
+    logger.debug("Building interactive turn prompt", extra={"town_person": name, "speaker": speaker})
+
     # Then get the complete history INCLUDING the just-added message
     history = conversation_manager.get_history(session_id)
-    print(f'Current history after adding user input: {history}')
-   
-    # Get responses based on speaker
-    if speaker == "Operator" or speaker == "Julie":
-        responses = vector_store.operator_responses.get(turn["category"], [])
-    else:
-        responses = vector_store.character_responses[character.lower()].get(turn["category"], [])
-    
+    log_payload(logger, "History for interactive turn", history, session_id=session_id)
+
+    # Get the example lines closest to the last message, based on speaker
+    partition = 'operator' if speaker == "Operator" or speaker == "Julie" else character
+    responses = vector_store.examples(partition, turn["category"], query)
+
     context = f"Category: {turn['category']}\nSpeaker: {name}\n\nExample responses:\n" + "\n".join([f"- {response}" for response in responses])
-    #print(f'category: {turn["category"]}, session_id: {session_id}, history lines: {(history.count("\n")+1) if history else 0}')
-    prompt = turn["prompt"].format(
+    return turn["prompt"].format(
             name=name,
             persona=persona,
             context=context,
             history=history
         )
 
-    response = clean_response(send_to_openai(prompt))
 
-    # Determine the response speaker (opposite of input speaker)
-    response_speaker = name  # In interactive mode, response always comes from town person
-    
+def _record_interactive_response(town_person, turn, session_id, response):
+    """Append the generated response to the session and build its retrieved info."""
+    # In interactive mode, response always comes from town person
+    response_speaker = town_person.lower()
+
     retrieved_info = {
         "full_prompt": turn["prompt"],
         "speaker": town_person.lower()
     }
-    
-    print(f"Created retrieved_info dictionary for {town_person} with keys: {retrieved_info.keys()}")
-    
+
     # Add the response to conversation history
     conversation_manager.add_message(session_id, response_speaker, response)
-    print(f'Added response to history: {response_speaker}: {response}')
-    
-    # Get updated history count for debugging
-    updated_history = conversation_manager.get_history(session_id)
-    print(f'Updated history after adding response: {updated_history}')
-    #print(f'Total messages in conversation: {updated_history.count("\n")+1 if updated_history else 0}')
+    logger.debug("Added response to history", extra={"session_id": session_id, "speaker": response_speaker})
 
     return response, retrieved_info
 
 
+def simulate_interactive_single_turn(town_person, user_input, speaker, persona, turn, session_id=None):
+    """Handle interactive conversation mode."""
+    # Use provided session_id or create a new one
+    if session_id is None:
+        session_id = f"{town_person.lower()}_{int(time.time())}"
+
+    with span("interactive_turn", **{"a2i2.town_person": town_person.lower(), "a2i2.category": turn.get("category")}):
+        with span("format_prompt"):
+            prompt = _interactive_turn_prompt(town_person, speaker, persona, turn, session_id,
+                                              _last_message(session_id))
+        raw = send_to_openai(prompt)
+        with span("clean_response"):
+            response = clean_response(raw)
+        with span("record_response"):
+            return _record_interactive_response(town_person, turn, session_id, response)
+
+
+async def simulate_interactive_single_turn_async(town_person, user_input, speaker, persona, turn, session_id=None,
+                                                 query=None):
+    """Async variant of simulate_interactive_single_turn for the server.
+
+    ``query`` is an optional precomputed retrieval vector for the last message.
+    """
+    if session_id is None:
+        session_id = f"{town_person.lower()}_{int(time.time())}"
+
+    with span("interactive_turn", **{"a2i2.town_person": town_person.lower(), "a2i2.category": turn.get("category")}):
+        with span("retrieval_query"):
+            query = await _turn_query_async(session_id, query)
+        with span("format_prompt"):
+            prompt = _interactive_turn_prompt(town_person, speaker, persona, turn, session_id, query)
+        raw = await send_to_openai_async(prompt)
+        with span("clean_response"):
+            response = clean_response(raw)
+        with span("record_response"):
+            return _record_interactive_response(town_person, turn, session_id, response)
+
+
+async def simulate_interactive_single_turn_stream(town_person, user_input, speaker, persona, turn, session_id=None,
+                                                  query=None):
+    """Streaming variant of simulate_interactive_single_turn.
+
+    Yields ``("delta", text)`` for each piece of the raw reply as it arrives,
+    then ``("result", (response, retrieved_info))`` once the cleaned reply
+    has been recorded in the session.
+    """
+    if session_id is None:
+        session_id = f"{town_person.lower()}_{int(time.time())}"
+
+    with span("interactive_turn", **{"a2i2.town_person": town_person.lower(), "a2i2.category": turn.get("category"),
+                                     "a2i2.streamed": True}):
+        with span("retrieval_query"):
+            query = await _turn_query_async(session_id, query)
+        with span("format_prompt"):
+            prompt = _interactive_turn_prompt(town_person, speaker, persona, turn, session_id, query)
+        pieces = []
+        async for delta in send_to_openai_stream(prompt):
+            pieces.append(delta)
+            yield "delta", delta
+        with span("clean_response"):
+            response = clean_response("".join(pieces))
+        with span("record_response"):
+            result = _record_interactive_response(town_person, turn, session_id, response)
+    yield "result", result
+
+
+# Every yes/no check used by the chat flow, answered together by one
+# classification call. The questions mirror the old per-check prompts.
+UTTERANCE_LABELS = {
+    "emphasize_danger": "Is this utterance emphasizing danger?",
+    "emphasize_value_of_life": "Is this utterance emphasizing the value of life?",
+    "mentions_fire": "Does this utterance mention fire?",
+    "keep_asking_questions": "Is this utterance asking about the fire conditions?",
+    "ending_conversation": "Is the last message the end of the conversation? For example, if the speaker says thanks or goodbye or something similar, the conversation is ending.",
+    "ask_about_children": "Does this utterance ask about children?",
+    "ask_about_parents": "Does this utterance ask about parents?",
+    "engagement": "Does the operator express he would like to leave if he is in the situation?",
+}
+
+prompt_classify = """Read the following text from a conversation between a Fire Department operator and a town person during a fire emergency.
+
+Text:
+{text}
+
+Answer each question below with 'yes' or 'no':
+{questions}
+
+Respond with a JSON object that maps each question key to 'yes' or 'no', and nothing else."""
+
+def _label_value(value) -> str:
+    """Normalize a classifier answer to 'yes' or 'no'."""
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    return "yes" if "yes" in str(value).lower() else "no"
+
+
+def _classification_request(text: str, name: Optional[str], model: str):
+    """Return the cache key, label set and prompt for classifying ``text``."""
+    check = f"labels+decision:{name.lower()}" if name else "labels"
+    key = make_key(text, check, model)
+
+    labels = dict(UTTERANCE_LABELS)
+    if name:
+        labels["evacuation_decision"] = f"Based on the conversation, is {name} leaving/going/being evacuated?"
+    questions = "\n".join([f"- {label}: {question}" for label, question in labels.items()])
+    prompt = prompt_classify.format(text=text, questions=questions)
+    return key, labels, prompt
+
+
+def _classification_purpose(name: Optional[str]) -> str:
+    """Usage metrics tag: classifying with a decision is the per-turn decision call."""
+    return "decision" if name else "checks"
+
+
+def _parse_labels(raw: str, labels: Dict[str, str]) -> Optional[Dict[str, str]]:
+    """Parse the classifier's JSON reply; None if it is not usable."""
+    try:
+        parsed = json.loads(raw)
+        return {label: _label_value(parsed.get(label, "no")) for label in labels}
+    except (json.JSONDecodeError, TypeError, AttributeError) as e:
+        logger.warning(f"Could not parse utterance labels, defaulting to 'no': {str(e)}")
+        return None
+
+
+def classify_utterance(text: str, name: Optional[str] = None, model: str = "gpt-4o-mini") -> Dict[str, str]:
+    """Classify text against every utterance label with a single model call.
+
+    When ``name`` is given, the result also carries ``evacuation_decision``:
+    whether ``name`` is leaving/going/being evacuated according to the text.
+    Results live in the shared ``label_cache``, keyed by the normalized text,
+    so asking several checks about the same text, or re-scanning history
+    lines on later turns, only pays for one round trip.
+    """
+    key, labels, prompt = _classification_request(text, name, model)
+    with span("classify", **{"llm.purpose": _classification_purpose(name)}) as classify_span:
+        cached = label_cache.get(key)
+        classify_span.set_attribute("a2i2.label_cache_hit", cached is not None)
+        if cached is not None:
+            record_cached(_classification_purpose(name), model)
+            return cached
+
+        raw = send_to_openai(prompt, model=model, temperature=0, max_tokens=200,
+                             response_format={"type": "json_object"}, purpose=_classification_purpose(name))
+        result = _parse_labels(raw, labels)
+        if result is None:
+            return {label: "no" for label in labels}
+        label_cache.set(key, result)
+        return result
+
+
+# Classification requests currently awaiting the model, by cache key, so
+# concurrent checks on the same text share one request.
+_inflight_classifications: Dict[tuple, "asyncio.Task"] = {}
+
+
+async def classify_utterance_async(text: str, name: Optional[str] = None, model: str = "gpt-4o-mini") -> Dict[str, str]:
+    """Async variant of classify_utterance sharing the same cache."""
+    with span("classify", **{"llm.purpose": _classification_purpose(name)}) as classify_span:
+        return await _classify_utterance_async(text, name, model, classify_span)
+
+
+async def _classify_utterance_async(text, name, model, classify_span) -> Dict[str, str]:
+    key, labels, prompt = _classification_request(text, name, model)
+    cached = label_cache.get(key)
+    classify_span.set_attribute("a2i2.label_cache_hit", cached is not None)
+    if cached is not None:
+        record_cached(_classification_purpose(name), model)
+        return cached
+
+    inflight = _inflight_classifications.get(key)
+    if inflight is not None:
+        record_cached(_classification_purpose(name), model)
+        return await asyncio.shield(inflight)
+
+    return await asyncio.shield(_start_shared(
+        _inflight_classifications, key, _classify_shared(key, labels, prompt, name, model)))
+
+
+async def _classify_shared(key, labels, prompt, name, model) -> Dict[str, str]:
+    raw = await send_to_openai_async(prompt, model=model, temperature=0, max_tokens=200,
+                                     response_format={"type": "json_object"},
+                                     purpose=_classification_purpose(name))
+    result = _parse_labels(raw, labels)
+    if result is None:
+        result = {label: "no" for label in labels}
+    else:
+        label_cache.set(key, result)
+    return result
+
+
 def decision_making(history, name):
-    recent_history = history
-    prompt = f"Based on the previous conversation {recent_history}, determine if {name} is leaving/going/being evacuated or not. If {name} is leaving/going/being evacuated, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+    return classify_utterance(history, name)["evacuation_decision"]
 
-def emphasize_danger_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance is emphasizing danger. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+def emphasize_danger_check(history, name=None):
+    return classify_utterance(history, name)["emphasize_danger"]
 
-def emphasize_value_of_life_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance is emphasizing the value of life. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+def emphasize_value_of_life_check(history, name=None):
+    return classify_utterance(history, name)["emphasize_value_of_life"]
 
-def mentions_fire_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance mentions fire. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+def mentions_fire_check(history, name=None):
+    return classify_utterance(history, name)["mentions_fire"]
 
-def keep_asking_questions_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance is asking about the fire conditions. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+def keep_asking_questions_check(history, name=None):
+    return classify_utterance(history, name)["keep_asking_questions"]
 
-def ending_conversation_check(history):
-    prompt = f"Based on the previous conversation {history}, determine if the last message is the end of the conversation, for example, if the speaker says thanks or goodbye or something similar, it means the conversation is ending. If the conversation is ending, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+def ending_conversation_check(history, name=None):
+    return classify_utterance(history, name)["ending_conversation"]
 
-def ask_about_children_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance asks about children. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+def ask_about_children_check(history, name=None):
+    return classify_utterance(history, name)["ask_about_children"]
 
-def ask_about_parents_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance asks about parents. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+def ask_about_parents_check(history, name=None):
+    return classify_utterance(history, name)["ask_about_parents"]
 
-def engagement_check(history):
-    prompt = f"Based on this utterance {history}, determine if the operator expresses he would like to leave if he is in the situation. If the operator expresses he would like to leave, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+def engagement_check(history, name=None):
+    return classify_utterance(history, name)["engagement"]
+
+
+async def decision_making_async(history, name):
+    return (await classify_utterance_async(history, name))["evacuation_decision"]
+
+async def emphasize_danger_check_async(history, name=None):
+    return (await classify_utterance_async(history, name))["emphasize_danger"]
+
+async def emphasize_value_of_life_check_async(history, name=None):
+    return (await classify_utterance_async(history, name))["emphasize_value_of_life"]
+
+async def mentions_fire_check_async(history, name=None):
+    return (await classify_utterance_async(history, name))["mentions_fire"]
+
+async def keep_asking_questions_check_async(history, name=None):
+    return (await classify_utterance_async(history, name))["keep_asking_questions"]
+
+async def ending_conversation_check_async(history, name=None):
+    return (await classify_utterance_async(history, name))["ending_conversation"]
+
+async def ask_about_children_check_async(history, name=None):
+    return (await classify_utterance_async(history, name))["ask_about_children"]
+
+async def ask_about_parents_check_async(history, name=None):
+    return (await classify_utterance_async(history, name))["ask_about_parents"]
+
+async def engagement_check_async(history, name=None):
+    return (await classify_utterance_async(history, name))["engagement"]
 
 def setup_logging(output_file):
-    # Create a logger
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    
-    # Create file handler
-    file_handler = logging.FileHandler(output_file)
-    file_handler.setLevel(logging.INFO)
-    
-    # Create console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
-    
-    # Create formatter
-    formatter = logging.Formatter('%(message)s')
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-    
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
-    return logger
+    """Copy the CLI's log records (message only) to ``output_file``; stdout is already covered."""
+    add_log_file(output_file, logging.Formatter('%(message)s'))
 
 
 
 
 
-# Example Usage
-if __name__ == "__main__":
+def _generate_runs(persona, name, output_file, runs, resume, concurrency=1):
+    """Append ``runs`` dual-role conversations to a JSONL answers file, skipping runs already done.
+
+    Up to ``concurrency`` conversations are simulated at once (see
+    simulate_dual_role_conversations_async).
+    """
+    try:
+        manifest = start_job(output_file, {"town_person": name, "runs": runs}, resume=resume)
+    except FileExistsError as e:
+        sys.exit(str(e))
+    manifest.total = manifest.config["runs"]
+    manifest.save()
+    pending = [run for run in range(manifest.total) if f"{name}-{run}" not in manifest.completed]
+    print(f"{len(pending)} of {manifest.total} conversations to generate for {name} ({concurrency} at a time)")
+
+    async def generate(writer):
+        jobs = ((f"{name}-{run}", persona, name) for run in pending)
+        async for run_id, result, error in simulate_dual_role_conversations_async(jobs, concurrency):
+            if error is not None:
+                manifest.mark_failed(run_id, str(error))
+                print(f"{run_id}: error: {error}")
+                continue
+            history, retrieved_info, decision = result
+            writer.write({
+                "id": run_id,
+                "conversation": history,
+                "decision": decision,
+                "timestamp": datetime.now().isoformat(),
+                "town_person": name,
+                "persona": persona
+            })
+            print(f"{run_id}: done")
+
+    with JSONLWriter(output_file, on_sync=manifest.mark_completed) as writer:
+        try:
+            asyncio.run(generate(writer))
+        except KeyboardInterrupt:
+            print("Interrupted; run again with --resume to continue")
+    manifest.finish()
+    print(f"Output appended to {output_file} ({len(manifest.completed)}/{manifest.total} done)")
+
+
+def main():
+    """Generate dual-role conversations from the command line.
+
+    With a ``.jsonl`` answers file, each conversation is appended as one line
+    and the job can be resumed (see jsonl_output); otherwise one conversation
+    is written as a JSON file.
+    """
     parser = argparse.ArgumentParser(description="A generator that uses language models to answer questions.")
     parser.add_argument("-persona", "--personafile", required=True, help="File containing persona")
     parser.add_argument("-answer", "--answersfile", required=False, help="File to save generated answers.")
     parser.add_argument("-townperson","--townperson", required=True, help="Town person's name")
-    parser.add_argument("--use-mps", action="store_true", help="Enable MPS (Metal Performance Shaders) backend on macOS.")
+    parser.add_argument("--use-mps", action="store_true", help="Accepted for compatibility; the encoder picks its own device.")
+    parser.add_argument("--runs", type=int, default=1, help="Conversations to generate (needs a .jsonl answers file if > 1)")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted .jsonl job, skipping finished runs")
+    parser.add_argument("--concurrency", type=int, default=1, help="Conversations simulated at once with --runs")
     args = parser.parse_args()
-
-    # Configure device
-    if args.use_mps and torch.backends.mps.is_available():
-        device = "mps"
-        print("Using MPS backend for inference.")
-    else:
-        device = "cpu"
-        print("Using CPU backend for inference.")
-
+    jsonl_output = bool(args.answersfile) and args.answersfile.endswith(".jsonl")
+    if (args.runs > 1 or args.resume) and not jsonl_output:
+        parser.error("--runs and --resume need a .jsonl answers file")
 
     # Generate and save answers
     print("Generating answers...")
@@ -1141,8 +2004,13 @@ if __name__ == "__main__":
         return data
     name = args.townperson
     persona = read_json_file(persona_file)[name]
+    if jsonl_output:
+        # The answers file only holds records; the log goes next to it
+        setup_logging(f"{output_file}.log")
+        _generate_runs(persona, name, output_file, args.runs, args.resume, args.concurrency)
+        return
     if output_file:
-        logger = setup_logging(output_file)
+        setup_logging(output_file)
         print(f"\n=== Conversation Generation Started at {datetime.now()} ===")
         print(f"Town Person: {name}")
         print(f"Persona: {persona}")
@@ -1181,3 +2049,7 @@ if __name__ == "__main__":
 
   
 
+
+# Example Usage
+if __name__ == "__main__":
+    main()
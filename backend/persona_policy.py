@@ -0,0 +1,220 @@
+"""Table-driven conversation policies for the town people.
+
+Each character's behaviour in interactive mode is described declaratively in
+``data_for_train/persona_policy.json``:
+
+* ``checks``: the signals the character reacts to. A check either asks the
+  utterance classifier for a ``label`` or looks for ``keywords``, on one of
+  three sources: the current ``message``, the whole ``history``, or each of
+  the ``history_lines`` (a signal is set if any line matches). Optional
+  ``speaker``, ``min_count``, ``from_line`` and ``line_speaker`` filters
+  restrict when a check runs.
+* ``stages``: for a message count (or ``default``), an ordered list of rules.
+  The first rule whose ``when`` signals include any set signal (or that has
+  no ``when``) picks the reply category and prompt.
+* ``julie_categories`` / ``auto_julie_categories``: category thresholds by
+  message count for the auto Julie mode.
+
+Characters without an entry use ``default``. Character entries override the
+``default`` keys they define. An overrides file (e.g.
+``persona_policy_keywords.json``, used by the keyword-only server) replaces
+keys of the merged character entries, such as their checks and stages. Policies are compiled once into a dispatch
+table with the checks each stage's rules read, so a turn only pays for the
+classifier calls its character needs at that message count.
+"""
+import asyncio
+import json
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+from log_config import get_logger
+
+logger = get_logger("persona_policy")
+
+POLICY_FILE_PATH = os.path.join("data_for_train/persona_policy.json")
+KEYWORD_POLICY_FILE_PATH = os.path.join("data_for_train/persona_policy_keywords.json")
+
+TURN_PROMPT = "You are roleplaying as {Name}, \n{Name}'s background: {persona}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages."
+
+
+def utterance_text(line: str) -> str:
+    """Strip the "speaker: " prefix from a history line.
+
+    The current turn's checks run on the bare user input, so scanning the
+    content of history lines lets later turns hit the label cache instead
+    of re-classifying lines that were already checked.
+    """
+    return line.split(':', 1)[-1].strip()
+
+
+class PersonaPolicy:
+    """A compiled character policy."""
+
+    def __init__(self, name: str, spec: Dict):
+        self.name = name
+        self.use_context = spec.get("use_context", True)
+        self.stages: Dict[int, List[Dict]] = {}
+        self.default_rules: List[Dict] = []
+        for stage, rules in spec.get("stages", {}).items():
+            if stage == "default":
+                self.default_rules = rules
+            else:
+                self.stages[int(stage)] = rules
+        if not self.default_rules:
+            raise ValueError(f"Policy {name} has no default stage")
+
+        checks = spec.get("checks", [])
+        # The checks each stage's rules read, e.g. none for an opening stage
+        # whose only rule has no ``when``
+        self.stage_checks: Dict[int, List[Dict]] = {
+            stage: self._read_checks(checks, rules) for stage, rules in self.stages.items()}
+        self.default_checks = self._read_checks(checks, self.default_rules)
+        used_signals = {check["signal"] for stage_checks in list(self.stage_checks.values()) + [self.default_checks]
+                        for check in stage_checks}
+        self.checks = [check for check in checks if check["signal"] in used_signals]
+        unused = [check["signal"] for check in checks if check["signal"] not in used_signals]
+        if unused:
+            logger.warning(f"Policy {name}: dropping checks no rule reads: {unused}")
+
+        self.julie_categories = spec.get("julie_categories", [])
+        self.auto_julie_categories = spec.get("auto_julie_categories", [])
+
+    @staticmethod
+    def _read_checks(checks: List[Dict], rules: List[Dict]) -> List[Dict]:
+        signals = {signal for rule in rules for signal in rule.get("when", [])}
+        return [check for check in checks if check["signal"] in signals]
+
+    def checks_for(self, message_count: int) -> List[Dict]:
+        """The checks whose signals this message count's rules read."""
+        return self.stage_checks.get(message_count, self.default_checks)
+
+    def select(self, message_count: int, signals: Dict[str, bool]) -> Dict:
+        """Return the first matching rule for this message count."""
+        for rule in self.stages.get(message_count, self.default_rules):
+            when = rule.get("when")
+            if not when or any(signals.get(signal) for signal in when):
+                return rule
+        return self.default_rules[-1]
+
+    def build_turn(self, town_person: str, persona: str, history: str, message_count: int,
+                   signals: Dict[str, bool], examples: Callable[[str], List[str]]) -> Dict:
+        """Build the turn dict passed to simulate_interactive_single_turn.
+
+        ``examples(category)`` returns the character's example lines for the
+        chosen category.
+        """
+        rule = self.select(message_count, signals)
+        category = rule["category"]
+        context = examples(category) if self.use_context else ''
+        prompt_content = rule["prompt"].format(category=category, context=context)
+        return {
+            "speaker": town_person,
+            "prompt": TURN_PROMPT.format(Name=town_person.capitalize(), persona=persona,
+                                         history=history, prompt_content=prompt_content),
+            "category": category
+        }
+
+    def julie_category(self, message_count: int) -> Optional[str]:
+        """Julie's category in auto Julie mode, or None once the conversation is over."""
+        for max_count, category in self.julie_categories:
+            if max_count is None or message_count <= max_count:
+                return category
+        return None
+
+    def auto_julie_category(self, message_count: int) -> Optional[str]:
+        """The town person's reply category in auto Julie mode."""
+        for max_count, category in self.auto_julie_categories:
+            if max_count is None or message_count <= max_count:
+                return category
+        return None
+
+
+def load_policies(file_path: str = POLICY_FILE_PATH, overrides_path: Optional[str] = None) -> Dict[str, PersonaPolicy]:
+    """Load and compile every policy in the policy file, with any overrides applied."""
+    with open(file_path, 'r') as f:
+        specs = json.load(f)
+    overrides = {}
+    if overrides_path is not None:
+        with open(overrides_path, 'r') as f:
+            overrides = json.load(f)
+    default_spec = specs["default"]
+    policies = {}
+    for name in set(specs) | set(overrides):
+        merged = dict(default_spec)
+        merged.update(specs.get(name, {}))
+        merged.update(overrides.get(name, {}))
+        policies[name] = PersonaPolicy(name, merged)
+    logger.info(f"Loaded persona policies: {list(policies.keys())}")
+    return policies
+
+
+# Compiled policies per overrides file (None for the plain policy file)
+_policies: Dict[Optional[str], Dict[str, PersonaPolicy]] = {}
+
+
+def get_policy(town_person: str, overrides_path: Optional[str] = None) -> PersonaPolicy:
+    """Return the compiled policy for a character, falling back to ``default``."""
+    policies = _policies.get(overrides_path)
+    if policies is None:
+        policies = _policies[overrides_path] = load_policies(overrides_path=overrides_path)
+    return policies.get(town_person.lower(), policies["default"])
+
+
+def _plan_checks(policy: PersonaPolicy, history: str, user_input: str, speaker: str,
+                 message_count: int, name: str) -> Tuple[Dict[str, bool], List[Tuple[str, str, str, Optional[str]]]]:
+    """Resolve keyword checks and list the classifier requests a turn needs.
+
+    Returns the keyword signals and a list of (signal, label, text, name)
+    classifier requests. ``name`` is passed for whole-history checks so they
+    share the classifier call made for the evacuation decision.
+    """
+    checks = policy.checks_for(message_count)
+    signals = {check["signal"]: False for check in checks}
+    requests = []
+    if not history or not checks:
+        return signals, requests
+    last_message = user_input.lower()
+    lines = history.split('\n')
+    for check in checks:
+        if message_count < check.get("min_count", 0):
+            continue
+        if check.get("speaker") and speaker != check["speaker"]:
+            continue
+        source = check["source"]
+        if source == "message":
+            texts = [(last_message, None)]
+        elif source == "history":
+            texts = [(history, name)]
+        elif source == "history_lines":
+            texts = [(utterance_text(line), None) for i, line in enumerate(lines, 1)
+                     if i >= check.get("from_line", 1)
+                     and (not check.get("line_speaker") or check["line_speaker"] == line.split(':')[0].lower())]
+        else:
+            raise ValueError(f"Unknown check source: {source}")
+
+        if "keywords" in check:
+            signals[check["signal"]] = any(keyword in text for text, _ in texts for keyword in check["keywords"])
+        else:
+            requests.extend([(check["signal"], check["label"], text, text_name) for text, text_name in texts])
+    return signals, requests
+
+
+def evaluate_signals(policy: PersonaPolicy, history: str, user_input: str, speaker: str,
+                     message_count: int, name: str, classify: Callable) -> Dict[str, bool]:
+    """Run a policy's checks with a sync ``classify(text, name)`` function."""
+    signals, requests = _plan_checks(policy, history, user_input, speaker, message_count, name)
+    for signal, label, text, text_name in requests:
+        if "yes" in classify(text, text_name)[label].lower():
+            signals[signal] = True
+    return signals
+
+
+async def evaluate_signals_async(policy: PersonaPolicy, history: str, user_input: str, speaker: str,
+                                 message_count: int, name: str, classify: Callable) -> Dict[str, bool]:
+    """Run a policy's checks concurrently with an async ``classify(text, name)`` function."""
+    signals, requests = _plan_checks(policy, history, user_input, speaker, message_count, name)
+    results = await asyncio.gather(*[classify(text, text_name) for _, _, text, text_name in requests])
+    for (signal, label, _, _), labels in zip(requests, results):
+        if "yes" in labels[label].lower():
+            signals[signal] = True
+    return signals
@@ -1,14 +1,26 @@
-from fastapi import FastAPI, HTTPException, Request
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from ollama_0220_openai import simulate_interactive_single_turn, conversation_manager, decision_making, emphasize_danger_check, emphasize_value_of_life_check, ending_conversation_check, mentions_fire_check, keep_asking_questions_check, simulate_dual_role_conversation, ask_about_children_check, ask_about_parents_check, engagement_check
-import subprocess
+from ollama_0220_openai import simulate_interactive_single_turn_async, conversation_manager, decision_making_async, simulate_dual_role_conversation_async, classify_utterance_async, simulate_interactive_single_turn_stream, DialogueVectorStore, vector_store
+from persona_policy import get_policy, evaluate_signals_async, utterance_text
 import os
 import json
-import traceback
-from pathlib import Path
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-import time
+import asyncio
+import re
+import uuid
+from label_cache import label_cache
+from generation_cache import generation_cache
+from llm_client import close_async_client, get_async_client
+from llm_metrics import llm_metrics, request_usage
+from tracing import span, traced, tracer
+from log_config import dropped_records, get_logger, log_payload
+
+logger = get_logger("server")
 
 app = FastAPI()
 
@@ -52,52 +64,56 @@ def load_json_file(file_path):
             return json.load(f)
     except Exception as e:
         import pdb; pdb.set_trace()
-        print(f"Error loading {file_path}: {str(e)}")
+        logger.error(f"Error loading {file_path}: {str(e)}")
         return {}
 
-# Function to load JSONL file
-bob_data = None
-niki_data = None
-lindsay_data = None
-ross_data = None
-michelle_data = None
-mary_data = None
-ben_data = None
-ana_data = None
-tom_data = None
-mia_data = None
-with open(DIAL_FILE_PATH, 'r') as f:
-    for line in f:
-        dialogue_data_line = json.loads(line)
-        #import pdb; pdb.set_trace()
-        if dialogue_data_line ['character'] == 'bob':
-            bob_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'niki':
-            niki_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'lindsay':
-            lindsay_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'ross':
-            ross_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'michelle':
-            michelle_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'mary':
-            mary_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'ben':
-            ben_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'ana':
-            ana_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'tom':
-            tom_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'mia':
-            mia_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'operator':
-            operator_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'julie':
-            julie_data = dialogue_data_line
+# Dialogue lines per character, with a semantic index (sharing the engine's
+# encoder, loaded on first use) so prompts carry only the example lines
+# closest to the current turn
+dialogue_index = DialogueVectorStore()
+dialogue_index.add_dialogues(DIAL_FILE_PATH)
+
+async def retrieval_query(text):
+    """Embed a retrieval query off the event loop; None for empty text."""
+    if not text or not text.strip():
+        return None
+    return await asyncio.to_thread(dialogue_index.query_vector, text)
+
+async def load_session(session_id):
+    """Read a session back from the session store, if it needs to be, off the event loop."""
+    if conversation_manager.store is not None:
+        await asyncio.to_thread(conversation_manager.ensure_loaded, session_id)
 
 
 persona_data = load_json_file(PERSONA_FILE_PATH)
-dialogue_data = bob_data
+
+# Heavy models load on first use (or at warmup), so importing the server
+# should stay well under this budget
+IMPORT_BUDGET_SECONDS = float(os.getenv("A2I2_IMPORT_BUDGET", "1.0"))
+IMPORT_SECONDS = time.perf_counter() - _import_started
+if IMPORT_SECONDS > IMPORT_BUDGET_SECONDS:
+    logger.warning(f"Server import took {IMPORT_SECONDS:.2f}s (budget {IMPORT_BUDGET_SECONDS:.2f}s)")
+else:
+    logger.info(f"Server import took {IMPORT_SECONDS:.2f}s")
+
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+
+# Auto Julie rounds one WebSocket message can ask for; conversations end
+# well before this
+MAX_AUTO_JULIE_ROUNDS = 20
+
+def resolve_session_id(data, town_person_lower, request):
+    """Return the conversation's session ID.
+
+    Clients send the ``sessionId`` returned by their first turn. Older
+    clients that send none get one session per client address and
+    character, so different users no longer share a history.
+    """
+    session_id = data.get("sessionId")
+    if session_id and SESSION_ID_PATTERN.match(session_id):
+        return session_id
+    client_host = request.client.host if request.client else "unknown"
+    return f"{town_person_lower}_{uuid.uuid5(uuid.NAMESPACE_URL, client_host).hex}"
 
 # Request body model
 class ChatRequest(BaseModel):
@@ -105,11 +121,103 @@ class ChatRequest(BaseModel):
     userInput: str
     mode: str  # "interactive" or "auto"
 
+# Warmup runs in the background after startup; /ready reports 503 until it
+# is done so load balancers only route traffic to a warm worker
+WARMUP_LLM = os.getenv("A2I2_WARMUP_LLM", "1") == "1"
+warmup_state = {"ready": False, "steps": {}}
+
+async def run_warmup_step(name, step):
+    """Run one warmup step, recording its duration or error."""
+    start = time.perf_counter()
+    try:
+        await step()
+        warmup_state["steps"][name] = {"seconds": round(time.perf_counter() - start, 3)}
+    except Exception as e:
+        logger.error(f"Warmup step {name} failed: {str(e)}")
+        warmup_state["steps"][name] = {"seconds": round(time.perf_counter() - start, 3), "error": str(e)}
+
+async def warmup():
+    """Load models, indexes and policies and open LLM connections ahead of the first chat."""
+    start = time.perf_counter()
+
+    async def load_policies():
+        for town_person_lower in persona_data:
+            get_policy(town_person_lower)
+
+    async def build_indexes():
+        await asyncio.to_thread(dialogue_index.warmup)
+        await asyncio.to_thread(vector_store.warmup)
+
+    async def warm_llm():
+        await get_async_client().warmup()
+
+    await run_warmup_step("policies", load_policies)
+    await run_warmup_step("indexes", build_indexes)
+    if WARMUP_LLM:
+        await run_warmup_step("llm", warm_llm)
+    warmup_state["seconds"] = round(time.perf_counter() - start, 3)
+    warmup_state["ready"] = True
+    logger.info(f"Warmup finished in {warmup_state['seconds']:.2f}s: {warmup_state['steps']}")
+
+@app.on_event("startup")
+async def startup():
+    """Reload recently active sessions from the session store and start warming up."""
+    conversation_manager.recover()
+    app.state.warmup_task = asyncio.create_task(warmup())
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Close pooled LLM connections and flush the session store."""
+    await close_async_client()
+    conversation_manager.close()
+    tracer.flush()
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
     return {"status": "ok", "message": "Emergency Response Chatbot Backend is running"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness check: 200 once warmup has finished, 503 before."""
+    body = dict(warmup_state, import_seconds=round(IMPORT_SECONDS, 3))
+    return JSONResponse(status_code=200 if warmup_state["ready"] else 503, content=body)
+
+@app.get("/stats/label-cache")
+async def label_cache_stats():
+    """Hit/miss counters for the shared utterance label cache."""
+    return label_cache.stats()
+
+@app.get("/stats/generation-cache")
+async def generation_cache_stats():
+    """Hit/miss counters for the opt-in LLM generation cache."""
+    return generation_cache.stats()
+
+@app.get("/stats/sessions")
+async def session_stats():
+    """Session counts and approximate memory held by conversation histories."""
+    return conversation_manager.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """LLM calls, cache hits, tokens and model time, per purpose and per endpoint."""
+    return llm_metrics.snapshot()
+
+@app.get("/stats/tracing")
+async def tracing_stats():
+    """Whether tracing is on, where spans go, and how many traces were exported."""
+    return tracer.stats()
+
+@app.get("/stats/logging")
+async def logging_stats():
+    """Log records dropped because the log queue was full."""
+    return {"dropped_records": dropped_records()}
+
+@app.delete("/session/{session_id}")
+async def end_session(session_id: str):
+    """Forget a conversation, e.g. when the trainee restarts it."""
+    return {"ended": conversation_manager.end_session(session_id)}
+
 @app.get("/persona/{town_person}")
 async def get_persona(town_person: str):
     """Get persona data for a specific town person."""
@@ -126,11 +234,474 @@ async def get_persona(town_person: str):
         return {"persona": persona_data[town_person_lower]}
     except Exception as e:
         import pdb; pdb.set_trace()
-        print(f"Error in get_persona: {str(e)}")
+        logger.error(f"Error in get_persona: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@traced("prepare_turn")
+async def prepare_interactive_turn(session_id, town_person_lower, user_input, speaker, policy):
+    """Record the user's message and build the town person's turn.
+
+    Returns the turn, a task computing the evacuation decision (None
+    without history) and the retrieval query vector of the user's line,
+    which the engine turn reuses instead of embedding it again. The
+    decision does not feed into the character's reply, so it runs
+    alongside the generation and is awaited at the end.
+    """
+    with span("history"):
+        await load_session(session_id)
+        # First, add the user's message to the conversation history
+        if user_input:
+            conversation_manager.add_message(session_id, speaker, user_input)
+            logger.debug("Added user input to history", extra={"session_id": session_id, "speaker": speaker})
+
+        # Get the conversation history to determine stage
+        message_count, history = conversation_manager.get_window(session_id, max_turns=11)
+    logger.debug("Interactive turn", extra={"session_id": session_id, "message_count": message_count})
+
+    decision_task = None
+    if history and message_count >= 0:
+        decision_task = asyncio.ensure_future(decision_making_async(history, town_person_lower))
+    try:
+        # Run the checks this character's policy needs, then let the
+        # policy pick the reply category and prompt
+        async def run_checks():
+            with span("checks"):
+                return await evaluate_signals_async(
+                    policy,
+                    history=history,
+                    user_input=user_input,
+                    speaker=speaker,
+                    message_count=message_count,
+                    name=town_person_lower,
+                    classify=classify_utterance_async
+                )
+
+        async def embed_query():
+            with span("retrieval_query"):
+                return await retrieval_query(user_input)
+
+        # The retrieval query does not depend on the checks, so embed it meanwhile
+        signals, query = await asyncio.gather(run_checks(), embed_query())
+        logger.debug("Policy signals", extra={"town_person": town_person_lower, "signals": signals})
+        with span("select_category") as category_span:
+            turn = policy.build_turn(
+                town_person_lower,
+                persona_data[town_person_lower],
+                history,
+                message_count,
+                signals,
+                lambda category: dialogue_index.examples(town_person_lower, category, query)
+            )
+            category_span.set_attribute("a2i2.category", turn["category"])
+    except Exception:
+        if decision_task is not None:
+            decision_task.cancel()
+        raise
+    return turn, decision_task, query
+
+def finish_interactive_turn(session_id, town_person, town_person_lower, turn, response, retrieved_info):
+    """Make sure the reply is in the history and return its retrieved info."""
+    # Check if response is in history and add it if not
+    history_after = conversation_manager.get_history(session_id, max_turns=12)
+    if not response in history_after:
+        # If response isn't in history already, add it explicitly
+        conversation_manager.add_message(session_id, town_person, response)
+        logger.debug("Explicitly added response to history", extra={"session_id": session_id})
+
+    if isinstance(retrieved_info, dict):
+        # Include the full prompt in the retrieved info for all characters
+        retrieved_info["full_prompt"] = turn["prompt"]
+        # Make sure speaker is set correctly
+        retrieved_info["speaker"] = town_person_lower
+    else:
+        # If retrieved_info is not a dict, create a new one
+        retrieved_info = {
+            "full_prompt": turn["prompt"],
+            "speaker": town_person_lower
+        }
+    return retrieved_info
+
+async def stream_interactive_turn(session_id, town_person, user_input, speaker):
+    """Run one interactive turn, yielding (event, data) pairs as it progresses.
+
+    Events are ``start`` (session and category), ``token`` for each piece
+    of the reply as the model generates it, and ``done`` with the same body
+    /chat returns, or ``error``.
+    """
+    town_person_lower = town_person.lower()
+    decision_task = None
+    try:
+        policy = get_policy(town_person_lower)
+        turn, decision_task, query = await prepare_interactive_turn(
+            session_id, town_person_lower, user_input, speaker, policy)
+        yield "start", {"session_id": session_id, "category": turn["category"]}
+
+        response, retrieved_info = None, None
+        async for kind, value in simulate_interactive_single_turn_stream(
+            town_person_lower,
+            user_input,
+            speaker=speaker,
+            persona=persona_data[town_person_lower],
+            turn=turn,
+            session_id=session_id,
+            query=query
+        ):
+            if kind == "delta":
+                yield "token", {"text": value}
+            else:
+                response, retrieved_info = value
+        retrieved_info = finish_interactive_turn(
+            session_id, town_person, town_person_lower, turn, response, retrieved_info)
+
+        decision_response = await decision_task if decision_task is not None else None
+        yield "done", {
+            "response": response,
+            "retrieved_info": retrieved_info,
+            "category": turn["category"],
+            "decision_response": decision_response,
+            "session_id": session_id
+        }
+    except Exception as e:
+        logger.exception(f"Error in streaming interactive mode: {str(e)}", extra={"session_id": session_id})
+        yield "error", {"error": f"Error generating response: {str(e)}", "session_id": session_id}
+    finally:
+        # Also covers the client disconnecting mid-stream
+        if decision_task is not None and not decision_task.done():
+            decision_task.cancel()
+
+def chat_endpoint(data):
+    """Name under which a /chat request's LLM usage is aggregated."""
+    if data.get("mode", "interactive") == "auto":
+        return "auto"
+    return "auto_julie" if data.get("autoJulie", False) else "interactive"
+
+def wants_usage(data, request=None):
+    """Clients opt in to per-request LLM usage with ``includeUsage`` (or ``?usage=1``)."""
+    return bool(data.get("includeUsage")) or (request is not None and request.query_params.get("usage") == "1")
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@traced("auto_julie_turn")
+async def auto_julie_turn(session_id, town_person, policy, on_julie=None, decide=True):
+    """Generate Julie's next message and the town person's reply to it.
+
+    ``on_julie(julie_response, julie_retrieved_info)`` is awaited as soon as
+    Julie's message exists, so a caller can push it before the reply is
+    generated. With ``decide=False`` the caller computes the decision.
+    """
+    town_person_lower = town_person.lower()
+    decision_response = None
+    await load_session(session_id)
+    # Get the conversation history
+    # Count messages to determine conversation stage
+    message_count, history = conversation_manager.get_window(session_id, max_turns=11)
+    
+    logger.debug("Auto Julie turn", extra={"session_id": session_id, "message_count": message_count})
+    
+    # Check if conversation has ended due to message count
+    conversation_ended = message_count > 10
+    
+    # If conversation has ended, return early with indication
+    if conversation_ended:
+        logger.debug("Conversation has ended due to message count exceeding limit", extra={"session_id": session_id})
+        return {
+            "julieResponse": "Thank you for your time. Stay safe!",
+            "response": "Goodbye, thank you for your help.",
+            "conversation_ended": True,
+            "message": "Conversation has ended.",
+            "session_id": session_id
+        }
+    
+    # Determine which category to use for Julie based on conversation stage
+    julie_category = policy.julie_category(message_count)
+    if julie_category is None:
+        logger.debug("Conversation has ended due to message count exceeding limit", extra={"session_id": session_id})
+        return {
+            "julieResponse": "Thank you for your time. Stay safe!",
+            "response": "Goodbye, thank you for your help.",
+            "conversation_ended": True,
+            "message": "Conversation has ended.",
+            "session_id": session_id
+        }
+    
+    logger.debug("Selected Julie category", extra={"category": julie_category})
+    
+    # Get Julie's dialogue lines for the selected category,
+    # closest to the last message first
+    julie_query = await retrieval_query(utterance_text(history.rsplit('\n', 1)[-1]))
+    julie_context = dialogue_index.examples('julie', julie_category, julie_query)
+    
+    # If category doesn't exist or is empty, use general as fallback
+    if not julie_context:
+        julie_category = "general"
+        julie_context = dialogue_index.examples('julie', "general", julie_query)
+        logger.debug("Fallback to Julie category", extra={"category": julie_category})
+    
+    # # Ensure we have context
+    # if not julie_context:
+    #     julie_context = ["Hi, I'm Julie. I'm here to help you evacuate safely."]
+    #     print("Using default Julie context")
+    
+    # Create the prompt for Julie's response
+    if julie_category == "closing":
+        # Make the closing instruction much more explicit when the category is "closing"
+        julie_prompt_content = f"This conversation is now ending. Generate ONLY a brief goodbye message to {town_person} that clearly ends the conversation. Choose from these closing lines: {julie_context}. Do not ask any questions or continue the conversation."
+    else:
+        julie_prompt_content = f"Generate a message to respond {town_person}. Use or adapt lines from this category: {julie_category}: {julie_context}."
+    
+    # Configure Julie's turn
+    julie_turn = {
+        "speaker": "julie",
+        "prompt": f"You are roleplaying as Julie, an emergency evacuation virtual assistant.\nPrevious conversation:\n{history}\n{julie_prompt_content}\nKeep your response in one short sentence. Only generate utterances, no system messages.",
+        "category": julie_category
+    }
+    
+    try:
+        # Generate Julie's persuasive message
+        julie_response, julie_retrieved_info = await simulate_interactive_single_turn_async(
+            "julie",
+            "",
+            speaker="Julie",
+            persona=persona_data.get("julie", "A virtual assistant specializing in emergency evacuations"),
+            turn=julie_turn,
+            session_id=session_id,
+            query=julie_query
+        )
+        
+        log_payload(logger, "Julie's response", julie_response, session_id=session_id)
+        
+        # Add Julie's message to conversation history
+        # conversation_manager.add_message(session_id, "Julie", julie_response)
+        
+        # Prepare Julie's retrieved info with full prompt
+        if isinstance(julie_retrieved_info, dict):
+            julie_retrieved_info["full_prompt"] = julie_turn["prompt"]
+            julie_retrieved_info["speaker"] = "julie"
+        else:
+            julie_retrieved_info = {
+                "full_prompt": julie_turn["prompt"],
+                "speaker": "julie"
+            }
+        if on_julie is not None:
+            await on_julie(julie_response, julie_retrieved_info)
+        
+        # Now generate town person's response to Julie
+        # Select appropriate category for town person's response
+        town_person_category = policy.auto_julie_category(message_count)
+        julie_response_query = await retrieval_query(julie_response)
+        context = dialogue_index.examples(town_person_lower, town_person_category, julie_response_query)
+        
+        logger.debug("Selected town person category", extra={"category": town_person_category})
+        
+        prompt_content = f"Generate a response to Julie's persuasive message. Use or adapt lines from this {town_person_category}: {context}."
+        
+        # Create turn for town person
+        town_person_turn = {
+            "speaker": town_person_lower,
+            "prompt": f"You are roleplaying as {town_person}, \n{town_person}'s background: {persona_data[town_person_lower]}\nPrevious conversation:\n{history}\n{prompt_content}\nJulie just said: {julie_response}\nPlease generate a response based on this message and keep your response natural and brief. Only generate utterances, no system messages.",
+            "category": town_person_category
+        }
+        
+        # Generate town person's response to Julie
+        response, retrieved_info = await simulate_interactive_single_turn_async(
+            town_person_lower,
+            julie_response,  # Using Julie's message as the input
+            speaker="Julie",
+            persona=persona_data[town_person_lower],
+            turn=town_person_turn,
+            session_id=session_id,
+            query=julie_response_query
+        )
+        
+        log_payload(logger, "Town person's response", response, session_id=session_id)
+        
+        # Add town person's response to history
+        # conversation_manager.add_message(session_id, town_person, response)
+        
+        # Prepare retrieved info
+        if isinstance(retrieved_info, dict):
+            retrieved_info["full_prompt"] = town_person_turn["prompt"]
+            retrieved_info["speaker"] = town_person_lower
+        else:
+            retrieved_info = {
+                "full_prompt": town_person_turn["prompt"],
+                "speaker": town_person_lower
+            }
+        
+        # Get decision response if appropriate
+        updated_history = conversation_manager.get_history(session_id, max_turns=11)
+        if updated_history and decide:
+            decision_response = await decision_making_async(updated_history,town_person_lower)
+        
+        # Return both Julie's message, retrieved info, and town person's response
+        return {
+            "julieResponse": julie_response,
+            "julieRetrievedInfo": julie_retrieved_info,
+            "response": response,
+            "retrieved_info": retrieved_info,
+            "category": town_person_turn["category"],
+            "decision_response": decision_response,
+            "conversation_ended": message_count > 10,
+            "session_id": session_id
+        }
+        
+    except Exception as e:
+        logger.exception(f"Error in 'Auto Julie' mode: {str(e)}", extra={"session_id": session_id})
+        return {"error": f"Error processing Julie's persuasion: {str(e)}"}
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """Streaming variant of /chat using Server-Sent Events.
+
+    A regular interactive turn sends the events of stream_interactive_turn.
+    The streamed text is the raw model output; ``done`` carries the cleaned
+    reply. Other modes are answered with a single ``done`` (or ``error``).
+    """
+    data = await request.json()
+    town_person = data.get("townPerson", "")
+    user_input = data.get("userInput", "")
+    mode = data.get("mode", "interactive")
+    speaker = data.get("speaker", "")
+    town_person_lower = town_person.lower()
+    session_id = resolve_session_id(data, town_person_lower, request)
+
+    async def events():
+        if mode != "interactive" or data.get("autoJulie", False):
+            result = await chat(request)
+            yield sse_event("error" if "error" in result else "done", result)
+            return
+        with span("chat_stream", **{"a2i2.town_person": town_person_lower, "a2i2.session_id": session_id}), \
+                request_usage("stream") as usage:
+            async for event, event_data in stream_interactive_turn(session_id, town_person, user_input, speaker):
+                if event == "done" and wants_usage(data, request):
+                    event_data["llm_usage"] = usage.summary()
+                yield sse_event(event, event_data)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """One conversation over a WebSocket, with the session pinned server-side.
+
+    Connect with ``?townPerson=<name>`` (and ``&sessionId=`` to resume a
+    session); the server replies ``{"type": "session"}``. Then send JSON messages:
+
+    * ``{"type": "turn", "userInput": ..., "speaker": ...}``: streams
+      ``start``, ``token`` and ``done`` events as in /chat/stream.
+    * ``{"type": "auto_julie", "rounds": n}``: runs n (at most
+      MAX_AUTO_JULIE_ROUNDS) auto Julie rounds back to back, pushing
+      ``julie`` as soon as Julie's message exists, then ``reply``. Each
+      round's ``decision`` is computed alongside the next round and pushed
+      when ready. ``ended`` marks the end of the conversation.
+    * ``"includeUsage": true`` on a turn or auto_julie message adds the
+      LLM usage (``llm_usage``) to ``done``/``reply`` events.
+    * ``{"type": "end"}``: forgets the session and closes the socket.
+
+    Every event is a JSON object with its name in ``type``.
+    """
+    await websocket.accept()
+    town_person = websocket.query_params.get("townPerson", "")
+    town_person_lower = town_person.lower()
+    if town_person_lower not in persona_data:
+        await websocket.send_json({"type": "error", "error": f"Unknown town person: {town_person}"})
+        await websocket.close()
+        return
+    # A connection is one conversation unless the client resumes a session
+    session_id = websocket.query_params.get("sessionId", "")
+    if not SESSION_ID_PATTERN.match(session_id):
+        session_id = f"{town_person_lower}_{uuid.uuid4().hex}"
+    policy = get_policy(town_person_lower)
+    send_lock = asyncio.Lock()
+    decision_tasks = set()
+
+    async def send(event, data):
+        # Decisions are pushed from background tasks, so serialize sends
+        async with send_lock:
+            await websocket.send_json({"type": event, **data})
+
+    async def push_decision(history):
+        decision_response = await decision_making_async(history, town_person_lower)
+        await send("decision", {"decision_response": decision_response, "session_id": session_id})
+
+    async def push_julie(julie_response, julie_retrieved_info):
+        await send("julie", {"julieResponse": julie_response, "julieRetrievedInfo": julie_retrieved_info})
+
+    await send("session", {"session_id": session_id, "townPerson": town_person_lower})
+    try:
+        while True:
+            message = await websocket.receive_json()
+            message_type = message.get("type")
+            if message_type == "turn":
+                with span("ws_turn", **{"a2i2.town_person": town_person_lower, "a2i2.session_id": session_id}), \
+                        request_usage("ws_turn") as usage:
+                    async for event, event_data in stream_interactive_turn(
+                            session_id, town_person, message.get("userInput", ""), message.get("speaker", "")):
+                        if event == "done" and wants_usage(message):
+                            event_data["llm_usage"] = usage.summary()
+                        await send(event, event_data)
+            elif message_type == "auto_julie":
+                try:
+                    rounds = int(message.get("rounds", 1))
+                except (TypeError, ValueError, OverflowError):
+                    await send("error", {"error": f"Invalid rounds: {message.get('rounds')!r}"})
+                    continue
+                for _ in range(min(max(1, rounds), MAX_AUTO_JULIE_ROUNDS)):
+                    # The round's decision, pushed later, is not included
+                    with span("ws_auto_julie", **{"a2i2.town_person": town_person_lower,
+                                                  "a2i2.session_id": session_id}), \
+                            request_usage("ws_auto_julie") as usage:
+                        result = await auto_julie_turn(session_id, town_person, policy,
+                                                       on_julie=push_julie, decide=False)
+                    if wants_usage(message):
+                        result["llm_usage"] = usage.summary()
+                    if "error" in result:
+                        await send("error", result)
+                        break
+                    if result.get("conversation_ended"):
+                        await send("ended", result)
+                        break
+                    await send("reply", result)
+                    history = conversation_manager.get_history(session_id, max_turns=11)
+                    task = asyncio.ensure_future(push_decision(history))
+                    decision_tasks.add(task)
+                    task.add_done_callback(decision_tasks.discard)
+            elif message_type == "end":
+                conversation_manager.end_session(session_id)
+                await websocket.close()
+                return
+            else:
+                await send("error", {"error": f"Unknown message type: {message_type}"})
+    except WebSocketDisconnect:
+        logger.debug("WebSocket closed", extra={"session_id": session_id})
+    finally:
+        for task in decision_tasks:
+            task.cancel()
+
 @app.post("/chat")
 async def chat(request: Request):
+    """Run one chat request; ``includeUsage`` adds its LLM usage as ``llm_usage``."""
+    with span("chat") as chat_span:
+        with span("parse_request"):
+            try:
+                data = await request.json()
+            except ValueError as e:
+                return {"error": str(e)}
+        endpoint = chat_endpoint(data)
+        chat_span.set_attributes(**{"a2i2.endpoint": endpoint,
+                                    "a2i2.town_person": str(data.get("townPerson", "")).lower()})
+        with request_usage(endpoint) as usage:
+            result = await handle_chat(request)
+        if isinstance(result, dict):
+            chat_span.set_attributes(**{"a2i2.session_id": result.get("session_id"),
+                                        "a2i2.error": "error" in result})
+        if wants_usage(data, request) and isinstance(result, dict):
+            result["llm_usage"] = usage.summary()
+        return result
+
+async def handle_chat(request: Request):
     try:
         data = await request.json()
         town_person = data.get("townPerson")
@@ -141,864 +712,77 @@ async def chat(request: Request):
         town_person_lower = town_person.lower()
         
         # Debug print to verify parameters
-        print(f"REQUEST: town_person={town_person}, mode={mode}, speaker={speaker}, auto_julie={auto_julie}")
+        logger.info("Chat request", extra={"town_person": town_person_lower, "mode": mode, "speaker": speaker,
+                                           "auto_julie": auto_julie})
         
-        # Simulating session tracking on the server side
-        session_id = f"{town_person_lower}_session"
+        # Per-client session tracking on the server side
+        session_id = resolve_session_id(data, town_person_lower, request)
         decision_response = None  # Initialize decision_response for all town people
 
         # If in interactive mode, the session ID is stable across requests
         if mode == "interactive":
-            print(f"Interactive mode: session_id = {session_id}")
+            policy = get_policy(town_person_lower)
             
             if auto_julie:
-                # Get the conversation history
-                history = conversation_manager.get_history(session_id, max_turns=11)
-                
-                # Count messages to determine conversation stage
-                message_count = 0
-                if history:
-                    message_count = len(history.split('\n'))
-                
-                print(f"Auto Julie mode: message count = {message_count}")
-                
-                # Check if conversation has ended due to message count
-                conversation_ended = message_count > 10
-                
-                # If conversation has ended, return early with indication
-                if conversation_ended:
-                    print("Conversation has ended due to message count exceeding limit")
-                    return {
-                        "julieResponse": "Thank you for your time. Stay safe!",
-                        "response": "Goodbye, thank you for your help.",
-                        "conversation_ended": True,
-                        "message": "Conversation has ended."
-                    }
-                
-                # Determine which category to use for Julie based on conversation stage
-                if message_count <= 1:
-                    julie_category = "greetings"
-                elif message_count <= 5:
-                    if town_person_lower == "bob" or town_person_lower == "michelle":
-                        julie_category = "emphasize_danger"
-                    else:
-                        julie_category = "progression"
-                elif message_count <= 7:
-                    julie_category = "progression"
-                elif message_count <= 9:
-                    julie_category = "closing"
-                else:
-                    print(f"Conversation has ended due to message count exceeding limit")
-                    return {
-                        "julieResponse": "Thank you for your time. Stay safe!",
-                        "response": "Goodbye, thank you for your help.",
-                        "conversation_ended": True,
-                        "message": "Conversation has ended."
-                    }
-                
-                print(f"Selected Julie category: {julie_category}")
-                
-                # Get Julie's dialogue lines for the selected category
-                # Get the lines for Julie from operator_data
-                julie_context = julie_data.get(julie_category, [])
-                
-                # If category doesn't exist or is empty, use general as fallback
-                if not julie_context:
-                    julie_category = "general"
-                    julie_context = julie_data.get("general", [])
-                    print(f"Fallback to Julie category: {julie_category}")
-                
-                # # Ensure we have context
-                # if not julie_context:
-                #     julie_context = ["Hi, I'm Julie. I'm here to help you evacuate safely."]
-                #     print("Using default Julie context")
-                
-                # Tailor the persuasion approach based on town person
-                if town_person_lower == "bob":
-                    persuasion_focus = "Focus on how his work can be continued later or recovered, but his life cannot be replaced."
-                elif town_person_lower == "niki":
-                    persuasion_focus = "Explain the fire danger clearly and directly to address her confusion and uncertainty."
-                elif town_person_lower == "lindsay":
-                    persuasion_focus = "Emphasize the safety of her family and children, offer specific help with evacuating them."
-                elif town_person_lower == "ross":
-                    persuasion_focus = "Use logical arguments about the fire's trajectory and timing to appeal to his practical nature."
-                elif town_person_lower == "michelle":
-                    persuasion_focus = "Be respectful of her independence, provide factual information about the fire rather than giving commands."
-                else:
-                    persuasion_focus = "Emphasize the imminent danger and the need to evacuate immediately."
-                
-                # Create the prompt for Julie's response
-                if julie_category == "closing":
-                    # Make the closing instruction much more explicit when the category is "closing"
-                    julie_prompt_content = f"This conversation is now ending. Generate ONLY a brief goodbye message to {town_person} that clearly ends the conversation. Choose from these closing lines: {julie_context}. Do not ask any questions or continue the conversation."
-                else:
-                    julie_prompt_content = f"Generate a message to respond {town_person}. Use or adapt lines from this category: {julie_category}: {julie_context}."
-                
-                # Configure Julie's turn
-                julie_turn = {
-                    "speaker": "julie",
-                    "prompt": f"You are roleplaying as Julie, an emergency evacuation virtual assistant.\nPrevious conversation:\n{history}\n{julie_prompt_content}\nKeep your response in one short sentence. Only generate utterances, no system messages.",
-                    "category": julie_category
-                }
-                
-                try:
-                    print("Generating Julie's response...")
-                    # Generate Julie's persuasive message
-                    julie_response, julie_retrieved_info = simulate_interactive_single_turn(
-                        "julie",
-                        "",
-                        speaker="Julie",
-                        persona=persona_data.get("julie", "A virtual assistant specializing in emergency evacuations"),
-                        turn=julie_turn,
-                        session_id=session_id
-                    )
-                    
-                    print(f"Julie's response generated: {julie_response}")
-                    print(f"Julie's retrieved info: {julie_retrieved_info}")
-                    
-                    # Add Julie's message to conversation history
-                    # conversation_manager.add_message(session_id, "Julie", julie_response)
-                    
-                    # Prepare Julie's retrieved info with full prompt
-                    if isinstance(julie_retrieved_info, dict):
-                        julie_retrieved_info["full_prompt"] = julie_turn["prompt"]
-                        julie_retrieved_info["speaker"] = "julie"
-                    else:
-                        julie_retrieved_info = {
-                            "full_prompt": julie_turn["prompt"],
-                            "speaker": "julie"
-                        }
-                    
-                    # Now generate town person's response to Julie
-                    # Create appropriate turn for town person based on their character
-                    town_person_category = ""
-                    
-                    # Select appropriate category for town person's response
-                    if town_person_lower == "bob":
-                        if message_count <= 2:
-                            town_person_category = "greetings"
-                        elif message_count <= 5:
-                            town_person_category = "work_resistance"
-                        else:
-                            town_person_category = "minimal_engagement"
-                        context = bob_data[town_person_category]
-                    elif town_person_lower == "niki":
-                        if message_count <= 2:
-                            town_person_category = "greetings"
-                        elif message_count <= 5:
-                            town_person_category = "observations"
-                        else:
-                            town_person_category = "progression"
-                        context = niki_data[town_person_category]
-                    elif town_person_lower == "lindsay":
-                        if message_count <= 2:
-                            town_person_category = "greetings"
-                        elif message_count <= 5:
-                            town_person_category = "observations"
-                        else:
-                            town_person_category = "progression"
-                        context = lindsay_data[town_person_category]
-                    elif town_person_lower == "ross":
-                        if message_count <= 2:
-                            town_person_category = "greetings"
-                        elif message_count <= 5:
-                            town_person_category = "response_to_operator_greetings"
-                        else:
-                            town_person_category = "progression"
-                        context = ross_data[town_person_category]
-                    elif town_person_lower == "michelle":
-                        if message_count <= 2:
-                            town_person_category = "greetings"
-                        elif message_count <= 5:
-                            town_person_category = "response_to_operator_greetings"
-                        else:
-                            town_person_category = "refuse_assistance"
-                        context = michelle_data[town_person_category]
-                    
-                    print(f"Selected town person category: {town_person_category}")
-                    
-                    prompt_content = f"Generate a response to Julie's persuasive message. Use or adapt lines from this {town_person_category}: {context}."
-                    
-                    # Create turn for town person
-                    town_person_turn = {
-                        "speaker": town_person_lower,
-                        "prompt": f"You are roleplaying as {town_person}, \n{town_person}'s background: {persona_data[town_person_lower]}\nPrevious conversation:\n{history}\n{prompt_content}\nJulie just said: {julie_response}\nPlease generate a response based on this message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": town_person_category
-                    }
-                    
-                    print("Generating town person's response...")
-                    # Generate town person's response to Julie
-                    response, retrieved_info = simulate_interactive_single_turn(
-                        town_person_lower,
-                        julie_response,  # Using Julie's message as the input
-                        speaker="Julie",
-                        persona=persona_data[town_person_lower],
-                        turn=town_person_turn,
-                        session_id=session_id
-                    )
-                    
-                    print(f"Town person's response generated: {response}")
-                    
-                    # Add town person's response to history
-                    # conversation_manager.add_message(session_id, town_person, response)
-                    
-                    # Prepare retrieved info
-                    if isinstance(retrieved_info, dict):
-                        retrieved_info["full_prompt"] = town_person_turn["prompt"]
-                        retrieved_info["speaker"] = town_person_lower
-                    else:
-                        retrieved_info = {
-                            "full_prompt": town_person_turn["prompt"],
-                            "speaker": town_person_lower
-                        }
-                    
-                    # Get decision response if appropriate
-                    updated_history = conversation_manager.get_history(session_id, max_turns=11)
-                    if updated_history and len(updated_history.split('\n')) >= 0:
-                        decision_response = decision_making(updated_history,town_person_lower)
-                    
-                    print("Returning Auto Julie response")
-                    # Return both Julie's message, retrieved info, and town person's response
-                    return {
-                        "julieResponse": julie_response,
-                        "julieRetrievedInfo": julie_retrieved_info,
-                        "response": response,
-                        "retrieved_info": retrieved_info,
-                        "category": town_person_turn["category"],
-                        "decision_response": decision_response,
-                        "conversation_ended": message_count > 10
-                    }
-                    
-                except Exception as e:
-                    print(f"Error in 'Auto Julie' mode: {str(e)}")
-                    traceback.print_exc()
-                    return {"error": f"Error processing Julie's persuasion: {str(e)}"}
+                return await auto_julie_turn(session_id, town_person, policy)
             
             else:
                 # Handle regular interactive mode (not auto Julie)
-                # First, add the user's message to the conversation history
-                if user_input:
-                   
-                    conversation_manager.add_message(session_id, speaker, user_input)
-                    print(f"Added user input to history: {speaker}: {user_input}")
-                
-                # Get the conversation history to determine stage
-                history = conversation_manager.get_history(session_id, max_turns=11)
-                message_count = 0
-                if history:
-                    message_count = len(history.split('\n'))
-                
-                print(f"Interactive mode: message count = {message_count}")
-                
-                # Get decision response if we have enough messages
-                if history and message_count >= 0:
-                    decision_response = decision_making(history,town_person_lower)
-                    print(f"Decision response: {decision_response}")
-                
-                # Special structure for Bob with branching logic
-                if town_person_lower == "bob":
-                    # Check if the operator is speaking personally
-                    is_operator_personal = False
-                    emphasizes_danger = False
-                    emphasizes_value_of_life = False
-                    ending_conversation = False
-                    emphasizes_danger_final = False
-                    if history and message_count >= 5:
-                        i=0
-                        for line in history.split('\n'):
-                            i+=1
-                            if i >=4:
-                                ##check if the current line is from operator
-                                if "operator" == line.split(':')[0].lower():
-                                    if "yes" in emphasize_danger_check(line).lower():
-                                        emphasizes_danger_final = True
-            
-                                        break
-                        
-                    if history and message_count >= 0:
-                        decision_response = decision_making(history,town_person_lower)
-                        print(f"Decision response: {decision_response}")
-                        
-                        last_message = user_input.lower()
-                        # Check if message emphasizes fire danger
-                        emphasizes_danger_response = emphasize_danger_check(last_message)
-                        print(f"emphasize_danger_response: {emphasizes_danger_response}")
-                        emphasizes_value_of_life_response = emphasize_value_of_life_check(last_message)
-                        print(f"emphasize_value_of_life_response: {emphasizes_value_of_life_response}")
-                        # if emphasizes_danger == "yes":
-                        #     emphasizes_danger = True
-                        if "yes" in emphasizes_danger_response.lower():
-                            emphasizes_danger = True
-                        if "yes" in emphasizes_value_of_life_response.lower():  
-                            emphasizes_value_of_life = True
-                        # 
-                        if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","sounds good","thank",'thanks',"bye","goodbye","see you"]):
-                            ending_conversation = True
-                        # If both conditions are met, the operator is being personally persuasive
-                        is_operator_personal = emphasizes_danger or emphasizes_value_of_life
-                    
-                    # Determine conversation stage based on message count and operator interaction
-                    category = ""
-                    if message_count == 1:
-                        # Initial dismissal - Bob ignores evacuation warnings
-                        category = "greetings"
-                        # Find Bob's responses in the dialogue data
-                        context = bob_data[category]
-                        
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. If the message came from Julie, show reluctance to even acknowledge her. If the message came from the Operator, be slightly more responsive but still resistant."
-                    
-                    elif message_count ==3 :
-                        # Work-focused resistance - Bob emphasizes his work is too important
-                        category = "work_resistance"
-                        # Find Bob's responses in the dialogue data
-                        context = bob_data[category]
-                        
-                        prompt_content = f"Generate a response focusing heavily on your work being too important to leave behind. Use or adapt lines from this {category}: {context}. If the previous message tried to emphasize danger, respond with skepticism. If the previous message tried to be empathetic, still refuse but with slightly less hostility."
-                    
-                    elif message_count == 5:
-                        print(f"emphasizes_danger_response: {emphasizes_danger_response}")
-                        # Decision point - Either minimal engagement or beginning to consider evacuation
-                        # category = "decision_point" if is_operator_personal else "minimal_engagement"
-                        # print(f"Category: {category}")
-                        
-                        # # Find Bob's responses in the dialogue data
-                        # context = bob_data[category]
-                        
-                        if emphasizes_danger:
-                            category = "decision_point"
-                            context = bob_data[category]
-                            prompt_content = f"Generate a response showing that you're beginning to consider the evacuation warning. The operator has personally emphasized the danger of the fire. Choose from: {context} to show that you're starting to take the threat seriously."
-                        else:
-                            
-                            category = "minimal_engagement"
-                            context = bob_data[category]
-                            prompt_content = f"Generate a response with minimal engagement. Showing frustration at continued persuasion attempts. Use lines from this {category}: {context} that show resistance. Keep your response very brief and show you're disengaging from the conversation."
-                    
-                    elif message_count == 7:
-                        # Final resolution - Either evacuation agreement or final refusal
-                        print(f"emphasizes_value_of_life_response: {emphasizes_value_of_life_response}")
-                        print(f"emphasizes_danger_final: {emphasizes_danger_final}")
-                        if emphasizes_value_of_life or emphasizes_danger_final:
-                            category = "progression"
-                            print(f"Category: {category}")
-                            # Find Bob's responses in the dialogue data
-                            context = bob_data[category]
-                            
-                            prompt_content = f"Generate a response agreeing to evacuate. Please be flexible based on the previous message. The operator has personally convinced you that the danger is real and no work is worth risking your life. Choose from this {category}: {context} like \"Okay, I'm not stupid. Let me just grab my bag and I'll head out.\" Show that you've been convinced to prioritize your safety."
-                        else:
-                            category = "final_refusal"
-                            print(f"Category: {category}")
-                            context = bob_data[category]
-                            
-                            prompt_content = f"Generate your final response refusing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context} to emphasize that you will not leave your work behind. This is your final decision and nothing will change your mind."
-                    else:
-                        if ending_conversation:
-                            category = "closing"
-                            context = bob_data[category]
-                            prompt_content = f"Generate a response ending the conversation. Choose from this {category}: {context} to show that you're done talking."
-                            print(f"Ending conversation")
-                        else:
-                            category = "closing"
-                            context = bob_data[category]
-                            prompt_content = f"Generate a response ending the conversation. Please be flexible based on the previous message. Choose from this {category}: {context} "
-                            # category = "ending_conversation"
-                            # print(f"Category: {category}")
-                            # context = bob_data[category]
-                
-                            # prompt_content = f"Generate a response ending the conversation. Choose from this {category}: {context} to show that you're done talking."
-                
-                    # Create turn object with the selected category and prompt - fix formatting to avoid string format issues
-                    turn = {
-                        "speaker": "bob",
-                        "prompt": f"You are roleplaying as Bob, \nBob's background: {persona_data['bob']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "niki":
-                    keep_asking_questions = False
-                    mentions_fire = False
-                    ending_conversation = False
-                    if history and message_count > 2 and speaker == "Operator":
-                        last_message = history
-                        # Check if message emphasizes fire danger
-                        keep_asking_questions_response = keep_asking_questions_check(history)
-                        if "yes" in keep_asking_questions_response.lower():
-                            keep_asking_questions = True
-                        if ending_conversation_check(history):
-                            if "yes" in ending_conversation_check(history).lower():
-                                ending_conversation = True
-                            else:
-                                ending_conversation = False
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = niki_data[category]
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. If the message came from Julie, show reluctance to even acknowledge her. If the message came from the Operator, be slightly more responsive but shows uncertainty and unware of the danger."
-                    elif message_count == 3:
-                        if mentions_fire:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a response acknowledging the danger and agreeing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-            
-                        else:
-                            category = "response_to_operator_greetings"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a response to the operator's greeting or answer the operator's question. Use or adapt lines from this {category}:{context}. If the message came from Julie, show reluctance to even acknowledge her. If the message came from the Operator, be slightly more responsive but try to confirm the danger."
-                    elif message_count == 5:
-                        print(f"mentions_fire_response: {mentions_fire_response}")
-                        if mentions_fire:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a final response acknowledging the danger and agreeing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-                        elif ending_conversation:
-                            category = "closing"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a final response to the operator or julie that agrees to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-                        elif keep_asking_questions:
-                            category = "observation"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = niki_data[category]
-                        prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 7:
-                        if mentions_fire:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your response acknowledging the danger and agreeing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-                        elif keep_asking_questions:
-                            print(f"keep_asking_questions_response: {keep_asking_questions_response}")
-                            category = "observation_2"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your response to answer the operator's or julie's question. Please be flexible based on the previous message. Choose from this {category}: {context} "
-                        elif ending_conversation:
-                            category = "closing"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your response ending the conversation. Please be flexible based on the previous message. Choose from this {category}: {context} "
-                        else:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your final response finally agreeing to evacuate. Choose from this {category}: {context} "
-
-                    else:
-                        if ending_conversation:
-                            category = "closing"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your response ending the conversation. Choose from this {category}: {context} "
-
-                        else:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your final response finally agreeing to evacuate. Choose from this {category}: {context} "
-                    turn = {
-                        "speaker": "niki",
-                        "prompt": f"You are roleplaying as Niki, \nNiki's background: {persona_data['niki']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "lindsay":
-                    mentions_children = False
-                    mentions_parents = False
-                    ending_conversation = False
-                    mentions_fire = False
-                    mentions_fire_final=False
-                    if history and message_count >= 3:
-                        for line in history.split('\n'):
-                            if "yes" in mentions_fire_check(line).lower():
-                                mentions_fire_final = True
-                                break
-                    if history and message_count > 0 and speaker == "Operator":
-                        last_message = user_input.lower()
-                        ask_about_children_response = ask_about_children_check(last_message)
-                        if "yes" in ask_about_children_response.lower():
-                            mentions_children = True
-                        ask_about_parents_response = ask_about_parents_check(last_message)
-                        if "yes" in ask_about_parents_response.lower():
-                            mentions_parents = True
-                        if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","sounds good","thank",'thanks',"bye","goodbye","see you"]):
-                            ending_conversation = True
-                        mentions_fire_response = mentions_fire_check(last_message)
-                        if "yes" in mentions_fire_response.lower():
-                            mentions_fire = True
-                            mentions_fire_final = True
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = lindsay_data[category]
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 3:
-                        if mentions_fire:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response acknowledging the danger and agreeing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-                            mentions_fire_final = True
-                        else:
-                            category = "response_to_operator_greetings"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to the operator's greeting or answer the operator's question. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 5:
-                        
-                        if mentions_children:
-                            category = "children"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question about the children. Use or adapt lines from this {category}:{context}. "
-                        elif mentions_parents:
-                            category = "parents"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question about the parents. Use or adapt lines from this {category}:{context}. "
-                        elif mentions_fire or mentions_fire_final:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                        elif ending_conversation:
-                            category = "closing"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-            
-                        else:
-                            category = "observations"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question about the fire. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 7:
-                        if mentions_children:
-                            category = "children"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question. Use or adapt lines from this {category}:{context}. "   
-                        elif mentions_parents:
-                            category = "parents"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question. Use or adapt lines from this {category}:{context}. "
-                        elif mentions_fire or mentions_fire_final:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a final response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                        elif ending_conversation:
-                            category = "closing"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    else:
-                        if ending_conversation:
-                            category = "closing"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate your final response finally agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    turn = {
-                        "speaker": "lindsay",
-                        "prompt": f"You are roleplaying as Lindsay, \nLindsay's background: {persona_data['lindsay']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "ross":
-                    ending_conversation = False
-                    if history and message_count > 5 and speaker == "Operator":
-                        last_message = user_input.lower()
-                        if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","sounds good","thank",'thanks',"bye","goodbye","see you"]):
-                            ending_conversation = True
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = ross_data[category]
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 3:
-                        category = "response_to_operator_greetings"
-                        context = ross_data[category]
-                        prompt_content = f"Generate a response to the operator's greeting or answer the operator's question. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 5:
-                        category = "progression"
-                        context = ross_data[category]
-                        prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 7:
-                        if ending_conversation:
-                            category = "closing"
-                            context = ross_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = ross_data[category]
-                            prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    else:
-                        if ending_conversation:
-                            category = "closing"
-                            context = ross_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = ross_data[category]
-                            prompt_content = f"Generate a final response finally agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    turn = {
-                        "speaker": "ross",
-                        "prompt": f"You are roleplaying as Ross, \nRoss's background: {persona_data['ross']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "michelle":
-                    final_engagement=False
-                    engagement=False
-                    if history:
-                        for line in history.split('\n'):
-                            if "yes" in engagement_check(line).lower():
-                                final_engagement = True
-                                break
-                    if history and message_count > 0 and speaker == "Operator":
-                        last_message = user_input.lower()
-                        engagement_response = engagement_check(last_message)
-                        if "yes" in engagement_response.lower():
-                            engagement = True
-                            
-                    ending_conversation = False
-                    if ending_conversation_check(history):
-                        if "yes" in ending_conversation_check(history).lower():
-                            ending_conversation = True
-                        else:
-                            ending_conversation = False
-                    
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = michelle_data[category]
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 3:
-                        category = "response_to_operator_greetings"
-                        context = michelle_data[category]
-                        prompt_content = f"Generate a response to ask the operator if he would like to leave in the situation. Refer to lines from this {category}:{context}."
-                    elif message_count == 5:
-                        print(f'engagement_response: {engagement_response}')
-                        if engagement or final_engagement:
-                            category = "progression"
-                            context = michelle_data[category]
-                            prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "refuse_assistance"
-                            context = michelle_data[category]
-                            prompt_content = f"Generate a response refusing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 7:
-                        if ending_conversation or final_engagement:
-                            category = "closing"
-                            context = michelle_data[category]
-                            prompt_content = f"Generate a final response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "refuse_assistance"
-                            context = michelle_data[category]
-                            prompt_content = f"Generate a final response refusing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    else:
-                        category = "closing"
-                        context = michelle_data[category]
-                        prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                    
-                    turn = {
-                        "speaker": "michelle",
-                        "prompt": f"You are roleplaying as Michelle, \nMichelle's background: {persona_data['michelle']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "mary":
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = ''
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting."
-                    elif message_count == 3:
-                        category = "response_to_operator_greetings"
-                        context = ''
-                        prompt_content = f"Generate a response to the operator's greeting or answer the operator's question."
-                    elif message_count == 5:
-                        category = "progression"
-                        context = ''
-                        prompt_content = f"Generate a response to the operator."
-                    elif message_count == 7:
-                        category = "closing"
-                        context = ''
-                        prompt_content = f"Generate a final response to determine whether you want to be evacuated or not."
-                    else:
-                        category = "closing"
-                        context = ''
-                        prompt_content = f"Generate a final response to operator or julie."
-                    turn = {
-                        "speaker": "mary",
-                        "prompt": f"You are roleplaying as Mary, \nMary's background: {persona_data['mary']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "ben":
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = ''
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting."
-                    elif message_count == 3:
-                        category = "response_to_operator_greetings"
-                        context = ''
-                        prompt_content = f"Generate a response to the operator's greeting or answer the operator's question."
-                    elif message_count == 5:
-                        category = "progression"
-                        context = ''
-                        prompt_content = f"Generate a response to the operator."
-                    elif message_count == 7:
-                        category = "closing"
-                        context = ''
-                        prompt_content = f"Generate a final response to determine whether you want to be evacuated or not."
-                    else:
-                        category = "closing"
-                        context = ''
-                        prompt_content = f"Generate a final response to operator or julie."
-                    turn = {
-                        "speaker": "ben",
-                        "prompt": f"You are roleplaying as Ben, \nBen's background: {persona_data['ben']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "ana":
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = ''
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting."
-                    elif message_count == 3:
-                        category = "response_to_operator_greetings"
-                        context = ''
-                        prompt_content = f"Generate a response to the operator's greeting or answer the operator's question."
-                    elif message_count == 5:
-                        category = "progression"
-                        context = ''
-                        prompt_content = f"Generate a response to the operator."
-                    elif message_count == 7:
-                        category = "closing"
-                        context = ''
-                        prompt_content = f"Generate a final response to determine whether you want to be evacuated or not."
-                    else:
-                        category = "closing"
-                        context = ''
-                        prompt_content = f"Generate a final response to operator or julie."
-                    turn = {
-                        "speaker": "ana",
-                        "prompt": f"You are roleplaying as Ana, \nAna's background: {persona_data['ana']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "tom":
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = ''
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting."
-                    elif message_count == 3:
-                        category = "response_to_operator_greetings"
-                        context = ''
-                        prompt_content = f"Generate a response to the operator's greeting or answer the operator's question."
-                    elif message_count == 5:
-                        category = "progression"
-                        context = ''
-                        prompt_content = f"Generate a response to the operator."
-                    elif message_count == 7:
-                        category = "closing"
-                        context = ''
-                        prompt_content = f"Generate a final response to determine whether you want to be evacuated or not."
-                    else:
-                        category = "closing"
-                        context = ''
-                        prompt_content = f"Generate a final response to operator or julie."
-                    turn = {
-                        "speaker": "tom",
-                        "prompt": f"You are roleplaying as Tom, \nTom's background: {persona_data['tom']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "mia":
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = ''
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting."
-                    elif message_count == 3:
-                        category = "response_to_operator_greetings"
-                        context = ''
-                        prompt_content = f"Generate a response to the operator's greeting or answer the operator's question."
-                    elif message_count == 5:
-                        category = "progression"
-                        context = ''
-                        prompt_content = f"Generate a response to the operator."
-                    elif message_count == 7:
-                        category = "closing"
-                        context = ''
-                        prompt_content = f"Generate a final response to determine whether you want to be evacuated or not."
-                    else:
-                        category = "closing"
-                        context = ''
-                        prompt_content = f"Generate a final response to operator or julie."
-                    turn = {
-                        "speaker": "mia",
-                        "prompt": f"You are roleplaying as Mia, \nMia's background: {persona_data['mia']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
+                decision_task = None
                 try:
-                    # Generate town person's response
-                    response, retrieved_info = simulate_interactive_single_turn(
+                    turn, decision_task, query = await prepare_interactive_turn(
+                        session_id, town_person_lower, user_input, speaker, policy)
+
+                    # Generate town person's response (reusing the query
+                    # vector already embedded for category selection)
+                    response, retrieved_info = await simulate_interactive_single_turn_async(
                         town_person_lower,
                         user_input,
                         speaker=speaker,
                         persona=persona_data[town_person_lower],
                         turn=turn,
-                        session_id=session_id
+                        session_id=session_id,
+                        query=query
                     )
-                    
-                    # Check if response is in history and add it if not
-                    history_after = conversation_manager.get_history(session_id, max_turns=12)
-                    if not response in history_after:
-                        # If response isn't in history already, add it explicitly
-                        conversation_manager.add_message(session_id, town_person, response)
-                        print(f"Explicitly added response to history: {town_person}: {response}")
-                    
-                    # Return town person's response
-                    if isinstance(retrieved_info, dict):
-                        # Include the full prompt in the retrieved info for all characters
-                        full_prompt = turn["prompt"]
-                        retrieved_info["full_prompt"] = full_prompt
-                        print(f"Added full_prompt to retrieved_info for {town_person_lower}")
-                        
-                        # Make sure speaker is set correctly
-                        if town_person_lower == "niki":
-                            retrieved_info["speaker"] = "niki"
-                            print(f"Set Niki's speaker in retrieved_info: {retrieved_info['speaker']}")
-                        elif town_person_lower == "lindsay":
-                            retrieved_info["speaker"] = "lindsay"
-                            print(f"Set Lindsay's speaker in retrieved_info: {retrieved_info['speaker']}")
-                        elif town_person_lower == "ross":
-                            retrieved_info["speaker"] = "ross"
-                            print(f"Set Ross's speaker in retrieved_info: {retrieved_info['speaker']}")
-                        elif town_person_lower == "michelle":
-                            retrieved_info["speaker"] = "michelle"
-                            print(f"Set Michelle's speaker in retrieved_info: {retrieved_info['speaker']}")
-                    else:
-                        # If retrieved_info is not a dict, create a new one
-                        retrieved_info = {
-                            "full_prompt": turn["prompt"],
-                            "speaker": town_person_lower
-                        }
-                    
-                    print(f"Decision response: {decision_response}")    
+                    retrieved_info = finish_interactive_turn(
+                        session_id, town_person, town_person_lower, turn, response, retrieved_info)
+
+                    if decision_task is not None:
+                        decision_response = await decision_task
+                    logger.debug("Decision response", extra={"session_id": session_id,
+                                                             "decision_response": decision_response})
                     return {
                         "response": response,
                         "retrieved_info": retrieved_info,
                         "category": turn["category"],
-                        "decision_response": decision_response
+                        "decision_response": decision_response,
+                        "session_id": session_id
                     }
                     
                 except Exception as e:
-                    print(f"Error in interactive mode: {str(e)}")
-                    traceback.print_exc()
+                    if decision_task is not None:
+                        decision_task.cancel()
+                    logger.exception(f"Error in interactive mode: {str(e)}", extra={"session_id": session_id})
                     return {"error": f"Error generating response: {str(e)}"}
             
         elif mode == "auto":
+            # Each request is a whole conversation: use the client's session
+            # ID if it sent one (never the per-address fallback, which holds
+            # its interactive history) and forget it once the run is over
+            if session_id != data.get("sessionId"):
+                session_id = f"{town_person_lower}_auto_{uuid.uuid4().hex}"
             try:
-                print(f"Starting auto mode generation for {town_person}")
+                logger.debug("Starting auto mode generation", extra={"town_person": town_person_lower,
+                                                                     "session_id": session_id})
                 # Generate the entire conversation at once
-                transcript, retrieved_info, decision = simulate_dual_role_conversation(
+                transcript, retrieved_info, decision = await simulate_dual_role_conversation_async(
                     persona_data[town_person_lower],
-                    town_person # Keep original case for display
+                    town_person, # Keep original case for display
+                    session_id=session_id
                 )
                 
-                print(f"Generated transcript: {transcript}")
-                print(f"Retrieved info: {retrieved_info}")
-                print(f"Decision: {decision}")
+                log_payload(logger, "Generated transcript", transcript, town_person=town_person_lower)
+                logger.debug("Auto mode decision", extra={"town_person": town_person_lower, "decision": decision})
                 
                 return {
                     "transcript": transcript,
@@ -1007,12 +791,12 @@ async def chat(request: Request):
                     "decision": decision}
                  
             except Exception as e:
-                print(f"Error in auto mode generation: {str(e)}")
-                traceback.print_exc()
+                logger.exception(f"Error in auto mode generation: {str(e)}")
                 return {"error": f"Error generating conversation: {str(e)}"}
+            finally:
+                conversation_manager.end_session(session_id)
     except Exception as e:
-        print(f"Error in chat endpoint: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error in chat endpoint: {str(e)}")
         return {"error": str(e)}
 
 if __name__ == "__main__":
@@ -2,7 +2,8 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from ollama_0220 import simulate_interactive_single_turn, conversation_manager
+from ollama_0220 import simulate_interactive_single_turn, conversation_manager, classify_utterance
+from persona_policy import KEYWORD_POLICY_FILE_PATH, get_policy, evaluate_signals
 import subprocess
 import os
 import json
@@ -51,29 +52,20 @@ def load_json_file(file_path):
         print(f"Error loading {file_path}: {str(e)}")
         return {}
 
-# Function to load JSONL file
-bob_data = None
-niki_data = None
-lindsay_data = None
-ross_data = None
-michelle_data = None
+# Dialogue lines by character and category
+character_lines = {}
 with open(DIAL_FILE_PATH, 'r') as f:
     for line in f:
         dialogue_data_line = json.loads(line)
-        if dialogue_data_line ['character'] == 'bob':
-            bob_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'niki':
-            niki_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'lindsay':
-            lindsay_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'ross':
-            ross_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'michelle':
-            michelle_data = dialogue_data_line
+        character_lines[dialogue_data_line['character']] = dialogue_data_line
+
+
+def examples(town_person, category):
+    """A character's example lines for a category."""
+    return character_lines.get(town_person, {}).get(category, [])
 
 
 persona_data = load_json_file(PERSONA_FILE_PATH)
-dialogue_data = bob_data
 
 # Request body model
 class ChatRequest(BaseModel):
@@ -252,19 +244,7 @@ async def chat(request: Request):
                         full_prompt = turn["prompt"]
                         retrieved_info["full_prompt"] = full_prompt
                         
-                        # Make sure speaker is set correctly
-                        if town_person_lower == "niki":
-                            retrieved_info["speaker"] = "niki"
-                            print(f"Set Niki's speaker in retrieved_info: {retrieved_info['speaker']}")
-                        elif town_person_lower == "lindsay":
-                            retrieved_info["speaker"] = "lindsay"
-                            print(f"Set Lindsay's speaker in retrieved_info: {retrieved_info['speaker']}")
-                        elif town_person_lower == "ross":
-                            retrieved_info["speaker"] = "ross"
-                            print(f"Set Ross's speaker in retrieved_info: {retrieved_info['speaker']}")
-                        elif town_person_lower == "michelle":
-                            retrieved_info["speaker"] = "michelle"
-                            print(f"Set Michelle's speaker in retrieved_info: {retrieved_info['speaker']}")
+                        retrieved_info["speaker"] = town_person_lower
                     else:
                         # If retrieved_info is not a dict, create a new one
                         retrieved_info = {
@@ -300,339 +280,27 @@ async def chat(request: Request):
                 
                 print(f"Interactive mode: message count = {message_count}")
                 
-                # Special structure for Bob with branching logic
-                if town_person_lower == "bob":
-                    # Check if the operator is speaking personally
-                    is_operator_personal = False
-                    emphasizes_danger = False
-                    emphasizes_value_of_life = False
-                    ending_conversation = False
-                    # Analyze last message if it exists and is from the Operator
-                    if history and message_count > 0 and speaker == "Operator":
-                        last_message = user_input.lower()
-                        # Check if message emphasizes fire danger
-                        if any(keyword in last_message for keyword in ["danger", "fire", "emergency", "threatening",'die']):
-                            emphasizes_danger = True
-                        # Check if message emphasizes that work is not worth the risk
-                        if any(keyword in last_message for keyword in ["not worth", "work isn't worth", "nothing is worth", "life"]):
-                            emphasizes_value_of_life = True
-                        if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","sounds good","thank",'thanks',"bye","goodbye","see you"]):
-                            ending_conversation = True
-                        # If both conditions are met, the operator is being personally persuasive
-                        is_operator_personal = emphasizes_danger or emphasizes_value_of_life
-                    
-                    # Determine conversation stage based on message count and operator interaction
-                    category = ""
-                    if message_count == 1:
-                        # Initial dismissal - Bob ignores evacuation warnings
-                        category = "greetings"
-                        # Find Bob's responses in the dialogue data
-                        context = bob_data[category]
-                        
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. If the message came from Julie, show reluctance to even acknowledge her. If the message came from the Operator, be slightly more responsive but still resistant."
-                    
-                    elif message_count ==3 :
-                        # Work-focused resistance - Bob emphasizes his work is too important
-                        category = "work_resistance"
-                        # Find Bob's responses in the dialogue data
-                        context = bob_data[category]
-                        
-                        prompt_content = f"Generate a response focusing heavily on your work being too important to leave behind. Use or adapt lines from this {category}: {context}. If the previous message tried to emphasize danger, respond with skepticism. If the previous message tried to be empathetic, still refuse but with slightly less hostility."
-                    
-                    elif message_count == 5:
-                        # Decision point - Either minimal engagement or beginning to consider evacuation
-                        # category = "decision_point" if is_operator_personal else "minimal_engagement"
-                        # print(f"Category: {category}")
-                        
-                        # # Find Bob's responses in the dialogue data
-                        # context = bob_data[category]
-                        
-                        if emphasizes_danger:
-                            category = "decision_point"
-                            context = bob_data[category]
-                            prompt_content = f"Generate a response showing that you're beginning to consider the evacuation warning. The operator has personally emphasized the danger of the fire. Choose from: {context} to show that you're starting to take the threat seriously."
-                        else:
-                            category = "minimal_engagement"
-                            context = bob_data[category]
-                            prompt_content = f"Generate a response with minimal engagement. Showing frustration at continued persuasion attempts. Use lines from this {category}: {context} that show resistance. Keep your response very brief and show you're disengaging from the conversation."
-                    
-                    elif message_count == 7:
-                        # Final resolution - Either evacuation agreement or final refusal
-                        if emphasizes_value_of_life or emphasizes_danger:
-                            category = "progression"
-                            print(f"Category: {category}")
-                            # Find Bob's responses in the dialogue data
-                            context = bob_data[category]
-                            
-                            prompt_content = f"Generate a response agreeing to evacuate. Please be flexible based on the previous message. The operator has personally convinced you that the danger is real and no work is worth risking your life. Choose from this {category}: {context} like \"Okay, I'm not stupid. Let me just grab my bag and I'll head out.\" Show that you've been convinced to prioritize your safety."
-                        else:
-                            category = "final_refusal"
-                            print(f"Category: {category}")
-                            context = bob_data[category]
-                            
-                            prompt_content = f"Generate your final response refusing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context} to emphasize that you will not leave your work behind. This is your final decision and nothing will change your mind."
-                    else:
-                        if ending_conversation:
-                            print(f"Ending conversation")
-                            # category = "ending_conversation"
-                            # print(f"Category: {category}")
-                            # context = bob_data[category]
-                
-                            # prompt_content = f"Generate a response ending the conversation. Choose from this {category}: {context} to show that you're done talking."
-                
-                    # Create turn object with the selected category and prompt - fix formatting to avoid string format issues
-                    turn = {
-                        "speaker": "bob",
-                        "prompt": f"You are roleplaying as Bob, \nBob's background: {persona_data['bob']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "niki":
-                    keep_asking_questions = False
-                    mentions_fire = False
-                    ending_conversation = False
-                    if history and message_count > 2 and speaker == "Operator":
-                        last_message = user_input.lower()
-                        # Check if message emphasizes fire danger
-                        if any(keyword in last_message for keyword in ["?"]):
-                            keep_asking_questions = True
-                        if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","sounds good","thank",'thanks',"bye","goodbye","see you"]):
-                            ending_conversation = True
-                        if any(keyword in last_message for keyword in ["fire", "danger", "emergency", "threatening",'die','evacuate','safety','drone', 'drones']):
-                            mentions_fire = True
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = niki_data[category]
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. If the message came from Julie, show reluctance to even acknowledge her. If the message came from the Operator, be slightly more responsive but shows uncertainty and unware of the danger."
-                    elif message_count == 3:
-                        if mentions_fire:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a response acknowledging the danger and agreeing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-            
-                        else:
-                            category = "response_to_operator_greetings"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a response to the operator's greeting or answer the operator's question. Use or adapt lines from this {category}:{context}. If the message came from Julie, show reluctance to even acknowledge her. If the message came from the Operator, be slightly more responsive but try to confirm the danger."
-                    elif message_count == 5:
-                        if mentions_fire:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a final response acknowledging the danger and agreeing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-                        elif ending_conversation:
-                            category = "closing"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a final response to the operator or julie that agrees to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-                        else:
-                            category = "observations"
-                            context = niki_data[category]
-                        prompt_content = f"Generate a response to answer the operator's or julie's question. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 7:
-                        if mentions_fire:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your response acknowledging the danger and agreeing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-                        elif keep_asking_questions:
-                            category = "observation_2"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your response to answer the operator's or julie's question. Please be flexible based on the previous message. Choose from this {category}: {context} "
-                        else:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your final response finally agreeing to evacuate. Choose from this {category}: {context} "
-
-                    else:
-                        if ending_conversation:
-                            category = "closing"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your response ending the conversation. Choose from this {category}: {context} "
-                            breakpoint()
-
-                        else:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your final response finally agreeing to evacuate. Choose from this {category}: {context} "
-                    turn = {
-                        "speaker": "niki",
-                        "prompt": f"You are roleplaying as Niki, \nNiki's background: {persona_data['niki']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "lindsay":
-                    mentions_children = False
-                    mentions_parents = False
-                    ending_conversation = False
-                    mentions_fire = False
-                    if history and message_count > 0 and speaker == "Operator":
-                        last_message = user_input.lower()
-                        # Check if message emphasizes fire danger
-                        if any(keyword and '?' in last_message for keyword in ["children", "kid", "kids"]):
-                            mentions_children = True
-                        if any(keyword and '?' in last_message for keyword in ["parents", "parent", "mom", "dad"]):
-                            mentions_parents = True
-                        if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","sounds good","thank",'thanks',"bye","goodbye","see you"]):
-                            ending_conversation = True
-                        if any(keyword in last_message for keyword in ["fire", "danger", "emergency", "threatening",'die','evacuate','safety', 'drone', 'drones']):
-                            mentions_fire = True
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = lindsay_data[category]
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 3:
-                        if mentions_fire:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response acknowledging the danger and agreeing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-                        else:
-                            category = "response_to_operator_greetings"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to the operator's greeting or answer the operator's question. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 5:
-                        if mentions_children:
-                            category = "children"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question about the children. Use or adapt lines from this {category}:{context}. "
-                        elif mentions_parents:
-                            category = "parents"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question about the parents. Use or adapt lines from this {category}:{context}. "
-                        elif mentions_fire:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                        elif ending_conversation:
-                            category = "closing"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-            
-                        else:
-                            category = "observations"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question about the fire. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 7:
-                        if mentions_children:
-                            category = "children"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question. Use or adapt lines from this {category}:{context}. "   
-                        elif mentions_parents:
-                            category = "parents"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question. Use or adapt lines from this {category}:{context}. "
-                        elif mentions_fire:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a final response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                        elif ending_conversation:
-                            category = "closing"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    else:
-                        if ending_conversation:
-                            category = "closing"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate your final response finally agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    turn = {
-                        "speaker": "lindsay",
-                        "prompt": f"You are roleplaying as Lindsay, \nLindsay's background: {persona_data['lindsay']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "ross":
-                    ending_conversation = False
-                    if history and message_count > 5 and speaker == "Operator":
-                        last_message = user_input.lower()
-                        if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","sounds good","thank",'thanks',"bye","goodbye","see you"]):
-                            ending_conversation = True
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = ross_data[category]
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 3:
-                        category = "response_to_operator_greetings"
-                        context = ross_data[category]
-                        prompt_content = f"Generate a response to the operator's greeting or answer the operator's question. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 5:
-                        category = "progression"
-                        context = ross_data[category]
-                        prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 7:
-                        if ending_conversation:
-                            category = "closing"
-                            context = ross_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = ross_data[category]
-                            prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    else:
-                        if ending_conversation:
-                            category = "closing"
-                            context = ross_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = ross_data[category]
-                            prompt_content = f"Generate a final response finally agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    turn = {
-                        "speaker": "ross",
-                        "prompt": f"You are roleplaying as Ross, \nRoss's background: {persona_data['ross']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "michelle":
-                    engagement=False
-                    if history and message_count > 0 and speaker == "Operator":
-                        last_message = user_input.lower()
-                        if any(keyword in last_message for keyword in ["worry","worried","understand","best"]):
-                            engagement = True
-                    ending_conversation = False
-                    if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","good","thank",'thanks',"bye","goodbye","see you"]):
-                        ending_conversation = True
-                    
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = michelle_data[category]
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 3:
-                        category = "response_to_operator_greetings"
-                        context = michelle_data[category]
-                        prompt_content = f"Generate a response to the operator's greeting or answer the operator's question. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 5:
-                        if engagement:
-                            category = "progression"
-                            context = michelle_data[category]
-                            prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "refuse_assistance"
-                            context = michelle_data[category]
-                            prompt_content = f"Generate a response refusing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 7:
-                        if ending_conversation:
-                            category = "progression"
-                            context = michelle_data[category]
-                            prompt_content = f"Generate a final response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "refuse_assistance"
-                            context = michelle_data[category]
-                            prompt_content = f"Generate a final response refusing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    else:
-                        category = "closing"
-                        context = michelle_data[category]
-                        prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                    
-                    turn = {
-                        "speaker": "michelle",
-                        "prompt": f"You are roleplaying as Michelle, \nMichelle's background: {persona_data['michelle']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
+                # Let the character's keyword policy pick the reply category and
+                # prompt from the checks its stage reads
+                policy = get_policy(town_person_lower, KEYWORD_POLICY_FILE_PATH)
+                signals = evaluate_signals(
+                    policy,
+                    history=history,
+                    user_input=user_input,
+                    speaker=speaker,
+                    message_count=message_count,
+                    name=town_person_lower,
+                    classify=classify_utterance
+                )
+                print(f"Policy signals: {signals}")
+                turn = policy.build_turn(
+                    town_person_lower,
+                    persona_data[town_person_lower],
+                    history,
+                    message_count,
+                    signals,
+                    lambda category: examples(town_person_lower, category)
+                )
                         
                 try:
                     # Generate town person's response
@@ -659,19 +327,7 @@ async def chat(request: Request):
                         retrieved_info["full_prompt"] = full_prompt
                         print(f"Added full_prompt to retrieved_info for {town_person_lower}")
                         
-                        # Make sure speaker is set correctly
-                        if town_person_lower == "niki":
-                            retrieved_info["speaker"] = "niki"
-                            print(f"Set Niki's speaker in retrieved_info: {retrieved_info['speaker']}")
-                        elif town_person_lower == "lindsay":
-                            retrieved_info["speaker"] = "lindsay"
-                            print(f"Set Lindsay's speaker in retrieved_info: {retrieved_info['speaker']}")
-                        elif town_person_lower == "ross":
-                            retrieved_info["speaker"] = "ross"
-                            print(f"Set Ross's speaker in retrieved_info: {retrieved_info['speaker']}")
-                        elif town_person_lower == "michelle":
-                            retrieved_info["speaker"] = "michelle"
-                            print(f"Set Michelle's speaker in retrieved_info: {retrieved_info['speaker']}")
+                        retrieved_info["speaker"] = town_person_lower
                     else:
                         # If retrieved_info is not a dict, create a new one
                         retrieved_info = {
@@ -1,7 +1,8 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from ollama_0220 import simulate_interactive_single_turn, conversation_manager, decision_making, emphasize_danger_check, emphasize_value_of_life_check, ending_conversation_check, mentions_fire_check, keep_asking_questions_check, simulate_dual_role_conversation, ask_about_children_check, ask_about_parents_check, engagement_check
+from ollama_0220 import simulate_interactive_single_turn, conversation_manager, decision_making, classify_utterance, simulate_dual_role_conversation
+from persona_policy import get_policy, evaluate_signals
 import subprocess
 import os
 import json
@@ -50,34 +51,20 @@ def load_json_file(file_path):
         print(f"Error loading {file_path}: {str(e)}")
         return {}
 
-# Function to load JSONL file
-bob_data = None
-niki_data = None
-lindsay_data = None
-ross_data = None
-michelle_data = None
+# Dialogue lines by character and category
+character_lines = {}
 with open(DIAL_FILE_PATH, 'r') as f:
     for line in f:
         dialogue_data_line = json.loads(line)
-        #import pdb; pdb.set_trace()
-        if dialogue_data_line ['character'] == 'bob':
-            bob_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'niki':
-            niki_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'lindsay':
-            lindsay_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'ross':
-            ross_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'michelle':
-            michelle_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'operator':
-            operator_data = dialogue_data_line
-        if dialogue_data_line ['character'] == 'julie':
-            julie_data = dialogue_data_line
+        character_lines[dialogue_data_line['character']] = dialogue_data_line
+
+
+def examples(town_person, category):
+    """A character's example lines for a category."""
+    return character_lines.get(town_person, {}).get(category, [])
 
 
 persona_data = load_json_file(PERSONA_FILE_PATH)
-dialogue_data = bob_data
 
 # Request body model
 class ChatRequest(BaseModel):
@@ -156,18 +143,9 @@ async def chat(request: Request):
                     }
                 
                 # Determine which category to use for Julie based on conversation stage
-                if message_count <= 1:
-                    julie_category = "greetings"
-                elif message_count <= 5:
-                    if town_person_lower == "bob" or town_person_lower == "michelle":
-                        julie_category = "emphasize_danger"
-                    else:
-                        julie_category = "progression"
-                elif message_count <= 7:
-                    julie_category = "progression"
-                elif message_count <= 9:
-                    julie_category = "closing"
-                else:
+                policy = get_policy(town_person_lower)
+                julie_category = policy.julie_category(message_count)
+                if julie_category is None:
                     print(f"Conversation has ended due to message count exceeding limit")
                     return {
                         "julieResponse": "Thank you for your time. Stay safe!",
@@ -179,13 +157,12 @@ async def chat(request: Request):
                 print(f"Selected Julie category: {julie_category}")
                 
                 # Get Julie's dialogue lines for the selected category
-                # Get the lines for Julie from operator_data
-                julie_context = julie_data.get(julie_category, [])
+                julie_context = examples('julie', julie_category)
                 
                 # If category doesn't exist or is empty, use general as fallback
                 if not julie_context:
                     julie_category = "general"
-                    julie_context = julie_data.get("general", [])
+                    julie_context = examples('julie', "general")
                     print(f"Fallback to Julie category: {julie_category}")
                 
                 # # Ensure we have context
@@ -193,20 +170,6 @@ async def chat(request: Request):
                 #     julie_context = ["Hi, I'm Julie. I'm here to help you evacuate safely."]
                 #     print("Using default Julie context")
                 
-                # Tailor the persuasion approach based on town person
-                if town_person_lower == "bob":
-                    persuasion_focus = "Focus on how his work can be continued later or recovered, but his life cannot be replaced."
-                elif town_person_lower == "niki":
-                    persuasion_focus = "Explain the fire danger clearly and directly to address her confusion and uncertainty."
-                elif town_person_lower == "lindsay":
-                    persuasion_focus = "Emphasize the safety of her family and children, offer specific help with evacuating them."
-                elif town_person_lower == "ross":
-                    persuasion_focus = "Use logical arguments about the fire's trajectory and timing to appeal to his practical nature."
-                elif town_person_lower == "michelle":
-                    persuasion_focus = "Be respectful of her independence, provide factual information about the fire rather than giving commands."
-                else:
-                    persuasion_focus = "Emphasize the imminent danger and the need to evacuate immediately."
-                
                 # Create the prompt for Julie's response
                 if julie_category == "closing":
                     # Make the closing instruction much more explicit when the category is "closing"
@@ -250,50 +213,9 @@ async def chat(request: Request):
                         }
                     
                     # Now generate town person's response to Julie
-                    # Create appropriate turn for town person based on their character
-                    town_person_category = ""
-                    
                     # Select appropriate category for town person's response
-                    if town_person_lower == "bob":
-                        if message_count <= 2:
-                            town_person_category = "greetings"
-                        elif message_count <= 5:
-                            town_person_category = "work_resistance"
-                        else:
-                            town_person_category = "minimal_engagement"
-                        context = bob_data[town_person_category]
-                    elif town_person_lower == "niki":
-                        if message_count <= 2:
-                            town_person_category = "greetings"
-                        elif message_count <= 5:
-                            town_person_category = "observations"
-                        else:
-                            town_person_category = "progression"
-                        context = niki_data[town_person_category]
-                    elif town_person_lower == "lindsay":
-                        if message_count <= 2:
-                            town_person_category = "greetings"
-                        elif message_count <= 5:
-                            town_person_category = "observations"
-                        else:
-                            town_person_category = "progression"
-                        context = lindsay_data[town_person_category]
-                    elif town_person_lower == "ross":
-                        if message_count <= 2:
-                            town_person_category = "greetings"
-                        elif message_count <= 5:
-                            town_person_category = "response_to_operator_greetings"
-                        else:
-                            town_person_category = "progression"
-                        context = ross_data[town_person_category]
-                    elif town_person_lower == "michelle":
-                        if message_count <= 2:
-                            town_person_category = "greetings"
-                        elif message_count <= 5:
-                            town_person_category = "response_to_operator_greetings"
-                        else:
-                            town_person_category = "refuse_assistance"
-                        context = michelle_data[town_person_category]
+                    town_person_category = policy.auto_julie_category(message_count)
+                    context = examples(town_person_lower, town_person_category)
                     
                     print(f"Selected town person category: {town_person_category}")
                     
@@ -375,405 +297,27 @@ async def chat(request: Request):
                     decision_response = decision_making(history,town_person_lower)
                     print(f"Decision response: {decision_response}")
                 
-                # Special structure for Bob with branching logic
-                if town_person_lower == "bob":
-                    # Check if the operator is speaking personally
-                    is_operator_personal = False
-                    emphasizes_danger = False
-                    emphasizes_value_of_life = False
-                    ending_conversation = False
-                    emphasizes_danger_final = False
-                    if history and message_count >= 5:
-                        i=0
-                        for line in history.split('\n'):
-                            i+=1
-                            if i >=4:
-                                ##check if the current line is from operator
-                                if "operator" == line.split(':')[0].lower():
-                                    if "yes" in emphasize_danger_check(line).lower():
-                                        emphasizes_danger_final = True
-            
-                                        break
-                        
-                    if history and message_count >= 3:
-                        decision_response = decision_making(history,town_person_lower)
-                        print(f"Decision response: {decision_response}")
-                        
-                        last_message = user_input.lower()
-                        # Check if message emphasizes fire danger
-                        emphasizes_danger_response = emphasize_danger_check(last_message)
-                        print(f"emphasize_danger_response: {emphasizes_danger_response}")
-                        emphasizes_value_of_life_response = emphasize_value_of_life_check(last_message)
-                        print(f"emphasize_value_of_life_response: {emphasizes_value_of_life_response}")
-                        # if emphasizes_danger == "yes":
-                        #     emphasizes_danger = True
-                        if "yes" in emphasizes_danger_response.lower():
-                            emphasizes_danger = True
-                        if "yes" in emphasizes_value_of_life_response.lower():  
-                            emphasizes_value_of_life = True
-                        # 
-                        if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","sounds good","thank",'thanks',"bye","goodbye","see you"]):
-                            ending_conversation = True
-                        # If both conditions are met, the operator is being personally persuasive
-                        is_operator_personal = emphasizes_danger or emphasizes_value_of_life
-                    
-                    # Determine conversation stage based on message count and operator interaction
-                    category = ""
-                    if message_count == 1:
-                        # Initial dismissal - Bob ignores evacuation warnings
-                        category = "greetings"
-                        # Find Bob's responses in the dialogue data
-                        context = bob_data[category]
-                        
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. If the message came from Julie, show reluctance to even acknowledge her. If the message came from the Operator, be slightly more responsive but still resistant."
-                    
-                    elif message_count ==3 :
-                        # Work-focused resistance - Bob emphasizes his work is too important
-                        category = "work_resistance"
-                        # Find Bob's responses in the dialogue data
-                        context = bob_data[category]
-                        
-                        prompt_content = f"Generate a response focusing heavily on your work being too important to leave behind. Use or adapt lines from this {category}: {context}. If the previous message tried to emphasize danger, respond with skepticism. If the previous message tried to be empathetic, still refuse but with slightly less hostility."
-                    
-                    elif message_count == 5:
-                        print(f"emphasizes_danger_response: {emphasizes_danger_response}")
-                        # Decision point - Either minimal engagement or beginning to consider evacuation
-                        # category = "decision_point" if is_operator_personal else "minimal_engagement"
-                        # print(f"Category: {category}")
-                        
-                        # # Find Bob's responses in the dialogue data
-                        # context = bob_data[category]
-                        
-                        if emphasizes_danger:
-                            category = "decision_point"
-                            context = bob_data[category]
-                            prompt_content = f"Generate a response showing that you're beginning to consider the evacuation warning. The operator has personally emphasized the danger of the fire. Choose from: {context} to show that you're starting to take the threat seriously."
-                        else:
-                            
-                            category = "minimal_engagement"
-                            context = bob_data[category]
-                            prompt_content = f"Generate a response with minimal engagement. Showing frustration at continued persuasion attempts. Use lines from this {category}: {context} that show resistance. Keep your response very brief and show you're disengaging from the conversation."
-                    
-                    elif message_count == 7:
-                        # Final resolution - Either evacuation agreement or final refusal
-                        print(f"emphasizes_value_of_life_response: {emphasizes_value_of_life_response}")
-                        print(f"emphasizes_danger_final: {emphasizes_danger_final}")
-                        if emphasizes_value_of_life or emphasizes_danger_final:
-                            category = "progression"
-                            print(f"Category: {category}")
-                            # Find Bob's responses in the dialogue data
-                            context = bob_data[category]
-                            
-                            prompt_content = f"Generate a response agreeing to evacuate. Please be flexible based on the previous message. The operator has personally convinced you that the danger is real and no work is worth risking your life. Choose from this {category}: {context} like \"Okay, I'm not stupid. Let me just grab my bag and I'll head out.\" Show that you've been convinced to prioritize your safety."
-                        else:
-                            category = "final_refusal"
-                            print(f"Category: {category}")
-                            context = bob_data[category]
-                            
-                            prompt_content = f"Generate your final response refusing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context} to emphasize that you will not leave your work behind. This is your final decision and nothing will change your mind."
-                    else:
-                        if ending_conversation:
-                            category = "closing"
-                            context = bob_data[category]
-                            prompt_content = f"Generate a response ending the conversation. Choose from this {category}: {context} to show that you're done talking."
-                            print(f"Ending conversation")
-                        else:
-                            category = "closing"
-                            context = bob_data[category]
-                            prompt_content = f"Generate a response ending the conversation. Please be flexible based on the previous message. Choose from this {category}: {context} "
-                            # category = "ending_conversation"
-                            # print(f"Category: {category}")
-                            # context = bob_data[category]
-                
-                            # prompt_content = f"Generate a response ending the conversation. Choose from this {category}: {context} to show that you're done talking."
-                
-                    # Create turn object with the selected category and prompt - fix formatting to avoid string format issues
-                    turn = {
-                        "speaker": "bob",
-                        "prompt": f"You are roleplaying as Bob, \nBob's background: {persona_data['bob']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "niki":
-                    keep_asking_questions = False
-                    mentions_fire = False
-                    ending_conversation = False
-                    if history and message_count > 2 and speaker == "Operator":
-                        last_message = user_input.lower()
-                        # Check if message emphasizes fire danger
-                        keep_asking_questions_response = keep_asking_questions_check(last_message)
-                        if "yes" in keep_asking_questions_response.lower():
-                            keep_asking_questions = True
-                        if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","sounds good","thank",'thanks',"bye","goodbye","see you"]):
-                            ending_conversation = True
-                        # ending_conversation_response = ending_conversation_check(last_message)
-                        # if "yes" in ending_conversation_response.lower():
-                        #     ending_conversation = True
-                        mentions_fire_response = mentions_fire_check(last_message)
-                        if "yes" in mentions_fire_response.lower():
-                            mentions_fire = True
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = niki_data[category]
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. If the message came from Julie, show reluctance to even acknowledge her. If the message came from the Operator, be slightly more responsive but shows uncertainty and unware of the danger."
-                    elif message_count == 3:
-                        if mentions_fire:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a response acknowledging the danger and agreeing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-            
-                        else:
-                            category = "response_to_operator_greetings"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a response to the operator's greeting or answer the operator's question. Use or adapt lines from this {category}:{context}. If the message came from Julie, show reluctance to even acknowledge her. If the message came from the Operator, be slightly more responsive but try to confirm the danger."
-                    elif message_count == 5:
-                        print(f"mentions_fire_response: {mentions_fire_response}")
-                        if mentions_fire:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a final response acknowledging the danger and agreeing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-                        elif ending_conversation:
-                            category = "closing"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a final response to the operator or julie that agrees to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-                        elif keep_asking_questions:
-                            category = "observation"
-                            context = niki_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = niki_data[category]
-                        prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 7:
-                        if mentions_fire:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your response acknowledging the danger and agreeing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-                        elif keep_asking_questions:
-                            print(f"keep_asking_questions_response: {keep_asking_questions_response}")
-                            category = "observation_2"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your response to answer the operator's or julie's question. Please be flexible based on the previous message. Choose from this {category}: {context} "
-                        elif ending_conversation:
-                            category = "closing"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your response ending the conversation. Please be flexible based on the previous message. Choose from this {category}: {context} "
-                        else:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your final response finally agreeing to evacuate. Choose from this {category}: {context} "
-
-                    else:
-                        if ending_conversation:
-                            category = "closing"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your response ending the conversation. Choose from this {category}: {context} "
-
-                        else:
-                            category = "progression"
-                            context = niki_data[category]
-                            prompt_content = f"Generate your final response finally agreeing to evacuate. Choose from this {category}: {context} "
-                    turn = {
-                        "speaker": "niki",
-                        "prompt": f"You are roleplaying as Niki, \nNiki's background: {persona_data['niki']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "lindsay":
-                    mentions_children = False
-                    mentions_parents = False
-                    ending_conversation = False
-                    mentions_fire = False
-                    mentions_fire_final=False
-                    if history and message_count >= 3:
-                        for line in history.split('\n'):
-                            if "yes" in mentions_fire_check(line).lower():
-                                mentions_fire_final = True
-                                break
-                    if history and message_count > 0 and speaker == "Operator":
-                        last_message = user_input.lower()
-                        ask_about_children_response = ask_about_children_check(last_message)
-                        if "yes" in ask_about_children_response.lower():
-                            mentions_children = True
-                        ask_about_parents_response = ask_about_parents_check(last_message)
-                        if "yes" in ask_about_parents_response.lower():
-                            mentions_parents = True
-                        if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","sounds good","thank",'thanks',"bye","goodbye","see you"]):
-                            ending_conversation = True
-                        mentions_fire_response = mentions_fire_check(last_message)
-                        if "yes" in mentions_fire_response.lower():
-                            mentions_fire = True
-                            mentions_fire_final = True
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = lindsay_data[category]
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 3:
-                        if mentions_fire:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response acknowledging the danger and agreeing to evacuate. Please be flexible based on the previous message. Choose from this {category}: {context}"
-                            mentions_fire_final = True
-                        else:
-                            category = "response_to_operator_greetings"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to the operator's greeting or answer the operator's question. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 5:
-                        
-                        if mentions_children:
-                            category = "children"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question about the children. Use or adapt lines from this {category}:{context}. "
-                        elif mentions_parents:
-                            category = "parents"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question about the parents. Use or adapt lines from this {category}:{context}. "
-                        elif mentions_fire or mentions_fire_final:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                        elif ending_conversation:
-                            category = "closing"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-            
-                        else:
-                            category = "observations"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question about the fire. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 7:
-                        if mentions_children:
-                            category = "children"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question. Use or adapt lines from this {category}:{context}. "   
-                        elif mentions_parents:
-                            category = "parents"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response to answer the operator's or julie's question. Use or adapt lines from this {category}:{context}. "
-                        elif mentions_fire or mentions_fire_final:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a final response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                        elif ending_conversation:
-                            category = "closing"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    else:
-                        if ending_conversation:
-                            category = "closing"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = lindsay_data[category]
-                            prompt_content = f"Generate your final response finally agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    turn = {
-                        "speaker": "lindsay",
-                        "prompt": f"You are roleplaying as Lindsay, \nLindsay's background: {persona_data['lindsay']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "ross":
-                    ending_conversation = False
-                    if history and message_count > 5 and speaker == "Operator":
-                        last_message = user_input.lower()
-                        if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","sounds good","thank",'thanks',"bye","goodbye","see you"]):
-                            ending_conversation = True
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = ross_data[category]
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 3:
-                        category = "response_to_operator_greetings"
-                        context = ross_data[category]
-                        prompt_content = f"Generate a response to the operator's greeting or answer the operator's question. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 5:
-                        category = "progression"
-                        context = ross_data[category]
-                        prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 7:
-                        if ending_conversation:
-                            category = "closing"
-                            context = ross_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = ross_data[category]
-                            prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    else:
-                        if ending_conversation:
-                            category = "closing"
-                            context = ross_data[category]
-                            prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "progression"
-                            context = ross_data[category]
-                            prompt_content = f"Generate a final response finally agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    turn = {
-                        "speaker": "ross",
-                        "prompt": f"You are roleplaying as Ross, \nRoss's background: {persona_data['ross']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
-                elif town_person_lower == "michelle":
-                    final_engagement=False
-                    engagement=False
-                    if history:
-                        for line in history.split('\n'):
-                            if "yes" in engagement_check(line).lower():
-                                final_engagement = True
-                                break
-                    if history and message_count > 0 and speaker == "Operator":
-                        last_message = user_input.lower()
-                        engagement_response = engagement_check(last_message)
-                        if "yes" in engagement_response.lower():
-                            engagement = True
-                            
-                    ending_conversation = False
-                    if any(keyword in last_message for keyword in ["fine", "alright", "sure", "ok","good","thank",'thanks',"bye","goodbye","see you"]):
-                        ending_conversation = True
-                    
-                    category = ""
-                    if message_count == 1:
-                        category = "greetings"
-                        context = michelle_data[category]
-                        prompt_content = f"Generate an initial response to the operator's or julie's greeting. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 3:
-                        category = "response_to_operator_greetings"
-                        context = michelle_data[category]
-                        prompt_content = f"Generate a response to ask the operator if he would like to leave in the situation. Refer to lines from this {category}:{context}."
-                    elif message_count == 5:
-                        print(f'engagement_response: {engagement_response}')
-                        if engagement or final_engagement:
-                            category = "progression"
-                            context = michelle_data[category]
-                            prompt_content = f"Generate a response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "refuse_assistance"
-                            context = michelle_data[category]
-                            prompt_content = f"Generate a response refusing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    elif message_count == 7:
-                        if ending_conversation or final_engagement:
-                            category = "closing"
-                            context = michelle_data[category]
-                            prompt_content = f"Generate a final response agreeing to evacuate. Use or adapt lines from this {category}:{context}. "
-                        else:
-                            category = "refuse_assistance"
-                            context = michelle_data[category]
-                            prompt_content = f"Generate a final response refusing to evacuate. Use or adapt lines from this {category}:{context}. "
-                    else:
-                        category = "closing"
-                        context = michelle_data[category]
-                        prompt_content = f"Generate a final response to operator or julie. Use or adapt lines from this {category}:{context}. "
-                    
-                    turn = {
-                        "speaker": "michelle",
-                        "prompt": f"You are roleplaying as Michelle, \nMichelle's background: {persona_data['michelle']}\nPrevious conversation:\n{history}\n{prompt_content}\n please generate a response based on the last message and keep your response natural and brief. Only generate utterances, no system messages.",
-                        "category": category
-                    }
+                # Let the character's policy run the checks its stage reads and
+                # pick the reply category and prompt
+                policy = get_policy(town_person_lower)
+                signals = evaluate_signals(
+                    policy,
+                    history=history,
+                    user_input=user_input,
+                    speaker=speaker,
+                    message_count=message_count,
+                    name=town_person_lower,
+                    classify=classify_utterance
+                )
+                print(f"Policy signals: {signals}")
+                turn = policy.build_turn(
+                    town_person_lower,
+                    persona_data[town_person_lower],
+                    history,
+                    message_count,
+                    signals,
+                    lambda category: examples(town_person_lower, category)
+                )
                         
                 try:
                     # Generate town person's response
@@ -800,19 +344,7 @@ async def chat(request: Request):
                         retrieved_info["full_prompt"] = full_prompt
                         print(f"Added full_prompt to retrieved_info for {town_person_lower}")
                         
-                        # Make sure speaker is set correctly
-                        if town_person_lower == "niki":
-                            retrieved_info["speaker"] = "niki"
-                            print(f"Set Niki's speaker in retrieved_info: {retrieved_info['speaker']}")
-                        elif town_person_lower == "lindsay":
-                            retrieved_info["speaker"] = "lindsay"
-                            print(f"Set Lindsay's speaker in retrieved_info: {retrieved_info['speaker']}")
-                        elif town_person_lower == "ross":
-                            retrieved_info["speaker"] = "ross"
-                            print(f"Set Ross's speaker in retrieved_info: {retrieved_info['speaker']}")
-                        elif town_person_lower == "michelle":
-                            retrieved_info["speaker"] = "michelle"
-                            print(f"Set Michelle's speaker in retrieved_info: {retrieved_info['speaker']}")
+                        retrieved_info["speaker"] = town_person_lower
                     else:
                         # If retrieved_info is not a dict, create a new one
                         retrieved_info = {
@@ -0,0 +1,248 @@
+"""Durable storage for conversation sessions.
+
+``ConversationManager`` keeps recent turns in memory; a session store makes
+them survive restarts and lets several uvicorn workers share sessions. The
+SQLite store runs in WAL mode and appends turns from a background writer
+thread in batched transactions, so a chat turn never waits on the disk.
+
+On startup the manager replays the sessions that were active within the
+idle TTL. Sessions evicted from memory are loaded again when next read, and
+with A2I2_SESSION_REFRESH_INTERVAL set (several workers sharing the
+database), sessions are re-checked against it at most that often.
+
+Configuration (environment variables):
+    A2I2_SESSION_STORE           "memory" (default, no persistence) or "sqlite"
+    A2I2_SESSION_DB              SQLite database path (default sessions.db)
+    A2I2_SESSION_FLUSH_INTERVAL  max seconds a write waits to be batched (default 0.05)
+    A2I2_SESSION_BATCH_SIZE      max writes per transaction (default 256)
+    A2I2_SESSION_REFRESH_INTERVAL  seconds between checks for turns written by other workers (default 0, single worker)
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from log_config import get_logger
+
+logger = get_logger("session_store")
+
+SESSION_STORE = os.getenv("A2I2_SESSION_STORE", "memory").lower()
+SESSION_DB = os.getenv("A2I2_SESSION_DB", "sessions.db")
+SESSION_FLUSH_INTERVAL = float(os.getenv("A2I2_SESSION_FLUSH_INTERVAL", "0.05"))
+SESSION_BATCH_SIZE = int(os.getenv("A2I2_SESSION_BATCH_SIZE", "256"))
+
+# (speaker, content, timestamp)
+StoredTurn = Tuple[str, str, float]
+
+
+class SessionStore(object, metaclass=ABCMeta):
+    """Append-only log of conversation turns, grouped by session."""
+
+    @abstractmethod
+    def append(self, session_id: str, speaker: str, content: str, timestamp: float):
+        """Queue a turn for writing."""
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Queue the removal of a session."""
+        pass
+
+    @abstractmethod
+    def load(self, session_id: str, limit: int) -> Tuple[int, List[StoredTurn]]:
+        """Return (total turns ever stored, last ``limit`` turns oldest first)."""
+        pass
+
+    @abstractmethod
+    def total(self, session_id: str) -> int:
+        """Number of turns ever stored for a session (0 if unknown)."""
+        pass
+
+    @abstractmethod
+    def recent_sessions(self, since: float, limit: int) -> List[str]:
+        """Sessions updated after ``since``, most recently updated first."""
+        pass
+
+    @abstractmethod
+    def compact(self, since: float, keep_turns: int):
+        """Drop sessions idle since before ``since`` and turns beyond the last ``keep_turns``."""
+        pass
+
+    def flush(self):
+        """Wait until queued writes are on disk."""
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session store backed by a SQLite database in WAL mode."""
+
+    def __init__(self, path: str = SESSION_DB, flush_interval: float = SESSION_FLUSH_INTERVAL,
+                 batch_size: int = SESSION_BATCH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: "queue.Queue" = queue.Queue()
+        # Queued but uncommitted writes per session, so load() only waits
+        # for the writer when the session has some
+        self._pending: Dict[str, int] = {}
+        self._pending_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._reader = self._connect()
+        self._reader.executescript("""
+            CREATE TABLE IF NOT EXISTS turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                speaker TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS turns_by_session ON turns(session_id, id);
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                total INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_by_update ON sessions(updated_at);
+        """)
+        self._writer = threading.Thread(target=self._write_loop, name="session-store-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _queue_write(self, op: str, session_id: str, arg):
+        with self._pending_lock:
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        self._queue.put((op, arg))
+
+    def _written(self, ops):
+        with self._pending_lock:
+            for op, arg in ops:
+                if op in ("append", "delete"):
+                    session_id = arg[0] if op == "append" else arg
+                    left = self._pending.get(session_id, 1) - 1
+                    if left > 0:
+                        self._pending[session_id] = left
+                    else:
+                        self._pending.pop(session_id, None)
+
+    def append(self, session_id, speaker, content, timestamp):
+        self._queue_write("append", session_id, (session_id, speaker, content, timestamp))
+
+    def delete(self, session_id):
+        self._queue_write("delete", session_id, session_id)
+
+    def flush(self):
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        done.wait()
+
+    def close(self):
+        self.flush()
+        self._queue.put(("close", None))
+        self._writer.join()
+        with self._read_lock:
+            self._reader.close()
+
+    def _write_loop(self):
+        conn = self._connect()
+        running = True
+        while running:
+            ops = [self._queue.get()]
+            deadline = time.time() + self.flush_interval
+            while len(ops) < self.batch_size and ops[-1][0] == "append":
+                try:
+                    ops.append(self._queue.get(timeout=max(0.0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(conn, ops)
+            except sqlite3.Error as e:
+                logger.error(f"Session store write failed ({len(ops)} ops): {e}")
+            self._written(ops)
+            for op, arg in ops:
+                if op == "flush":
+                    arg.set()
+                elif op == "close":
+                    running = False
+        conn.close()
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, ops):
+        conn.execute("BEGIN")
+        try:
+            for op, arg in ops:
+                if op == "append":
+                    session_id, speaker, content, timestamp = arg
+                    conn.execute("INSERT INTO turns (session_id, speaker, content, timestamp) VALUES (?, ?, ?, ?)",
+                                 (session_id, speaker, content, timestamp))
+                    conn.execute("INSERT INTO sessions (session_id, total, updated_at) VALUES (?, 1, ?) "
+                                 "ON CONFLICT(session_id) DO UPDATE SET total = total + 1, updated_at = excluded.updated_at",
+                                 (session_id, timestamp))
+                elif op == "delete":
+                    conn.execute("DELETE FROM turns WHERE session_id = ?", (arg,))
+                    conn.execute("DELETE FROM sessions WHERE session_id = ?", (arg,))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load(self, session_id, limit):
+        with self._pending_lock:
+            pending = session_id in self._pending
+        if pending:
+            self.flush()
+        with self._read_lock:
+            row = self._reader.execute("SELECT total FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return 0, []
+            turns = self._reader.execute(
+                "SELECT speaker, content, timestamp FROM turns WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit)).fetchall()
+        return row[0], turns[::-1]
+
+    def total(self, session_id):
+        with self._read_lock:
+            row = self._reader.execute("SELECT total FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else 0
+
+    def recent_sessions(self, since, limit):
+        self.flush()
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT session_id FROM sessions WHERE updated_at >= ? ORDER BY updated_at DESC LIMIT ?",
+                (since, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def compact(self, since, keep_turns):
+        self.flush()
+        with self._read_lock:
+            conn = self._reader
+            conn.execute("BEGIN")
+            conn.execute("DELETE FROM turns WHERE session_id IN (SELECT session_id FROM sessions WHERE updated_at < ?)",
+                         (since,))
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (since,))
+            conn.execute("DELETE FROM turns WHERE id IN (SELECT id FROM (SELECT id, ROW_NUMBER() OVER "
+                         "(PARTITION BY session_id ORDER BY id DESC) AS position FROM turns) WHERE position > ?)",
+                         (keep_turns,))
+            conn.execute("COMMIT")
+
+
+def open_session_store() -> Optional[SessionStore]:
+    """Return the configured session store, or None to keep sessions in memory only."""
+    if SESSION_STORE == "memory":
+        return None
+    if SESSION_STORE == "sqlite":
+        logger.info(f"Using SQLite session store at {SESSION_DB}")
+        return SQLiteSessionStore()
+    raise ValueError(f"Unknown session store: {SESSION_STORE}")
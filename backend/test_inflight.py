@@ -0,0 +1,61 @@
+"""Shared in-flight LLM calls must survive their first caller being cancelled.
+
+    A2I2_LLM_BACKEND=fake python -m unittest test_inflight
+"""
+import asyncio
+import os
+import unittest
+import uuid
+from unittest import mock
+
+os.environ.setdefault("A2I2_LLM_BACKEND", "fake")
+
+import ollama_0220_openai as engine  # noqa: E402
+from generation_cache import GenerationCache  # noqa: E402
+
+
+class CancelledLeaderTest(unittest.TestCase):
+
+    def run_leader_cancelled(self, call, fake_target, fake_reply):
+        """Start ``call`` twice, cancel the first caller, and return what the second gets."""
+        release = asyncio.Event()
+        calls = []
+
+        async def slow_call(*args, **kwargs):
+            calls.append(args)
+            await release.wait()
+            return fake_reply
+
+        async def scenario():
+            with mock.patch.object(engine, fake_target, slow_call):
+                leader = asyncio.ensure_future(call())
+                await asyncio.sleep(0)
+                follower = asyncio.ensure_future(call())
+                await asyncio.sleep(0)
+                leader.cancel()
+                await asyncio.sleep(0)
+                release.set()
+                return await asyncio.wait_for(follower, timeout=2)
+
+        result = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        return result
+
+    def test_classification(self):
+        text = f"Hello, this is the fire department {uuid.uuid4()}"
+        result = self.run_leader_cancelled(lambda: engine.classify_utterance_async(text), "send_to_openai_async",
+                                           '{"mentions_fire": "yes"}')
+        self.assertEqual(result["mentions_fire"], "yes")
+        self.assertEqual(engine._inflight_classifications, {})
+
+    def test_generation(self):
+        prompt = f"Greet the trainee {uuid.uuid4()}"
+        with mock.patch.object(engine, "generation_cache", GenerationCache(mode="exact")):
+            result = self.run_leader_cancelled(lambda: engine.send_to_openai_async(prompt), "_complete_async",
+                                               "Hello there.")
+        self.assertEqual(result, "Hello there.")
+        self.assertEqual(engine._inflight_generations, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
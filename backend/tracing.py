@@ -0,0 +1,259 @@
+"""Lightweight tracing for the chat turn pipeline.
+
+Spans follow the OpenTelemetry data model: a trace id shared by every span
+of a request, a span id, the parent span id, start/end times in Unix
+nanoseconds, attributes and a status. Finished traces are written as JSON
+lines (one span per line, OTLP JSON field names) so slow turns can be
+inspected with ``jq`` or loaded into a tracing backend.
+
+Export is tail-based: the spans of a trace are kept in memory until its root
+span ends, then the trace is either dropped or handed to a background thread
+that appends it to the trace file, so the request path never waits on disk.
+A trace is exported if it is sampled, or if its root span took at least the
+slow threshold.
+
+The current span is carried in a context variable, so spans opened in tasks
+spawned by a request (e.g. the concurrent checks) join the request's trace.
+When tracing is disabled ``span()`` returns a shared no-op span.
+
+Configuration (environment variables):
+    A2I2_TRACE          1 to enable tracing (default 0)
+    A2I2_TRACE_FILE     JSON lines file spans are appended to (default traces.jsonl)
+    A2I2_TRACE_SAMPLE   fraction of traces exported regardless of duration (default 1.0)
+    A2I2_TRACE_SLOW_MS  also export every trace whose root span took at least this long (default 0, off)
+"""
+import asyncio
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from log_config import get_logger
+
+logger = get_logger("tracing")
+
+TRACE_ENABLED = os.getenv("A2I2_TRACE", "0") == "1"
+TRACE_FILE = os.getenv("A2I2_TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE = float(os.getenv("A2I2_TRACE_SAMPLE", "1.0"))
+TRACE_SLOW_MS = float(os.getenv("A2I2_TRACE_SLOW_MS", "0"))
+
+# Spans kept per trace before further spans are dropped
+MAX_SPANS_PER_TRACE = 1000
+
+
+class Span:
+    """One timed operation within a trace."""
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "attributes",
+                 "start_time", "end_time", "status", "status_message")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self.status = "STATUS_CODE_UNSET"
+        self.status_message = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_exception(self, error: BaseException):
+        self.status = "STATUS_CODE_ERROR"
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_time or time.time_ns()) - self.start_time) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        status = {"code": self.status}
+        if self.status_message:
+            status["message"] = self.status_message
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id or "",
+            "name": self.name,
+            "kind": "SPAN_KIND_INTERNAL",
+            "startTimeUnixNano": self.start_time,
+            "endTimeUnixNano": self.end_time,
+            "durationMs": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "status": status,
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is disabled."""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def record_exception(self, error):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class FileSpanExporter:
+    """Appends finished traces to a JSON lines file from a background thread."""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, spans: List[Span]):
+        self._queue.put([span.to_dict() for span in spans])
+
+    def flush(self):
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            try:
+                with open(self.path, "a") as f:
+                    for span in item:
+                        f.write(json.dumps(span, default=str) + "\n")
+            except OSError as e:
+                logger.error(f"Could not write traces to {self.path}: {e}")
+
+
+class Tracer:
+    """Creates spans and exports finished traces that are sampled or slow."""
+
+    def __init__(self, enabled: bool = TRACE_ENABLED, sample: float = TRACE_SAMPLE,
+                 slow_ms: float = TRACE_SLOW_MS, exporter: Optional[FileSpanExporter] = None):
+        self.enabled = enabled
+        self.sample = sample
+        self.slow_ms = slow_ms
+        self._exporter = exporter
+        self._traces: Dict[str, List[Span]] = {}
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+
+    @property
+    def exporter(self) -> FileSpanExporter:
+        if self._exporter is None:
+            self._exporter = FileSpanExporter()
+        return self._exporter
+
+    def start(self, name: str, attributes: Dict[str, Any]) -> Span:
+        parent = _current_span.get()
+        if parent is None:
+            span = Span(name, "%032x" % random.getrandbits(128), None, attributes)
+            with self._lock:
+                self._traces[span.trace_id] = []
+        else:
+            span = Span(name, parent.trace_id, parent.span_id, attributes)
+        return span
+
+    def end(self, span: Span):
+        span.end_time = time.time_ns()
+        with self._lock:
+            spans = self._traces.get(span.trace_id)
+            if spans is None:
+                # The root already ended (e.g. a cancelled background task)
+                return
+            if len(spans) < MAX_SPANS_PER_TRACE:
+                spans.append(span)
+            if span.parent_span_id is not None:
+                return
+            del self._traces[span.trace_id]
+        export = random.random() < self.sample or (self.slow_ms > 0 and span.duration_ms >= self.slow_ms)
+        with self._lock:
+            if export:
+                self.exported += 1
+            else:
+                self.dropped += 1
+        if export:
+            self.exporter.export(spans)
+
+    def flush(self):
+        if self._exporter is not None:
+            self._exporter.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            open_traces = len(self._traces)
+        return {
+            "enabled": self.enabled,
+            "sample": self.sample,
+            "slow_ms": self.slow_ms,
+            "file": self._exporter.path if self._exporter is not None else TRACE_FILE,
+            "exported_traces": self.exported,
+            "dropped_traces": self.dropped,
+            "open_traces": open_traces,
+        }
+
+
+tracer = Tracer()
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("a2i2_current_span", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as a span, a child of the current span if any."""
+    if not tracer.enabled:
+        yield _NOOP_SPAN
+        return
+    current = tracer.start(name, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        tracer.end(current)
+
+
+def current_trace_id() -> Optional[str]:
+    """Trace id of the current span, e.g. to put in a log line or response."""
+    current = _current_span.get()
+    return current.trace_id if current is not None else None
+
+
+def traced(name: Optional[str] = None):
+    """Decorator running each call of a (sync or async) function in a span."""
+    def decorate(func):
+        span_name = name or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -26,6 +26,15 @@ let messages = [];
 let lineCounter = 1;
 let currentSpeaker = 'Operator'; // Default speaker
 let isGenerating = false; // Flag to prevent multiple simultaneous Julie responses
+let sessionId = newSessionId(); // Identifies this conversation to the backend
+
+// Create a random conversation ID for the backend session
+function newSessionId() {
+    if (window.crypto && window.crypto.randomUUID) {
+        return window.crypto.randomUUID();
+    }
+    return Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
 
 // Add interaction mode toggle
 const interactionModeContainer = document.createElement('div');
@@ -147,12 +156,14 @@ async function generateJulieResponse() {
                 userInput: "",
                 mode: "interactive",
                 speaker: "Julie",
-                autoJulie: true
+                autoJulie: true,
+                sessionId: sessionId
             })
         });
 
         const data = await response.json();
         console.log("Response from auto Julie API:", data);
+        if (data.session_id) sessionId = data.session_id;
         
         // Remove loading indicator
         const loadingElement = document.getElementById('julieStatus');
@@ -358,6 +369,69 @@ function addMessageWithDelay(text, sender, delay, retrievedInfo) {
     });
 }
 
+// Post a chat turn to /chat/stream, showing the reply's tokens as they arrive.
+// Resolves with the final "done" (or "error") event, which has the same
+// fields as a /chat response.
+async function fetchChatStream(body) {
+    const response = await fetch(`${API_BASE_URL}/chat/stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(body)
+    });
+    
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let streamedText = '';
+    let streamingDiv = null;
+    let result = null;
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let eventName = 'message';
+            let payload = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) payload += line.slice(5).trim();
+            });
+            const eventData = payload ? JSON.parse(payload) : {};
+            
+            if (eventName === 'token') {
+                // Show the partial reply in a placeholder message
+                if (!streamingDiv) {
+                    streamingDiv = document.createElement('div');
+                    streamingDiv.className = `message ${selectedPerson.toLowerCase()} streaming`;
+                    chatWindow.appendChild(streamingDiv);
+                }
+                streamedText += eventData.text;
+                streamingDiv.innerHTML = `<strong>${selectedPerson}:</strong> `;
+                streamingDiv.appendChild(document.createTextNode(streamedText));
+                chatWindow.scrollTop = chatWindow.scrollHeight;
+            } else if (eventName === 'done' || eventName === 'error') {
+                result = eventData;
+            }
+        }
+    }
+    
+    // The final message is added with the cleaned reply and its details
+    if (streamingDiv) streamingDiv.remove();
+    return result;
+}
+
 // Function to handle sending messages in interactive mode
 async function sendMessage() {
     const userInput = chatInput.value.trim();
@@ -384,25 +458,16 @@ async function sendMessage() {
     let data;
     try {
         console.log(`Sending message as ${speaker}: ${userInput}`);
-        const response = await fetch(`${API_BASE_URL}/chat`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                townPerson: selectedPerson,
-                userInput: userInput,
-                mode: 'interactive',
-                speaker: speaker  // Pass the speaker (Julie or Operator)
-            })
+        // Stream the reply so it shows up as it is generated
+        data = await fetchChatStream({
+            townPerson: selectedPerson,
+            userInput: userInput,
+            mode: 'interactive',
+            speaker: speaker,  // Pass the speaker (Julie or Operator)
+            sessionId: sessionId
         });
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        
-        data = await response.json();
         console.log('Received response data:', data);
+        if (data && data.session_id) sessionId = data.session_id;
         
         // Check if data is null or undefined before accessing properties
         if (!data) {
@@ -653,10 +718,12 @@ async function restartConversation() {
     speakerToggleBtn.textContent = `Switch to ${selectedPerson}`;
     chatInput.placeholder = 'Type Operator\'s message...';
     
-    // Clear backend conversation history (if needed)
+    // Clear backend conversation history and start a new session
     try {
-        // You can add an API call here to clear backend session if implemented
-        // For now, the backend will handle new session on next message
+        if (sessionId) {
+            fetch(`${API_BASE_URL}/session/${encodeURIComponent(sessionId)}`, { method: 'DELETE' });
+        }
+        sessionId = newSessionId();
         console.log('Frontend state cleared');
     } catch (error) {
         console.error('Error clearing backend session:', error);